@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Benchmark of feeding mini-batches by `feed_dict` and by `InputQueue`.
+
+This script measures the time of each training step of a tiny model,
+when the mini-batches are fed by `feed_dict` at every `session.run`,
+and when they are prefetched into the TensorFlow runtime by `InputQueue`.
+Since the model is tiny, the step time is dominated by the overhead of
+delivering the data.
+"""
+import argparse
+import time
+
+import numpy as np
+import tensorflow as tf
+
+from tfsnippet.scaffold import train_loop
+from tfsnippet.utils import InputQueue, MiniBatchIterator
+
+
+def build_train_op(x):
+    w = tf.get_variable('w', shape=[x.get_shape()[1].value, 1],
+                        initializer=tf.zeros_initializer())
+    loss = tf.reduce_mean(tf.matmul(x, w))
+    return tf.train.GradientDescentOptimizer(0.01).minimize(loss)
+
+
+def run_feed_dict(session, data, batch_size, max_epoch):
+    with tf.variable_scope('feed_dict'):
+        input_x = tf.placeholder(tf.float32, shape=[None, data.shape[1]])
+        train_op = build_train_op(input_x)
+    session.run(tf.global_variables_initializer())
+    it = MiniBatchIterator([data], batch_size=batch_size, shuffle=True)
+    with train_loop([], max_epoch=max_epoch) as loop:
+        start_time = time.time()
+        for _ in loop.iter_epochs():
+            for _, (x,) in loop.iter_steps(it):
+                session.run(train_op, feed_dict={input_x: x})
+        return (time.time() - start_time) / loop.step
+
+
+def run_input_queue(session, data, batch_size, max_epoch):
+    with tf.variable_scope('input_queue'):
+        q = InputQueue([tf.float32], shapes=[[None, data.shape[1]]],
+                       capacity=8)
+        train_op = build_train_op(q.inputs[0])
+    session.run(tf.global_variables_initializer())
+    it = MiniBatchIterator([data], batch_size=batch_size, shuffle=True,
+                           num_buffers=2)
+    with train_loop([], max_epoch=max_epoch) as loop:
+        start_time = time.time()
+        for _ in loop.iter_epochs():
+            for _ in loop.iter_steps(q.feed(it)):
+                session.run(train_op)
+        return (time.time() - start_time) / loop.step
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--count', type=int, default=65536,
+                        help='number of data items')
+    parser.add_argument('--dim', type=int, default=784,
+                        help='dimension of each data item')
+    parser.add_argument('--batch-sizes', type=int, nargs='+',
+                        default=[16, 4096])
+    parser.add_argument('--max-epoch', type=int, default=3)
+    args = parser.parse_args()
+
+    data = np.random.random([args.count, args.dim]).astype(np.float32)
+    print('%-12s %16s %16s' % ('batch size', 'feed_dict', 'InputQueue'))
+    for batch_size in args.batch_sizes:
+        with tf.Graph().as_default(), tf.Session() as session:
+            t1 = run_feed_dict(session, data, batch_size, args.max_epoch)
+            t2 = run_input_queue(session, data, batch_size, args.max_epoch)
+        print('%-12d %13.1f us %13.1f us' % (batch_size, t1 * 1e6, t2 * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Benchmark of iterating through a memory-mapped dataset.
+
+This script compares the throughput of fully random access and of
+block-shuffled access, when iterating through a `MemmapDataset`.
+For meaningful results, the dataset should be larger than the free
+physical memory, or the page cache should be dropped before each run
+(e.g., ``echo 3 > /proc/sys/vm/drop_caches`` as root).
+"""
+import argparse
+import os
+import time
+
+import numpy as np
+
+from tfsnippet.utils import MemmapDataset, MiniBatchIterator, TemporaryDirectory
+
+
+def make_dataset(path, count, dim):
+    array = np.lib.format.open_memmap(
+        path, mode='w+', dtype=np.float32, shape=(count, dim))
+    for s in range(0, count, 65536):
+        e = min(s + 65536, count)
+        array[s: e] = np.random.random((e - s, dim))
+    array.flush()
+    del array
+
+
+def run(name, iterator, item_bytes):
+    start_time = time.time()
+    count = 0
+    for batch, in iterator:
+        count += len(batch)
+    duration = time.time() - start_time
+    print('%-16s %10.0f items/sec %10.1f MB/sec' % (
+        name, count / duration, count * item_bytes / duration / 1048576.))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--count', type=int, default=2000000,
+                        help='number of data items')
+    parser.add_argument('--dim', type=int, default=128,
+                        help='dimension of each data item')
+    parser.add_argument('--batch-size', type=int, default=256)
+    parser.add_argument('--block-size', type=int, default=16384)
+    parser.add_argument('--data-file', default=None,
+                        help='path of the ".npy" file; if not specified, '
+                             'a temporary file will be used')
+    args = parser.parse_args()
+
+    with TemporaryDirectory() as tempdir:
+        path = args.data_file or os.path.join(tempdir, 'data.npy')
+        if not os.path.exists(path):
+            make_dataset(path, args.count, args.dim)
+        dataset = MemmapDataset.from_npy_files([path])
+        item_bytes = dataset.arrays[0].strides[0]
+        print('Dataset: %d items, %.1f MB' % (
+            dataset.data_count, dataset.data_count * item_bytes / 1048576.))
+
+        run('random access',
+            MiniBatchIterator(dataset.arrays, batch_size=args.batch_size,
+                              shuffle=True),
+            item_bytes)
+        run('block shuffled',
+            dataset.iterator(batch_size=args.batch_size,
+                             block_size=args.block_size),
+            item_bytes)
+        run('sequential',
+            dataset.iterator(batch_size=args.batch_size, shuffle=False),
+            item_bytes)
+
+
+if __name__ == '__main__':
+    main()
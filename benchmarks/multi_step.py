@@ -0,0 +1,89 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Benchmark of running K training steps per `session.run`.
+
+This script measures the time of each training step of a small model,
+when each `session.run` runs one step, and when it runs K steps by
+`multi_step_train_op`.  Since the model is small, the step time with
+K=1 is dominated by the overhead of `session.run` and the training loop.
+"""
+import argparse
+import time
+
+import numpy as np
+import tensorflow as tf
+
+from tfsnippet.scaffold import train_loop, multi_step_train_op
+from tfsnippet.utils import MiniBatchIterator
+
+
+def build_variables(dim, hidden_units):
+    # the variables must be created outside of the while loop
+    return [
+        tf.get_variable('w1', shape=[dim, hidden_units]),
+        tf.get_variable('b1', shape=[hidden_units],
+                        initializer=tf.zeros_initializer()),
+        tf.get_variable('w2', shape=[hidden_units, dim]),
+        tf.get_variable('b2', shape=[dim],
+                        initializer=tf.zeros_initializer()),
+    ]
+
+
+def build_step(x, variables):
+    w1, b1, w2, b2 = variables
+    h = tf.nn.relu(tf.matmul(x, w1) + b1)
+    y = tf.matmul(h, w2) + b2
+    loss = tf.reduce_mean(tf.square(y - x))
+    return tf.train.GradientDescentOptimizer(0.01).minimize(loss), loss
+
+
+def run(session, data, batch_size, max_epoch, hidden_units, steps_per_run):
+    dim = data.shape[1]
+    with tf.variable_scope('k%d' % steps_per_run):
+        variables = build_variables(dim, hidden_units)
+        input_x = tf.placeholder(tf.float32, shape=[None, None, dim])
+
+        def step_fn(x):
+            train_op, loss = build_step(x, variables)
+            return train_op, {'loss': loss}
+
+        train_op, metrics = multi_step_train_op(
+            step_fn, [input_x], metric_names=['loss'])
+    session.run(tf.global_variables_initializer())
+    it = MiniBatchIterator([data], batch_size=batch_size, shuffle=True,
+                           ignore_incomplete_batch=True)
+    with train_loop([], max_epoch=max_epoch) as loop:
+        start_time = time.time()
+        for _ in loop.iter_epochs():
+            for _, (x,) in loop.iter_steps(it, steps_per_run=steps_per_run):
+                loop.run(train_op, feed_dict={input_x: x}, metrics=metrics)
+        return (time.time() - start_time) / loop.step
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--count', type=int, default=16384,
+                        help='number of data items')
+    parser.add_argument('--dim', type=int, default=32,
+                        help='dimension of each data item')
+    parser.add_argument('--hidden-units', type=int, default=32)
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--steps-per-run', type=int, nargs='+',
+                        default=[1, 4, 16, 64])
+    parser.add_argument('--max-epoch', type=int, default=3)
+    args = parser.parse_args()
+
+    data = np.random.random([args.count, args.dim]).astype(np.float32)
+    print('%-8s %16s %10s' % ('K', 'step time', 'speed-up'))
+    baseline = None
+    for k in args.steps_per_run:
+        with tf.Graph().as_default(), tf.Session() as session:
+            t = run(session, data, args.batch_size, args.max_epoch,
+                    args.hidden_units, k)
+        if baseline is None:
+            baseline = t
+        print('%-8d %13.1f us %9.2fx' % (k, t * 1e6, baseline / t))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""Benchmark of drawing and re-weighting mini-batches by weights.
+
+This script measures the latency of drawing a mini-batch from a
+`WeightedMiniBatchSampler`, and of updating the weights of the drawn
+mini-batch afterwards, which should stay stable as the number of data
+items grows to tens of millions.
+"""
+import argparse
+import time
+
+import numpy as np
+
+from tfsnippet.utils import WeightedMiniBatchSampler
+
+
+def percentiles(durations):
+    return tuple(np.percentile(durations, [50, 99]) * 1e6)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--count', type=int, default=10000000,
+                        help='number of data items')
+    parser.add_argument('--batch-size', type=int, default=256)
+    parser.add_argument('--num-batches', type=int, default=2000)
+    args = parser.parse_args()
+
+    data = np.arange(args.count, dtype=np.int64)
+    weights = np.random.exponential(size=args.count)
+    start_time = time.time()
+    sampler = WeightedMiniBatchSampler(
+        [data], batch_size=args.batch_size, weights=weights,
+        num_batches=args.num_batches, return_indices=True
+    )
+    print('Built the sampler of %d items in %.3f sec' % (
+        args.count, time.time() - start_time))
+
+    sample_durations = []
+    update_durations = []
+    start_time = time.time()
+    for _, indices in sampler:
+        sample_durations.append(time.time() - start_time)
+        start_time = time.time()
+        sampler.update_weights(
+            indices, np.random.exponential(size=len(indices)))
+        update_durations.append(time.time() - start_time)
+        start_time = time.time()
+
+    print('sample: p50 %8.1f us, p99 %8.1f us' %
+          percentiles(sample_durations))
+    print('update: p50 %8.1f us, p99 %8.1f us' %
+          percentiles(update_durations))
+
+
+if __name__ == '__main__':
+    main()
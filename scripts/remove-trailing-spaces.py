@@ -30,7 +30,7 @@ def process_dir(path, relpath):
                 print('%s: %d line(s)' % (f_relpath, modify_count))
 
 
-for fname in ('scripts', 'tests', 'tfsnippet'):
+for fname in ('benchmarks', 'scripts', 'tests', 'tfsnippet'):
     process_dir(
         os.path.abspath(os.path.join(os.path.split(__file__)[0], '..', fname)),
         fname
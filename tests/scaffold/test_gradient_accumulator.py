@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+import numpy as np
+import tensorflow as tf
+
+from tfsnippet.scaffold import GradientAccumulator, Model, train_loop
+from tfsnippet.utils import (ensure_variables_initialized,
+                             get_variable_values, set_variable_values)
+from tests.helper import TestCase
+
+
+class _LinearModel(Model):
+
+    def _build(self):
+        self.input_x = tf.placeholder(tf.float32, shape=[None, 2])
+        self.input_y = tf.placeholder(tf.float32, shape=[None])
+        with tf.variable_scope('model'):
+            self.w = tf.get_variable('w', shape=[2], dtype=tf.float32,
+                                     initializer=tf.zeros_initializer())
+        self.y = tf.reduce_sum(self.input_x * self.w, axis=-1)
+        self.loss = tf.reduce_mean(tf.square(self.y - self.input_y))
+
+
+class GradientAccumulatorTestCase(TestCase):
+
+    def test_accumulate(self):
+        x = np.asarray([[1., 2.], [3., 4.], [5., 6.], [7., 8.], [9., 10.]],
+                       dtype=np.float32)
+        y = np.asarray([1., 2., 3., 4., 5.], dtype=np.float32)
+
+        with self.get_session() as session:
+            model = _LinearModel()
+            model.build()
+            grad = tf.gradients(model.loss, [model.w])[0]
+            accumulator = GradientAccumulator(
+                tf.train.GradientDescentOptimizer(0.01), model.loss,
+                model.get_param_variables(), num_micro_batches=2,
+                global_step=model.get_global_step()
+            )
+            self.assertEqual(accumulator.num_micro_batches, 2)
+            self.assertEqual(accumulator.var_list, [model.w])
+            self.assertEqual(len(accumulator.slots), 1)
+            ensure_variables_initialized()
+
+            # the applied gradient should equal the full-batch gradient
+            set_variable_values([model.w], [np.asarray([.1, .2])])
+            full_grad = session.run(
+                grad, feed_dict={model.input_x: x, model.input_y: y})
+            losses = accumulator.run(
+                [model.input_x, model.input_y], [x, y], fetches=model.loss)
+            self.assertEqual(len(losses), 2)
+            np.testing.assert_allclose(
+                get_variable_values([model.w])[0],
+                np.asarray([.1, .2]) - 0.01 * full_grad, rtol=1e-5
+            )
+            np.testing.assert_equal(session.run(accumulator.slots[0]),
+                                    [0., 0.])
+            self.assertEqual(session.run(model.get_global_step()), 1)
+
+            # test the batch smaller than `num_micro_batches`
+            self.assertEqual(
+                accumulator.run([model.input_x, model.input_y],
+                                [x[:1], y[:1]]),
+                [None]
+            )
+            self.assertEqual(session.run(model.get_global_step()), 2)
+
+            # test running with the train loop, which counts logical steps
+            with train_loop(model.get_param_variables(), max_epoch=1) as loop:
+                for _ in loop.iter_epochs():
+                    for _ in loop.iter_steps([(x, y), (x, y)]):
+                        accumulator.run([model.input_x, model.input_y],
+                                        [x, y])
+                self.assertEqual(loop.step, 2)
+            self.assertEqual(session.run(model.get_global_step()), 4)
+
+            with self.assertRaisesRegex(
+                    ValueError, 'The length of `arrays` does not match '
+                                '`placeholders`.'):
+                accumulator.run([model.input_x], [x, y])
+
+    def test_errors(self):
+        with self.get_session():
+            model = _LinearModel()
+            optimizer = tf.train.GradientDescentOptimizer(0.01)
+            model.build()
+            with self.assertRaisesRegex(
+                    ValueError, '`num_micro_batches` must be at least 1.'):
+                _ = GradientAccumulator(optimizer, model.loss,
+                                        model.get_param_variables(), 0)
+            with self.assertRaisesRegex(
+                    ValueError, '`var_list` must not be empty.'):
+                _ = GradientAccumulator(optimizer, model.loss, [], 2)
+            v = tf.get_variable('v', shape=(), dtype=tf.float32)
+            with self.assertRaisesRegex(
+                    ValueError, 'No gradient can be computed for '
+                                '`var_list`.'):
+                _ = GradientAccumulator(optimizer, model.loss, [v], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,14 +1,16 @@
 # -*- coding: utf-8 -*-
 import contextlib
+import json
 import os
+import time
 import unittest
 
 import numpy as np
 import tensorflow as tf
 
 from tfsnippet.scaffold import (get_variables_summary, MetricLogger,
-                                SummaryWriter)
-from tfsnippet.utils import TemporaryDirectory
+                                SummaryWriter, AsyncSummaryWriter)
+from tfsnippet.utils import TemporaryDirectory, LogBucketHistogram
 from tests.helper import TestCase
 
 
@@ -68,6 +70,39 @@ class MetricLoggerTestCase(TestCase):
         logger.add_metrics(metrics={'loss': 1.})
         self.assertEqual(logger.format_logs(), 'loss: 1')
 
+    def test_percentiles(self):
+        logger = MetricLogger(percentiles=True)
+        for i in range(1, 101):
+            logger.add_metrics(step_time=i * .01, loss=i)
+        logger.add_metrics(valid_time=.5)
+        self.assertEqual(sorted(logger.histograms),
+                         ['step_time', 'valid_time'])
+        self.assertEqual(logger.histograms['step_time'].count, 100)
+        self.assertRegex(
+            logger.format_logs(),
+            r'^step time: 0\.505 sec \(±0\.2887 sec, p50 0\.50\d* sec, '
+            r'p90 0\.(89|90)\d* sec, p99 0\.9[89]\d* sec, max 1 sec\); '
+            r'valid time: 0\.5 sec; loss: 50\.5 \(±28\.8661\)$'
+        )
+
+        # test restoring the state
+        logger2 = MetricLogger(percentiles=True)
+        logger2.add_metrics(other=1.)
+        logger2.set_state(json.loads(json.dumps(logger.get_state())))
+        self.assertEqual(logger2.format_logs(), logger.format_logs())
+
+        logger.clear()
+        self.assertEqual(logger.histograms, {})
+        self.assertEqual(logger.format_logs(), '')
+
+        # test no percentiles by default
+        logger = MetricLogger()
+        logger.add_metrics(step_time=.1)
+        logger.add_metrics(step_time=.2)
+        self.assertEqual(logger.histograms, {})
+        self.assertEqual(logger.format_logs(),
+                         'step time: 0.15 sec (±0.05 sec)')
+
     def test_errors(self):
         logger = MetricLogger()
         with self.assertRaisesRegex(TypeError, '`metrics` should be a dict.'):
@@ -127,5 +162,148 @@ class SummaryWriterTestCase(TestCase):
             )
 
 
+
+    def test_add_histograms(self):
+        histogram = LogBucketHistogram()
+        for v in [.1, .2, .2, .4]:
+            histogram.add(v)
+
+        with TemporaryDirectory() as tempdir:
+            with contextlib.closing(SummaryWriter(
+                    tf.summary.FileWriter(tempdir))) as sw:
+                sw.add_histograms(global_step=1, histograms={
+                    'step_time': histogram,
+                    'empty_time': LogBucketHistogram(),
+                })
+                sw.add_histograms(global_step=2)
+
+            histos = []
+            event_file_path = os.path.join(tempdir, os.listdir(tempdir)[0])
+            for e in tf.train.summary_iterator(event_file_path):
+                for v in e.summary.value:
+                    histos.append((e.step, v.tag, v.histo))
+
+        self.assertEqual(len(histos), 1)
+        step, tag, histo = histos[0]
+        self.assertEqual((step, tag), (1, 'step_time'))
+        self.assertAlmostEqual(histo.min, .1)
+        self.assertAlmostEqual(histo.max, .4)
+        self.assertEqual(histo.num, 4)
+        self.assertAlmostEqual(histo.sum, .9)
+        self.assertAlmostEqual(histo.sum_squares, .25)
+        self.assertEqual(list(histo.bucket), [1, 2, 1])
+        self.assertAlmostEqual(histo.bucket_limit[-1], .4)
+
+
+class AsyncSummaryWriterTestCase(TestCase):
+
+    def read_events(self, tempdir):
+        ret = []
+        event_file_path = os.path.join(tempdir, os.listdir(tempdir)[0])
+        for e in tf.train.summary_iterator(event_file_path):
+            if e.summary.value:
+                ret.append((e.step, {v.tag: v.simple_value
+                                     for v in e.summary.value}))
+        return ret
+
+    def test_merge_and_flush(self):
+        with TemporaryDirectory() as tempdir:
+            steps = [0]
+            sw = AsyncSummaryWriter(
+                tf.summary.FileWriter(tempdir), flush_interval=1000.,
+                max_buffer_steps=100, step_counter=lambda: steps[0])
+            with contextlib.closing(sw):
+                for step in range(1, 6):
+                    steps[0] = step
+                    sw.add_metrics(loss=step)
+                    sw.add_metrics(global_step=step, metrics={'acc': -step})
+                    sw.add_metrics(global_step=lambda: step, loss=step * 2)
+                self.assertEqual(sw.queue_depth, 5)
+                self.assertEqual(sw.written_count, 0)
+                sw.flush()
+                self.assertEqual(sw.queue_depth, 0)
+                self.assertEqual(sw.written_count, 5)
+
+                summary = tf.summary.Summary(value=[
+                    tf.summary.Summary.Value(tag='x', simple_value=1.)])
+                sw.add_summary(summary, global_step=5)
+                sw.add_metrics(global_step=5, loss=100)
+                with self.get_session():
+                    sw.add_metrics(global_step=tf.constant(6), loss=200)
+
+            self.assertEqual(sw.written_count, 8)
+            self.assertEqual(sw.dropped_count, 0)
+            self.assertEqual(self.read_events(tempdir), [
+                (1, {'loss': 2., 'acc': -1.}),
+                (2, {'loss': 4., 'acc': -2.}),
+                (3, {'loss': 6., 'acc': -3.}),
+                (4, {'loss': 8., 'acc': -4.}),
+                (5, {'loss': 10., 'acc': -5.}),
+                (5, {'x': 1.}),
+                (5, {'loss': 100.}),
+                (6, {'loss': 200.}),
+            ])
+
+    def test_background_flush(self):
+        with TemporaryDirectory() as tempdir:
+            # test flushing on the buffer size
+            sw = AsyncSummaryWriter(tf.summary.FileWriter(tempdir),
+                                    flush_interval=1000., max_buffer_steps=3)
+            with contextlib.closing(sw):
+                for step in range(3):
+                    sw.add_metrics(step, loss=step)
+                for _ in range(100):
+                    if sw.written_count == 3:
+                        break
+                    time.sleep(0.01)
+                self.assertEqual(sw.written_count, 3)
+
+            # test flushing on the time interval
+            sw = AsyncSummaryWriter(tf.summary.FileWriter(tempdir),
+                                    flush_interval=0.05, max_buffer_steps=3)
+            with contextlib.closing(sw):
+                sw.add_metrics(0, loss=0)
+                time.sleep(0.2)
+                self.assertEqual(sw.written_count, 1)
+
+    def test_drop_events(self):
+        with TemporaryDirectory() as tempdir:
+            sw = AsyncSummaryWriter(
+                tf.summary.FileWriter(tempdir), flush_interval=1000.,
+                max_buffer_steps=2, max_queue_steps=3)
+            with contextlib.closing(sw):
+                # simulate a stalled writer thread
+                with sw._write_lock:
+                    for step in range(5):
+                        sw.add_metrics(step, loss=step)
+                    self.assertEqual(sw.dropped_count, 2)
+                    self.assertEqual(sw.queue_depth, 3)
+            self.assertEqual([e[0] for e in self.read_events(tempdir)],
+                             [2, 3, 4])
+
+    def test_errors(self):
+        with TemporaryDirectory() as tempdir:
+            writer = tf.summary.FileWriter(tempdir)
+            with self.assertRaisesRegex(
+                    ValueError, '`flush_interval` must be positive.'):
+                _ = AsyncSummaryWriter(writer, flush_interval=0)
+            with self.assertRaisesRegex(
+                    ValueError, '`max_buffer_steps` must be at least 1.'):
+                _ = AsyncSummaryWriter(writer, max_buffer_steps=0)
+            with self.assertRaisesRegex(
+                    ValueError, '`max_queue_steps` must be at least '
+                                '`max_buffer_steps`.'):
+                _ = AsyncSummaryWriter(writer, max_buffer_steps=2,
+                                       max_queue_steps=1)
+
+            sw = AsyncSummaryWriter(writer)
+            with self.assertRaisesRegex(TypeError, '.* should be a dict.'):
+                sw.add_metrics(metrics=[])
+            sw.close()
+            with self.assertRaisesRegex(
+                    RuntimeError, 'The summary writer has been closed.'):
+                sw.add_metrics(1, loss=1.)
+
+
 if __name__ == '__main__':
     unittest.main()
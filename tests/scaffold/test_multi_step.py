@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+import numpy as np
+import tensorflow as tf
+
+from tfsnippet.scaffold import multi_step_train_op, stack_steps, train_loop
+from tfsnippet.utils import MiniBatchIterator
+from tests.helper import TestCase
+
+
+class MultiStepTestCase(TestCase):
+
+    def test_stack_steps(self):
+        # test stacking tuples of arrays, where the incomplete mini-batch
+        # should be yielded separately
+        it = MiniBatchIterator([np.arange(10), np.arange(10) * 2],
+                               batch_size=3)
+        stacked = list(stack_steps(it, 2))
+        self.assertEqual([len(b) for b in stacked], [2, 2, 2])
+        self.assertEqual([b[0].shape for b in stacked],
+                         [(2, 3), (1, 3), (1, 1)])
+        np.testing.assert_equal(stacked[0][0], [[0, 1, 2], [3, 4, 5]])
+        np.testing.assert_equal(stacked[0][1], [[0, 2, 4], [6, 8, 10]])
+        np.testing.assert_equal(stacked[1][0], [[6, 7, 8]])
+        np.testing.assert_equal(stacked[2][0], [[9]])
+
+        # test stacking single arrays
+        stacked = list(stack_steps(np.arange(5), 3))
+        self.assertEqual(len(stacked), 2)
+        np.testing.assert_equal(stacked[0][0], [0, 1, 2])
+        np.testing.assert_equal(stacked[1][0], [3, 4])
+
+        with self.assertRaisesRegex(
+                ValueError, '`steps_per_run` must be at least 1.'):
+            _ = list(stack_steps([], 0))
+
+    def test_multi_step_train_op(self):
+        with self.get_session() as session:
+            v = tf.get_variable('v', shape=(), dtype=tf.float32,
+                                initializer=tf.zeros_initializer())
+            input_x = tf.placeholder(tf.float32, shape=[None, None])
+
+            def step_fn(x):
+                # the metric should be computed before the update
+                value = v + tf.reduce_sum(x)
+                return tf.assign(v, value), {'v': value, 'n': tf.size(x)}
+
+            train_op, metrics = multi_step_train_op(
+                step_fn, [input_x], metric_names=['v', 'n'])
+            self.assertEqual(sorted(metrics), ['n', 'v'])
+            session.run(tf.global_variables_initializer())
+
+            x = np.asarray([[1., 2.], [3., 4.], [5., 6.]])
+            _, metric_values = session.run(
+                [train_op, metrics], feed_dict={input_x: x})
+            self.assertAlmostEqual(session.run(v), 21.)
+            self.assertAlmostEqual(metric_values['v'], (3. + 10. + 21.) / 3)
+            self.assertAlmostEqual(metric_values['n'], 2.)
+
+            # test running with the train loop
+            session.run(tf.assign(v, 0.))
+            data = np.arange(10, dtype=np.float32)
+            with train_loop([], max_epoch=1) as loop:
+                for _ in loop.iter_epochs():
+                    steps = []
+                    batch_sizes = []
+                    for step, (x,) in loop.iter_steps(
+                            MiniBatchIterator([data], batch_size=2),
+                            steps_per_run=2):
+                        steps.append(step)
+                        batch_sizes.append(loop._step_batch_size)
+                        loop.run(train_op, feed_dict={input_x: x},
+                                 metrics=metrics)
+                    self.assertEqual(steps, [2, 4, 5])
+                    self.assertEqual(batch_sizes, [4, 4, 2])
+                    self.assertEqual(loop.step, 5)
+                    epoch_metrics = loop._epoch_metrics._metrics
+                    self.assertEqual(epoch_metrics['n'].counter, 3)
+                    self.assertEqual(
+                        epoch_metrics['examples_per_sec'].counter, 3)
+            self.assertAlmostEqual(session.run(v), 45.)
+
+            # test without data generator
+            with train_loop([], max_step=5) as loop:
+                for _ in loop.iter_epochs():
+                    self.assertEqual(list(loop.iter_steps(steps_per_run=2)),
+                                     [2, 4, 5])
+
+            with self.assertRaisesRegex(
+                    ValueError, 'The metrics returned by `step_fn` do not '
+                                'match `metric_names`'):
+                _ = multi_step_train_op(step_fn, [input_x])
+            with self.assertRaisesRegex(
+                    ValueError, '`inputs` must not be empty.'):
+                _ = multi_step_train_op(step_fn, [])
+            with self.assertRaisesRegex(
+                    ValueError, '`steps_per_run` must be at least 1.'):
+                with train_loop([], max_step=5) as loop:
+                    for _ in loop.iter_epochs():
+                        _ = list(loop.iter_steps(steps_per_run=0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import unittest
+
+import tensorflow as tf
+
+from tfsnippet.scaffold import StepTracer, train_loop
+from tfsnippet.utils import TemporaryDirectory
+from tests.helper import TestCase
+
+
+class StepTracerTestCase(TestCase):
+
+    def test_should_trace(self):
+        tracer = StepTracer('./trace', every_n_steps=5)
+        self.assertEqual(tracer.every_n_steps, 5)
+        self.assertIsNone(tracer.step_range)
+        self.assertEqual(tracer.output_dir, os.path.abspath('./trace'))
+        self.assertEqual([s for s in range(1, 12) if tracer.should_trace(s)],
+                         [5, 10])
+
+        tracer = StepTracer('./trace', every_n_steps=5, step_range=(2, 4))
+        self.assertEqual(tracer.step_range, (2, 4))
+        self.assertEqual([s for s in range(1, 12) if tracer.should_trace(s)],
+                         [2, 3, 5, 10])
+
+    def test_from_env(self):
+        self.assertIsNone(StepTracer.from_env('./trace', environ={}))
+        self.assertIsNone(StepTracer.from_env(
+            environ={'TFSNIPPET_TRACE_EVERY_N_STEPS': '10'}))
+
+        tracer = StepTracer.from_env(
+            './trace', environ={'TFSNIPPET_TRACE_EVERY_N_STEPS': '10'})
+        self.assertEqual(tracer.output_dir, os.path.abspath('./trace'))
+        self.assertEqual(tracer.every_n_steps, 10)
+        self.assertIsNone(tracer.step_range)
+
+        tracer = StepTracer.from_env(
+            './trace', environ={'TFSNIPPET_TRACE_STEPS': '100:110',
+                                'TFSNIPPET_TRACE_DIR': './trace2'})
+        self.assertEqual(tracer.output_dir, os.path.abspath('./trace2'))
+        self.assertIsNone(tracer.every_n_steps)
+        self.assertEqual(tracer.step_range, (100, 110))
+
+    def test_trace(self):
+        logs = []
+        with self.get_session(), TemporaryDirectory() as tempdir:
+            a = tf.constant([[1., 2.], [3., 4.]])
+            b = tf.matmul(a, a)
+            tracer = StepTracer(tempdir, step_range=(2, 3),
+                                print_function=logs.append)
+            with train_loop([], max_step=3, step_tracer=tracer) as loop:
+                self.assertIs(loop.step_tracer, tracer)
+                for _ in loop.iter_epochs():
+                    for _ in loop.iter_steps():
+                        self.assertEqual(loop.run(b).tolist(),
+                                         [[7., 10.], [15., 22.]])
+            self.assertEqual(tracer.trace_count, 1)
+            self.assertEqual(
+                sorted(os.listdir(tempdir)),
+                ['run_metadata-2.pb', 'timeline-2.json']
+            )
+            with open(os.path.join(tempdir, 'timeline-2.json')) as f:
+                self.assertIn('traceEvents', json.load(f))
+            with open(os.path.join(tempdir, 'run_metadata-2.pb'), 'rb') as f:
+                run_metadata = tf.RunMetadata()
+                run_metadata.ParseFromString(f.read())
+                self.assertGreater(len(run_metadata.step_stats.dev_stats), 0)
+            self.assertEqual(len(logs), 1)
+            self.assertTrue(logs[0].startswith('Traced step 2: '))
+            self.assertIn('MatMul', logs[0])
+
+    def test_errors(self):
+        with self.assertRaisesRegex(
+                ValueError, 'At least one of `every_n_steps` and '
+                            '`step_range` should be specified.'):
+            _ = StepTracer('./trace')
+        with self.assertRaisesRegex(
+                ValueError, '`every_n_steps` must be at least 1.'):
+            _ = StepTracer('./trace', every_n_steps=0)
+        with self.assertRaisesRegex(
+                ValueError, r'`step_range` must be a tuple of \(start, '
+                            r'stop\), where start <= stop.'):
+            _ = StepTracer('./trace', step_range=(3, 2))
+
+
+if __name__ == '__main__':
+    unittest.main()
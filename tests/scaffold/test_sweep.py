@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+import tensorflow as tf
+
+from tfsnippet.scaffold import Model, SweepRunner
+from tfsnippet.utils import ensure_variables_initialized
+from tests.helper import TestCase
+
+
+class _QuadraticModel(Model):
+
+    def _build(self):
+        with tf.variable_scope('model'):
+            self.w = tf.get_variable('w', shape=(), dtype=tf.float32,
+                                     initializer=tf.zeros_initializer())
+        self.loss = tf.square(self.w - 1.)
+
+
+def _train_fn(trial):
+    if trial.config.get('fail'):
+        raise ValueError('failed trial')
+    model = _QuadraticModel()
+    model.build()
+    train_op = tf.train.GradientDescentOptimizer(trial.config['lr']). \
+        minimize(model.loss, var_list=[model.w])
+    ensure_variables_initialized()
+    session = tf.get_default_session()
+    with trial.train_loop(model.get_param_variables(),
+                          print_function=lambda message: None) as loop:
+        for _ in loop.iter_epochs():
+            session.run(train_op)
+            loop.add_metrics(valid_loss=session.run(model.loss))
+
+
+class SweepRunnerTestCase(TestCase):
+
+    def test_successive_halving(self):
+        logs = []
+        configs = [{'lr': .01}, {'lr': .1}, {'lr': .3}, {'lr': .5},
+                   {'fail': True}]
+        runner = SweepRunner(_train_fn, configs, num_workers=2,
+                             rung_epochs=[1, 3], reduction_factor=2,
+                             print_function=logs.append)
+        self.assertEqual(runner.num_workers, 2)
+        self.assertEqual(runner.rung_epochs, [1, 3])
+        self.assertIsNone(runner.trials)
+
+        trials = runner.run()
+        self.assertIs(runner.trials[0], trials[0])
+        self.assertEqual([t.config for t in trials], configs)
+        # the failures are printed in the order of completion
+        self.assertEqual(logs[0], 'Rung 1/2: training 5 trials until epoch 1.')
+        failures = [l for l in logs if l.startswith('Trial 4 failed:\n')]
+        self.assertEqual(len(failures), 1)
+        self.assertIn('failed trial', failures[0])
+        rung_2 = 'Rung 2/2: training 2 trials until epoch 3.'
+        self.assertIn(rung_2, logs)
+        self.assertLess(logs.index(failures[0]), logs.index(rung_2))
+        self.assertEqual(len(logs), 3)
+
+        # the worst trials should be terminated after the first rung
+        self.assertEqual([t.status for t in trials], [
+            'terminated at rung 1', 'terminated at rung 1', 'finished',
+            'finished', 'error'
+        ])
+        self.assertEqual([t.epoch for t in trials], [1, 1, 3, 3, 0])
+        self.assertAlmostEqual(trials[0].best_metric, .9604, places=5)
+        self.assertAlmostEqual(trials[1].best_metric, .64, places=5)
+
+        # the promoted trials should be resumed from the checkpoints
+        self.assertAlmostEqual(trials[2].final_metric, .004096, places=5)
+        self.assertAlmostEqual(trials[2].best_metric, .004096, places=5)
+        self.assertAlmostEqual(trials[3].final_metric, 0., places=5)
+        self.assertIsNone(trials[4].best_metric)
+
+        # test the table of the results
+        table = runner.format_table().split('\n')
+        self.assertEqual(len(table), 6)
+        self.assertEqual(table[0].split(),
+                         ['trial', 'epoch', 'step', 'best', 'final',
+                          'status', 'config'])
+        self.assertEqual([r.split()[0] for r in table[1:]],
+                         ['3', '2', '1', '0', '4'])
+        self.assertRegex(table[1], r'\sfinished\s+lr=0\.5$')
+        self.assertRegex(table[5], r'\serror\s+fail=True$')
+
+    def test_errors(self):
+        with self.assertRaisesRegex(
+                ValueError, '`configs` must not be empty.'):
+            _ = SweepRunner(_train_fn, [])
+        with self.assertRaisesRegex(
+                ValueError, '`intra_op_threads` and `inter_op_threads` '
+                            'must be at least 1.'):
+            _ = SweepRunner(_train_fn, [{}], intra_op_threads=0)
+        with self.assertRaisesRegex(
+                ValueError, '`num_workers` must be at least 1.'):
+            _ = SweepRunner(_train_fn, [{}], num_workers=0)
+        with self.assertRaisesRegex(
+                ValueError, '`rung_epochs` must be positive and strictly '
+                            'increasing.'):
+            _ = SweepRunner(_train_fn, [{}], rung_epochs=[3, 3])
+        with self.assertRaisesRegex(
+                ValueError, '`reduction_factor` must be at least 2.'):
+            _ = SweepRunner(_train_fn, [{}], reduction_factor=1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -9,7 +9,8 @@ import tensorflow as tf
 
 from tfsnippet.scaffold import train_loop, SummaryWriter
 from tfsnippet.utils import (ensure_variables_initialized, set_variable_values,
-                             get_variable_values, TemporaryDirectory)
+                             get_variable_values, TemporaryDirectory,
+                             PrefetchIterator, MiniBatchIterator)
 from tests.helper import TestCase
 
 
@@ -117,6 +118,25 @@ class TrainLoopTestCase(TestCase):
             self.assertEqual(epoch_counter, 3)
             self.assertEqual(step_counter, 10)
 
+    def test_close_data_generator(self):
+        closed = []
+
+        def data_generator():
+            try:
+                for i in range(10):
+                    yield i
+            finally:
+                closed.append(True)
+
+        # test closing the data generator when `max_step` is reached
+        with train_loop([], max_step=3) as loop:
+            for _ in loop.iter_epochs():
+                it = PrefetchIterator(data_generator())
+                self.assertEqual(
+                    [x for _, x in loop.iter_steps(it)], [0, 1, 2])
+                self.assertEqual(closed, [True])
+                self.assertEqual(list(it), [])
+
     def test_logs(self):
         logs = []
         with train_loop([], max_step=6, print_function=logs.append) as loop:
@@ -128,23 +148,72 @@ class TrainLoopTestCase(TestCase):
                         loop.print_logs()
                 loop.add_metrics(y=epoch)
                 loop.print_logs()
+        # the epoch logs should include percentiles of the timing metrics
+        percentiles = (r'\(±[^ ]+ sec, p50 0\.01\d* sec, p90 0\.01\d* sec, '
+                       r'p99 0\.01\d* sec, max 0\.01\d* sec\)')
         self.assertMatches('\n'.join(logs), re.compile(
             r'^'
-            r'\[Epoch 1, Step 2/6\] step time: 0\.01\d* sec \(±[^ ]+ sec\); '
-            r'x: 0\.5 \(±0\.5\)\n'
-            r'\[Epoch 1, Step 4/6\] step time: 0\.01\d* sec \(±[^ ]+ sec\); '
-            r'x: 2\.5 \(±0\.5\)\n'
-            r'\[Epoch 1\] epoch time: 0\.0[456]\d* sec; '
-            r'step time: 0\.01\d* sec \(±[^ ]+ sec\); x: 1\.5 \(±1\.11803\); '
-            r'y: 1\n'
-            r'\[Epoch 2, Step 6/6\] step time: 0\.01\d* sec \(±[^ ]+ sec\); '
-            r'x: 0\.5 \(±0\.5\)\n'
-            r'\[Epoch 2\] epoch time: 0\.0[23]\d* sec; '
-            r'step time: 0\.01\d* sec \(±[^ ]+ sec\); x: 0\.5 \(±0\.5\); y: 2'
+            r'\[Epoch 1, Step 2/6\] data time: [^;]+; '
+            r'step time: 0\.01\d* sec \(±[^ ]+ sec\); x: 0\.5 \(±0\.5\)\n'
+            r'\[Epoch 1, Step 4/6\] data time: [^;]+; '
+            r'step time: 0\.01\d* sec \(±[^ ]+ sec\); x: 2\.5 \(±0\.5\)\n'
+            r'\[Epoch 1\] data time: [^;]+; epoch time: 0\.0[456]\d* sec; '
+            r'step time: 0\.01\d* sec ' + percentiles + r'; '
+            r'x: 1\.5 \(±1\.11803\); y: 1\n'
+            r'\[Epoch 2, Step 6/6\] data time: [^;]+; '
+            r'step time: 0\.01\d* sec \(±[^ ]+ sec\); x: 0\.5 \(±0\.5\)\n'
+            r'\[Epoch 2\] data time: [^;]+; epoch time: 0\.0[23]\d* sec; '
+            r'step time: 0\.01\d* sec ' + percentiles + r'; '
+            r'x: 0\.5 \(±0\.5\); y: 2'
             r'$'
         ))
 
+    def test_data_time(self):
+        def slow_generator():
+            for i in range(3):
+                time.sleep(0.02)
+                yield i
+
+        logs = []
+        with train_loop([], max_epoch=1, print_function=logs.append) as loop:
+            for _ in loop.iter_epochs():
+                for _ in loop.iter_steps(slow_generator(), batch_size=10):
+                    time.sleep(0.01)
+                metrics = loop._epoch_metrics._metrics
+                self.assertGreater(metrics['data_time'].mean, 0.015)
+                self.assertLess(metrics['step_time'].mean, 0.02)
+                self.assertGreater(metrics['step_time'].mean, 0.005)
+                self.assertGreater(metrics['examples_per_sec'].mean, 100)
+                self.assertLess(metrics['examples_per_sec'].mean, 400)
+                loop.print_logs()
+        self.assertIn('examples per sec: ', logs[0])
+
+        # test the batch size inferred from `MiniBatchIterator`, the
+        # actual size of the last incomplete mini-batch, and no data time
+        # without data generator
+        with train_loop([], max_epoch=1, max_step=4) as loop:
+            for _ in loop.iter_epochs():
+                batch_sizes = []
+                for _ in loop.iter_steps(
+                        MiniBatchIterator([np.arange(10)], batch_size=4)):
+                    batch_sizes.append(loop._step_batch_size)
+                self.assertEqual(batch_sizes, [4, 4, 2])
+                for _ in loop.iter_steps():
+                    pass
+                metrics = loop._epoch_metrics._metrics
+                self.assertEqual(metrics['step_time'].counter, 4)
+                self.assertEqual(metrics['data_time'].counter, 3)
+                self.assertEqual(metrics['examples_per_sec'].counter, 3)
+
     def test_valid_metric(self):
+        step_time = r'data time: [^ ]+ sec; step time: [^ ]+ sec'
+        percentiles = (r'\(±[^ ]+ sec, p50 [^ ]+ sec, p90 [^ ]+ sec, '
+                       r'p99 [^ ]+ sec, max [^ ]+ sec\)')
+        epoch_time = (
+            r'data time: [^ ]+ sec ' + percentiles + r'; '
+            r'epoch time: [^ ]+ sec; step time: [^ ]+ sec ' + percentiles
+        )
+
         # test default "valid_loss"
         logs = []
         with train_loop([], print_function=logs.append) as loop:
@@ -162,14 +231,14 @@ class TrainLoopTestCase(TestCase):
         self.assertAlmostEqual(loop.best_valid_metric, 0.6)
         self.assertMatches('\n'.join(logs), re.compile(
             r'^'
-            r'\[Epoch 1, Step 1\] step time: [^ ]+ sec; '
+            r'\[Epoch 1, Step 1\] ' + step_time + r'; '
             r'valid loss: 0\.8 \(\*\)\n'
-            r'\[Epoch 1, Step 2\] step time: [^ ]+ sec; '
+            r'\[Epoch 1, Step 2\] ' + step_time + r'; '
             r'valid loss: 0\.6 \(\*\)\n'
-            r'\[Epoch 1, Step 3\] step time: [^ ]+ sec; '
+            r'\[Epoch 1, Step 3\] ' + step_time + r'; '
             r'valid loss: 0\.7\n'
-            r'\[Epoch 1\] epoch time: [^ ]+ sec; step time: [^ ]+ sec '
-            r'\(±[^ ]+ sec\); valid loss: 0\.7 \(±0\.0816497\)'
+            r'\[Epoch 1\] ' + epoch_time + r'; '
+            r'valid loss: 0\.7 \(±0\.0816497\)'
             r'$'
         ))
 
@@ -191,14 +260,14 @@ class TrainLoopTestCase(TestCase):
         self.assertAlmostEqual(loop.best_valid_metric, 0.8)
         self.assertMatches('\n'.join(logs), re.compile(
             r'^'
-            r'\[Epoch 1, Step 1\] step time: [^ ]+ sec; '
+            r'\[Epoch 1, Step 1\] ' + step_time + r'; '
             r'y: 0\.7 \(\*\)\n'
-            r'\[Epoch 1, Step 2\] step time: [^ ]+ sec; '
+            r'\[Epoch 1, Step 2\] ' + step_time + r'; '
             r'y: 0\.6\n'
-            r'\[Epoch 1, Step 3\] step time: [^ ]+ sec; '
+            r'\[Epoch 1, Step 3\] ' + step_time + r'; '
             r'y: 0\.8 \(\*\)\n'
-            r'\[Epoch 1\] epoch time: [^ ]+ sec; step time: [^ ]+ sec '
-            r'\(±[^ ]+ sec\); y: 0\.7 \(±0\.0816497\)'
+            r'\[Epoch 1\] ' + epoch_time + r'; '
+            r'y: 0\.7 \(±0\.0816497\)'
             r'$'
         ))
 
@@ -319,7 +388,8 @@ class TrainLoopTestCase(TestCase):
             obj = read_summary(tempdir)
             self.assertEqual(
                 sorted(obj[0]),
-                ['epoch_time', 'loss', 'step_time', 'valid_loss', 'x']
+                ['data_time', 'epoch_time', 'loss',
+                 'step_time', 'valid_loss', 'x']
             )
             np.testing.assert_equal(obj[1], [1, 2, 3, 4, 5, 6])
             np.testing.assert_almost_equal(
@@ -344,7 +414,7 @@ class TrainLoopTestCase(TestCase):
             sw.close()
             self.assertEqual(
                 sorted(read_summary(tempdir)[0]),
-                ['epoch_time', 'loss', 'step_time', 'valid_loss']
+                ['data_time', 'epoch_time', 'loss', 'step_time', 'valid_loss']
             )
 
         with TemporaryDirectory() as tempdir:
@@ -359,7 +429,7 @@ class TrainLoopTestCase(TestCase):
             sw.close()
             self.assertEqual(
                 sorted(read_summary(tempdir)[0]),
-                ['epoch_time', 'loss', 'step_time', 'valid_loss']
+                ['data_time', 'epoch_time', 'loss', 'step_time', 'valid_loss']
             )
 
     def test_early_stopping(self):
@@ -397,6 +467,132 @@ class TrainLoopTestCase(TestCase):
             self.assertAlmostEqual(loop.best_valid_metric, 0.8)
             self.assertEqual(get_variable_values([a, b]), [13, 23])
 
+            # test early-stopping with patience
+            logs = []
+            set_variable_values([a, b], [1, 2])
+            with train_loop([a], max_epoch=10, print_function=logs.append,
+                            early_stopping={'patience': 2,
+                                            'min_delta': .05}) as loop:
+                self.assertFalse(loop.should_stop)
+                valid_losses = [.7, .6, .58, .62, .5]
+                for epoch in loop.iter_epochs():
+                    for _ in loop.iter_steps([0]):
+                        set_variable_values([a, b], [10 + epoch, 20 + epoch])
+                    loop.add_metrics(valid_loss=valid_losses[epoch - 1])
+                    loop.print_logs()
+            self.assertTrue(loop.should_stop)
+            self.assertEqual(loop.epoch, 4)
+            # .58 is not better than .6 by `min_delta`
+            self.assertAlmostEqual(loop.best_valid_metric, .6)
+            self.assertEqual([l.endswith(' (*)') for l in logs],
+                             [True, True, False, False])
+            self.assertEqual(get_variable_values([a, b]), [12, 24])
+
+    def test_checkpoint(self):
+        with self.get_session(), TemporaryDirectory() as tempdir:
+            a = tf.get_variable('a', shape=(), dtype=tf.int32)
+            b = tf.get_variable('b', shape=(), dtype=tf.int32)
+            checkpoint_dir = os.path.join(tempdir, 'checkpoint')
+            valid_losses = {1: .5, 2: .4, 3: .6}
+
+            def train(interrupt_at=None):
+                data = MiniBatchIterator([np.arange(4)], batch_size=1)
+                with train_loop([a], max_epoch=3, early_stopping=True,
+                                checkpoint_dir=checkpoint_dir,
+                                checkpoint_vars=[a, b],
+                                state_objects={'data': data},
+                                print_function=logs.append) as loop:
+                    for epoch in loop.iter_epochs():
+                        for step, (x,) in loop.iter_steps(data):
+                            set_variable_values(
+                                [a, b], [get_variable_values([a])[0] + 1,
+                                         step])
+                            loop.add_metrics(loss=x[0])
+                            if step == interrupt_at:
+                                loop.save_checkpoint()
+                                raise ValueError('preempted')
+                        epoch_steps.append(
+                            loop._epoch_metrics._metrics['loss'].counter)
+                        loop.add_metrics(valid_loss=valid_losses[epoch])
+                return loop
+
+            # the training is interrupted within the second epoch
+            logs = []
+            epoch_steps = []
+            set_variable_values([a, b], [0, 0])
+            with self.assertRaisesRegex(ValueError, 'preempted'):
+                train(interrupt_at=6)
+            self.assertEqual(epoch_steps, [4])
+            self.assertTrue(os.path.isdir(
+                os.path.join(checkpoint_dir, 'early_stopping')))
+
+            # resume from the checkpoint at step 6
+            logs = []
+            epoch_steps = []
+            set_variable_values([a, b], [100, 100])
+            loop = train()
+            self.assertEqual(
+                logs[0], 'Resumed from the checkpoint at epoch 1, step 6.')
+            self.assertEqual(epoch_steps, [4, 4])
+            self.assertEqual(loop.epoch, 3)
+            self.assertEqual(loop.step, 12)
+            self.assertAlmostEqual(loop.best_valid_metric, .4)
+            self.assertEqual(get_variable_values([a, b]), [8, 12])
+
+            # resume from the completed training
+            logs = []
+            epoch_steps = []
+            set_variable_values([a, b], [100, 100])
+            loop = train()
+            self.assertEqual(
+                logs, ['Resumed from the checkpoint at epoch 3, step 12.'])
+            self.assertEqual(epoch_steps, [])
+            self.assertAlmostEqual(loop.best_valid_metric, .4)
+            self.assertEqual(get_variable_values([a, b]), [8, 12])
+
+            with self.assertRaisesRegex(
+                    RuntimeError, '`checkpoint_dir` has not been configured.'):
+                with train_loop([a]) as loop:
+                    loop.save_checkpoint()
+
+    def test_run(self):
+        logs = []
+        with self.get_session() as sess:
+            x = tf.placeholder(dtype=tf.float32, shape=())
+            a = tf.get_variable('a', initializer=0., dtype=tf.float32)
+            train_op = tf.assign_add(a, x)
+            ensure_variables_initialized()
+
+            with train_loop([a], max_step=4,
+                            print_function=logs.append) as loop:
+                for _ in loop.iter_epochs():
+                    for step in loop.iter_steps():
+                        out = loop.run(
+                            train_op, feed_dict={x: step},
+                            metrics={'x2': x * 2}, metrics_interval=2,
+                            session=sess
+                        )
+                        self.assertEqual(out, sum(range(step + 1)))
+                    self.assertIsNone(loop.run(None, metrics={'y': a}))
+                    loop.print_logs()
+                    self.assertIsNone(loop.run(None))
+                self.assertEqual(sess.run(a), 10.)
+
+        self.assertEqual(len(logs), 1)
+        self.assertIn('x2: 6 (±2)', logs[0])
+        self.assertIn('y: 10', logs[0])
+
+        with self.assertRaisesRegex(
+                TypeError, '`metrics` should be a dict.'):
+            with train_loop([], max_epoch=1) as loop:
+                for _ in loop.iter_epochs():
+                    loop.run(None, metrics=[])
+        with self.assertRaisesRegex(
+                ValueError, '`metrics_interval` must be at least 1.'):
+            with train_loop([], max_epoch=1) as loop:
+                for _ in loop.iter_epochs():
+                    loop.run(None, metrics_interval=0)
+
     def test_tensor_arguments(self):
         with self.get_session():
             a = tf.get_variable('a', initializer=0, dtype=tf.int32)
@@ -1,10 +1,12 @@
 # -*- coding: utf-8 -*-
 import os
+import threading
+import time
 import unittest
 
 import tensorflow as tf
 
-from tfsnippet.scaffold import early_stopping
+from tfsnippet.scaffold import early_stopping, train_loop, AsyncValidator
 from tfsnippet.utils import (TemporaryDirectory,
                              set_variable_values,
                              get_variable_values)
@@ -143,6 +145,220 @@ class EarlyStoppingTestCase(TestCase):
                 self.assertTrue(
                     os.path.exists(os.path.join(save_dir, 'latest')))
 
+    def test_memory_budget(self):
+        with self.get_session():
+            a, b, c = _populate_variables()
+
+            # test: memorize the parameters in memory
+            with early_stopping([a, b]) as es:
+                self.assertTrue(es.in_memory)
+                self.assertTrue(es.update(1.))
+                set_variable_values([a, b], [10, 20])
+                self.assertTrue(es.update(.5))
+                set_variable_values([a, b], [100, 200])
+                self.assertFalse(es.update(.8))
+            self.assertEqual(es.save_count, 2)
+            self.assertGreater(es.save_time, 0.)
+            self.assertEqual(get_variable_values([a, b, c]), [10, 20, 3])
+
+            # test: fallback to disk if exceeding the memory budget
+            set_variable_values([a, b, c], [1, 2, 3])
+            with early_stopping({'a': a, 'b': b}, memory_budget=7) as es:
+                self.assertFalse(es.in_memory)
+                self.assertTrue(es.update(1.))
+                set_variable_values([a, b], [10, 20])
+            self.assertEqual(es.save_count, 1)
+            self.assertEqual(get_variable_values([a, b, c]), [1, 2, 3])
+
+            # test: memory budget is ignored if `save_dir` is specified
+            with TemporaryDirectory() as tempdir:
+                with early_stopping([a, b], save_dir=tempdir) as es:
+                    self.assertFalse(es.in_memory)
+
+    def test_patience_and_min_delta(self):
+        with self.get_session():
+            a, b, c = _populate_variables()
+
+            # test: patience in epochs, with min_delta
+            with early_stopping([a], patience=2, min_delta=.1) as es:
+                self.assertTrue(es.update(1., global_step=10, epoch=1))
+                self.assertFalse(es.update(.95, global_step=20, epoch=2))
+                self.assertFalse(es.should_stop)
+                self.assertTrue(es.update(.85, global_step=30, epoch=3))
+                self.assertFalse(es.update(.8, global_step=40, epoch=4))
+                self.assertFalse(es.should_stop)
+                self.assertFalse(es.update(.9, global_step=50, epoch=5))
+                self.assertTrue(es.should_stop)
+            self.assertAlmostEqual(es.best_metric, .85)
+
+            # test: patience in steps, and bigger is better
+            with early_stopping([a], patience=15, patience_unit='step',
+                                smaller_is_better=False) as es:
+                self.assertTrue(es.update(1., global_step=10, epoch=1))
+                self.assertFalse(es.update(.5, global_step=20, epoch=1))
+                self.assertFalse(es.should_stop)
+                self.assertFalse(es.update(.5, global_step=25, epoch=1))
+                self.assertTrue(es.should_stop)
+
+            # test: the initial metric is never improved, with the number
+            # of updates as counter
+            with early_stopping([a], initial_metric=.5, patience=2) as es:
+                self.assertFalse(es.update(1.))
+                self.assertFalse(es.should_stop)
+                self.assertFalse(es.update(1.))
+                self.assertTrue(es.should_stop)
+
+    def test_min_save_interval(self):
+        with self.get_session():
+            a, b, c = _populate_variables()
+
+            # test: the pending improvement should be flushed on exit
+            with early_stopping([a, b], min_save_interval=60) as es:
+                self.assertTrue(es.update(1.))
+                self.assertFalse(es.has_pending)
+                set_variable_values([a, b], [10, 20])
+                self.assertTrue(es.update(.5))
+                self.assertAlmostEqual(es.best_metric, .5)
+                self.assertTrue(es.has_pending)
+                self.assertEqual(es.save_count, 1)
+                set_variable_values([a, b], [100, 200])
+            self.assertFalse(es.has_pending)
+            self.assertEqual(es.save_count, 2)
+            self.assertEqual(get_variable_values([a, b, c]), [10, 20, 3])
+
+            # test: the pending improvement should be saved by the next
+            # update beyond the interval, keeping the current values
+            set_variable_values([a, b, c], [1, 2, 3])
+            with early_stopping([a, b], min_save_interval=.1) as es:
+                self.assertTrue(es.update(1.))
+                set_variable_values([a, b], [10, 20])
+                self.assertTrue(es.update(.8))
+                self.assertTrue(es.has_pending)
+                set_variable_values([a, b], [100, 200])
+                time.sleep(.2)
+                self.assertFalse(es.update(.9))
+                self.assertFalse(es.has_pending)
+                self.assertEqual(es.save_count, 2)
+                self.assertEqual(get_variable_values([a, b]), [100, 200])
+            self.assertEqual(es.save_count, 2)
+            self.assertEqual(get_variable_values([a, b, c]), [10, 20, 3])
+
+            # test: the pending improvements should reset the patience
+            with early_stopping([a, b], min_save_interval=60,
+                                patience=2) as es:
+                self.assertTrue(es.update(1., epoch=1))
+                self.assertTrue(es.update(.9, epoch=2))
+                self.assertTrue(es.update(.8, epoch=3))
+                self.assertFalse(es.update(.8, epoch=4))
+                self.assertFalse(es.should_stop)
+                self.assertFalse(es.update(.8, epoch=5))
+                self.assertTrue(es.should_stop)
+
+            # test: the improvement with session should be saved
+            # immediately, superseding the pending improvement
+            set_variable_values([a, b, c], [1, 2, 3])
+            session = tf.get_default_session()
+            with early_stopping([a, b], min_save_interval=60) as es:
+                self.assertTrue(es.update(1.))
+                set_variable_values([a, b], [10, 20])
+                self.assertTrue(es.update(.8))
+                set_variable_values([a, b], [30, 40])
+                self.assertTrue(es.update(.5, session=session))
+                self.assertFalse(es.has_pending)
+                set_variable_values([a, b], [100, 200])
+            self.assertEqual(es.save_count, 2)
+            self.assertEqual(get_variable_values([a, b, c]), [30, 40, 3])
+
+            # test: the pending improvement should be flushed before
+            # restoring on error
+            set_variable_values([a, b, c], [1, 2, 3])
+            with self.assertRaisesRegex(ValueError, 'value error'):
+                with early_stopping([a, b], min_save_interval=60,
+                                    restore_on_error=True) as es:
+                    self.assertTrue(es.update(1.))
+                    set_variable_values([a, b], [10, 20])
+                    self.assertTrue(es.update(.5))
+                    set_variable_values([a, b], [100, 200])
+                    raise ValueError('value error')
+            self.assertEqual(es.save_count, 2)
+            self.assertEqual(get_variable_values([a, b, c]), [10, 20, 3])
+
+    def test_errors(self):
+        with self.get_session():
+            a, b, c = _populate_variables()
+            with self.assertRaisesRegex(
+                    ValueError, '`patience` must be at least 1.'):
+                with early_stopping([a], patience=0):
+                    pass
+            with self.assertRaisesRegex(
+                    ValueError, '`patience_unit` must be either \'epoch\' '
+                                'or \'step\'.'):
+                with early_stopping([a], patience_unit='batch'):
+                    pass
+            with self.assertRaisesRegex(
+                    ValueError, '`min_delta` must be non-negative.'):
+                with early_stopping([a], min_delta=-1.):
+                    pass
+
+
+class AsyncValidatorTestCase(TestCase):
+
+    def test_async_validator(self):
+        with self.get_session():
+            a, b, c = _populate_variables()
+            event = threading.Event()
+
+            def valid_fn(session):
+                event.wait()
+                # the separate session should hold the snapshot
+                return {'valid_loss': float(session.run(a))}
+
+            for save_dir in (None, 'save_dir'):
+                with TemporaryDirectory() as tempdir:
+                    es_config = True
+                    if save_dir is not None:
+                        es_config = {
+                            'save_dir': os.path.join(tempdir, save_dir)}
+                    with train_loop([a], max_epoch=1,
+                                    early_stopping=es_config) as loop:
+                        validator = AsyncValidator(loop, valid_fn)
+                        for _ in loop.iter_epochs():
+                            for step, _ in loop.iter_steps([5, 3, 4]):
+                                set_variable_values([a], [step + 10])
+                                event.clear()
+                                self.assertTrue(validator.submit())
+                                self.assertTrue(validator.is_running)
+                                set_variable_values([a], [step + 100])
+                                self.assertFalse(validator.submit())
+                                event.set()
+                                if step < 3:
+                                    self.assertTrue(validator.poll(True))
+                                    self.assertFalse(validator.is_running)
+                                    self.assertEqual(
+                                        loop.best_valid_metric, 11)
+                        # the last validation should be delivered on exit
+                        self.assertEqual(get_variable_values([a]), [103])
+                    self.assertEqual(loop.best_valid_metric, 11)
+                    self.assertEqual(get_variable_values([a]), [11])
+                    self.assertEqual(
+                        loop._early_stopping.best_metric, 11)
+                    self.assertEqual(loop._async_validators, [])
+
+            # test the error in validation
+            with train_loop([a], max_epoch=1) as loop:
+                def error_fn(session):
+                    raise ValueError('error in validation')
+                validator = AsyncValidator(loop, error_fn)
+                for _ in loop.iter_epochs():
+                    self.assertTrue(validator.submit())
+                    with self.assertRaisesRegex(
+                            ValueError, 'error in validation'):
+                        validator.poll(wait=True)
+                validator.close()
+                with self.assertRaisesRegex(
+                        RuntimeError, 'The validator has been closed.'):
+                    validator.submit()
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,342 @@
+# -*- coding: utf-8 -*-
+import functools
+import os
+import threading
+import time
+import unittest
+
+import numpy as np
+
+from tfsnippet.utils import (PrefetchIterator, ProcessMapIterator,
+                             TransformCache, MiniBatchIterator,
+                             minibatch_iterator, TemporaryDirectory)
+from tests.helper import TestCase
+
+
+class PrefetchIteratorTestCase(TestCase):
+
+    def test_prefetch(self):
+        # test prefetching an empty iterable
+        it = PrefetchIterator([])
+        self.assertEqual(list(it), [])
+        self.assertEqual(it.counter, 0)
+
+        # test prefetching with a single worker
+        it = PrefetchIterator(minibatch_iterator(np.arange(10), 3),
+                              capacity=2)
+        self.assertEqual(it.capacity, 2)
+        self.assertEqual(it.num_workers, 1)
+        batches = list(it)
+        self.assertEqual(len(batches), 4)
+        np.testing.assert_equal(np.concatenate(batches), np.arange(10))
+        self.assertEqual(it.counter, 4)
+        self.assertGreaterEqual(it.wait_time, it.last_wait_time)
+
+        # the iterator should be exhausted after the first pass
+        self.assertEqual(list(it), [])
+
+    def test_multiple_workers_keep_order(self):
+        def map_func(x):
+            time.sleep(np.random.random() * 0.01)
+            return x * 2
+
+        it = PrefetchIterator(range(50), capacity=3, num_workers=4,
+                              map_func=map_func)
+        self.assertEqual(list(it), [i * 2 for i in range(50)])
+
+    def test_wait_time(self):
+        def slow_generator():
+            for i in range(3):
+                time.sleep(0.05)
+                yield i
+
+        it = PrefetchIterator(slow_generator())
+        self.assertEqual(list(it), [0, 1, 2])
+        self.assertGreater(it.wait_time, 0.1)
+
+    def test_errors(self):
+        with self.assertRaisesRegex(
+                ValueError, '`capacity` must be at least 1.'):
+            _ = PrefetchIterator([], capacity=0)
+        with self.assertRaisesRegex(
+                ValueError, '`num_workers` must be at least 1.'):
+            _ = PrefetchIterator([], num_workers=0)
+
+        # test the error raised from source iterable
+        def error_generator():
+            yield 1
+            yield 2
+            raise ValueError('error from source')
+
+        it = PrefetchIterator(error_generator())
+        self.assertEqual(next(it), 1)
+        self.assertEqual(next(it), 2)
+        with self.assertRaisesRegex(ValueError, 'error from source'):
+            next(it)
+        self.assertEqual(list(it), [])
+
+        # test the error raised from `map_func`
+        def map_func(x):
+            if x == 3:
+                raise KeyError('error from map_func')
+            return x
+
+        it = PrefetchIterator(range(10), num_workers=2, map_func=map_func)
+        self.assertEqual([next(it) for _ in range(3)], [0, 1, 2])
+        with self.assertRaisesRegex(KeyError, 'error from map_func'):
+            next(it)
+
+    def test_close(self):
+        closed = []
+
+        def infinite_generator():
+            try:
+                i = 0
+                while True:
+                    yield i
+                    i += 1
+            finally:
+                closed.append(True)
+
+        thread_count = threading.active_count()
+        with PrefetchIterator(infinite_generator(), num_workers=2) as it:
+            self.assertEqual([next(it) for _ in range(5)], list(range(5)))
+            self.assertEqual(threading.active_count(), thread_count + 2)
+        self.assertEqual(closed, [True])
+        self.assertEqual(threading.active_count(), thread_count)
+        self.assertEqual(list(it), [])
+
+
+def _double_arrays(batch):
+    x, y = batch
+    return x * 2, y.astype(np.float32) * 2
+
+
+def _to_list(batch):
+    return list(batch)
+
+
+def _as_array(x):
+    return np.asarray([x])
+
+
+def _raise_on_three(x):
+    if x == 3:
+        raise KeyError('error from transform')
+    return np.asarray([x])
+
+
+def _unpicklable_on_three(x):
+    if x == 3:
+        return lambda: x
+    return [x]
+
+
+class _UnpicklableError(Exception):
+
+    def __init__(self):
+        super(_UnpicklableError, self).__init__('unpicklable error')
+        self.callback = lambda: None
+
+
+def _raise_unpicklable_on_three(x):
+    if x == 3:
+        raise _UnpicklableError()
+    return [x]
+
+
+class ProcessMapIteratorTestCase(TestCase):
+
+    def test_shared_outputs(self):
+        x = np.arange(100)
+        y = np.arange(200).reshape([100, 2])
+        source = MiniBatchIterator([x, y], batch_size=16, shuffle=True)
+        with ProcessMapIterator(source, _double_arrays, num_workers=2,
+                                backlog=3) as it:
+            self.assertEqual(it.num_workers, 2)
+            self.assertEqual(it.backlog, 3)
+            batches = [(a.copy(), b.copy()) for a, b in it]
+        self.assertEqual(len(batches), 7)
+        self.assertEqual(batches[0][1].dtype, np.float32)
+        x_out = np.concatenate([b[0] for b in batches])
+        y_out = np.concatenate([b[1] for b in batches])
+        np.testing.assert_equal(np.sort(x_out), x * 2)
+        np.testing.assert_equal(y_out[:, 0], x_out * 2)
+
+    def test_ordered_outputs(self):
+        # test with explicit buffer size
+        it = ProcessMapIterator(range(20), _as_array, num_workers=3,
+                                buffer_size=1024)
+        self.assertEqual(it.buffer_size, 1024)
+        self.assertEqual([int(v[0]) for v in it], list(range(20)))
+
+        # test pickled outputs
+        it = ProcessMapIterator(
+            minibatch_iterator(np.arange(10), 3), _to_list, num_workers=2)
+        self.assertEqual(list(it), [[0, 1, 2], [3, 4, 5], [6, 7, 8], [9]])
+
+        # test empty source
+        self.assertEqual(list(ProcessMapIterator([], _to_list)), [])
+
+    def test_errors(self):
+        with self.assertRaisesRegex(
+                ValueError, '`num_workers` must be at least 1.'):
+            _ = ProcessMapIterator([], _to_list, num_workers=0)
+        with self.assertRaisesRegex(
+                ValueError, '`backlog` must be at least 1.'):
+            _ = ProcessMapIterator([], _to_list, backlog=0)
+
+        it = ProcessMapIterator(range(10), _raise_on_three, num_workers=2)
+        self.assertEqual([int(next(it)[0]) for _ in range(3)], [0, 1, 2])
+        with self.assertRaisesRegex(KeyError, 'error from transform'):
+            next(it)
+        self.assertEqual(list(it), [])
+
+        # test unpicklable outputs
+        it = ProcessMapIterator(range(10), _unpicklable_on_three,
+                                num_workers=2)
+        self.assertEqual([next(it) for _ in range(3)], [[0], [1], [2]])
+        with self.assertRaises(Exception):
+            next(it)
+        self.assertEqual(list(it), [])
+
+        # test unpicklable errors
+        it = ProcessMapIterator(range(10), _raise_unpicklable_on_three,
+                                num_workers=2)
+        self.assertEqual([next(it) for _ in range(3)], [[0], [1], [2]])
+        with self.assertRaisesRegex(
+                RuntimeError, '_UnpicklableError: unpicklable error'):
+            next(it)
+        self.assertEqual(list(it), [])
+
+    def test_close(self):
+        def infinite_generator():
+            i = 0
+            while True:
+                yield i
+                i += 1
+
+        it = ProcessMapIterator(infinite_generator(), _as_array,
+                                num_workers=2)
+        self.assertEqual([int(next(it)[0]) for _ in range(5)], list(range(5)))
+        workers = list(it._workers)
+        it.close()
+        for worker in workers:
+            self.assertFalse(worker.is_alive())
+        self.assertEqual(list(it), [])
+
+
+def _scale(batch, factor=2):
+    x, y = batch
+    return x * factor, (y + x).astype(np.float32)
+
+
+class TransformCacheTestCase(TestCase):
+
+    def test_cache(self):
+        x = np.arange(100)
+        y = np.arange(100) * 10
+        calls = []
+
+        def transform(batch):
+            calls.append(len(batch[0]))
+            return _scale(batch)
+
+        with TemporaryDirectory() as tempdir:
+            cache_dir = os.path.join(tempdir, 'cache')
+            cache = TransformCache([x, y], transform, cache_dir)
+            self.assertEqual(cache.data_count, 100)
+            self.assertEqual(cache.cache_dir, cache_dir)
+            self.assertFalse(cache.is_cached)
+            self.assertIsNone(cache.read_throughput)
+
+            # the first epoch should compute and cache the outputs
+            it = cache.iterator(batch_size=16, shuffle=True,
+                                random_state=np.random.RandomState(1234))
+            self.assertEqual(it.batch_size, 16)
+            batches = [(a.copy(), b.copy()) for a, b in it]
+            self.assertEqual(len(batches), 7)
+            self.assertEqual(sum(calls), 100)
+            self.assertEqual((cache.hit_count, cache.miss_count), (0, 7))
+            self.assertTrue(cache.is_cached)
+            x_out = np.concatenate([b[0] for b in batches])
+            y_out = np.concatenate([b[1] for b in batches])
+            np.testing.assert_equal(np.sort(x_out), x * 2)
+            np.testing.assert_equal(y_out, x_out * 5.5)
+            self.assertEqual(y_out.dtype, np.float32)
+
+            # later epochs should read from the cache
+            for _ in range(2):
+                batches = [(a.copy(), b.copy()) for a, b in it]
+                self.assertEqual(len(batches), 7)
+                x_out2 = np.concatenate([b[0] for b in batches])
+                np.testing.assert_equal(np.sort(x_out2), x * 2)
+                np.testing.assert_equal(
+                    np.concatenate([b[1] for b in batches]), x_out2 * 5.5)
+            self.assertFalse(np.all(x_out2 == x_out))
+            self.assertEqual(sum(calls), 100)
+            self.assertEqual((cache.hit_count, cache.miss_count), (14, 7))
+            self.assertEqual(cache.read_bytes, 100 * (8 + 4) * 2)
+            self.assertGreater(cache.read_throughput, 0)
+
+            # the cache should be reused by a new object
+            cache = TransformCache([x, y], transform, cache_dir)
+            self.assertTrue(cache.is_cached)
+            batches = [(a.copy(), b.copy())
+                       for a, b in cache.iterator(10, shuffle=False)]
+            np.testing.assert_equal(
+                np.concatenate([b[0] for b in batches]), x * 2)
+            self.assertEqual(sum(calls), 100)
+
+            # the cache should be invalidated by the changes of arrays
+            # or the transform
+            self.assertFalse(
+                TransformCache([x, y + 1], transform, cache_dir).is_cached)
+            self.assertFalse(TransformCache(
+                [x, y], functools.partial(_scale, factor=3),
+                cache_dir).is_cached)
+            self.assertFalse(TransformCache(
+                [x, y], lambda b: _scale(b), cache_dir).is_cached)
+            self.assertTrue(TransformCache(
+                [x, y + 1], transform, cache_dir,
+                fingerprint=cache.fingerprint).is_cached)
+
+    def test_interrupted_and_incomplete(self):
+        x = np.arange(10)
+        with TemporaryDirectory() as tempdir:
+            cache = TransformCache([x, x], _scale, tempdir)
+            it = cache.iterator(batch_size=4, ignore_incomplete_batch=True)
+            batches = iter(it)
+            _ = next(batches)
+            batches.close()
+            self.assertFalse(cache.is_cached)
+
+            # the final incomplete batch should be cached, but not yielded
+            self.assertEqual([len(a) for a, b in it], [4, 4])
+            self.assertTrue(cache.is_cached)
+            self.assertEqual(cache.miss_count, 4)
+            np.testing.assert_equal(cache.dataset.arrays[0], x * 2)
+            self.assertEqual([len(a) for a, b in it], [4, 4])
+
+    def test_errors(self):
+        x = np.arange(10)
+        with TemporaryDirectory() as tempdir:
+            with self.assertRaisesRegex(
+                    ValueError, '`arrays` must not be empty.'):
+                _ = TransformCache([], _scale, tempdir)
+            with self.assertRaisesRegex(
+                    ValueError, '`batch_size` must be at least 1.'):
+                _ = TransformCache([x], _to_list, tempdir).iterator(0)
+            with self.assertRaisesRegex(
+                    TypeError, 'The outputs of `transform` must be an array '
+                               'or a tuple of arrays.'):
+                _ = list(TransformCache([x], _to_list, tempdir).iterator(3))
+            with self.assertRaisesRegex(
+                    ValueError, 'The outputs of `transform` must have one '
+                                'record for each data item.'):
+                _ = list(TransformCache(
+                    [x], lambda b: b[0][:1], tempdir).iterator(3))
+
+
+if __name__ == '__main__':
+    unittest.main()
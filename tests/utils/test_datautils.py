@@ -1,9 +1,16 @@
+import json
+import os
 import unittest
 
 import numpy as np
 
 from tfsnippet.utils import (minibatch_iterator, minibatch_slices_iterator,
-                             split_numpy_arrays, split_numpy_array)
+                             split_numpy_arrays, split_numpy_array,
+                             split_indices, stratified_split_indices,
+                             kfold_indices, MiniBatchIterator, MemmapDataset,
+                             BucketedMiniBatchIterator, ShardedDataset,
+                             WeightedMiniBatchSampler, TemporaryDirectory)
+from tfsnippet.utils.datautils import _SumTree
 from tests.helper import TestCase
 
 
@@ -160,5 +167,735 @@ class SplitNumpyArraysTestCase(TestCase):
         np.testing.assert_equal(right, [9])
 
 
+class SplitIndicesTestCase(TestCase):
+
+    def test_split_indices(self):
+        left, right = split_indices(10, portion=0.2, shuffle=False)
+        np.testing.assert_equal(left, np.arange(8))
+        np.testing.assert_equal(right, [8, 9])
+
+        left, right = split_indices(10, size=3)
+        self.assertEqual(len(left), 7)
+        self.assertEqual(len(right), 3)
+        np.testing.assert_equal(
+            np.sort(np.concatenate([left, right])), np.arange(10))
+
+        left, right = split_indices(10, size=11)
+        self.assertEqual(len(left), 0)
+        self.assertEqual(len(right), 10)
+
+        with self.assertRaisesRegex(
+                ValueError, 'At least one of `portion` and `size` should '
+                            'be specified.'):
+            split_indices(10)
+
+    def test_stratified_split_indices(self):
+        labels = np.asarray([0] * 60 + [1] * 30 + [2] * 10)
+        left, right = stratified_split_indices(labels, portion=0.2)
+        self.assertEqual(len(left), 80)
+        self.assertEqual(len(right), 20)
+        np.testing.assert_equal(
+            np.sort(np.concatenate([left, right])), np.arange(100))
+        np.testing.assert_equal(np.bincount(labels[right]), [12, 6, 2])
+
+        # test the largest remainder rounding
+        labels = np.asarray([0] * 5 + [1] * 3 + [2] * 2)
+        left, right = stratified_split_indices(labels, size=5,
+                                               shuffle=False)
+        self.assertEqual(len(right), 5)
+        np.testing.assert_equal(np.bincount(labels[right]), [3, 1, 1])
+        np.testing.assert_equal(left, np.sort(left))
+        np.testing.assert_equal(right, np.sort(right))
+
+        # test empty labels
+        left, right = stratified_split_indices([], portion=0.2)
+        self.assertEqual(len(left), 0)
+        self.assertEqual(len(right), 0)
+
+    def test_kfold_indices(self):
+        folds = list(kfold_indices(10, 3, shuffle=False))
+        self.assertEqual(len(folds), 3)
+        np.testing.assert_equal(folds[0][1], [0, 1, 2, 3])
+        np.testing.assert_equal(folds[1][1], [4, 5, 6])
+        np.testing.assert_equal(folds[2][1], [7, 8, 9])
+        np.testing.assert_equal(folds[0][0], np.arange(4, 10))
+
+        folds = list(kfold_indices(10, 3))
+        np.testing.assert_equal(
+            np.sort(np.concatenate([f[1] for f in folds])), np.arange(10))
+        for train, test in folds:
+            np.testing.assert_equal(
+                np.sort(np.concatenate([train, test])), np.arange(10))
+
+        # test stratified k-fold
+        labels = np.asarray([0] * 60 + [1] * 30 + [2] * 9)
+        for train, test in kfold_indices(99, 3, labels=labels):
+            np.testing.assert_equal(np.bincount(labels[test]), [20, 10, 3])
+
+        with self.assertRaisesRegex(ValueError, '`k` must be at least 2.'):
+            list(kfold_indices(10, 1))
+        with self.assertRaisesRegex(
+                ValueError, 'The length of `labels` does not match '
+                            '`data_count`.'):
+            list(kfold_indices(10, 2, labels=np.arange(9)))
+
+
+class MiniBatchIteratorObjectTestCase(TestCase):
+
+    def test_sequential(self):
+        x = np.arange(10)
+        y = np.arange(20).reshape([10, 2])
+        it = MiniBatchIterator([x, y], batch_size=4)
+        self.assertEqual(it.data_count, 10)
+        self.assertEqual(it.batch_size, 4)
+        self.assertFalse(it.shuffle)
+        self.assertEqual(it.num_batches, 3)
+
+        batches = [(a.copy(), b.copy()) for a, b in it]
+        self.assertEqual(len(batches), 3)
+        np.testing.assert_equal(
+            np.concatenate([b[0] for b in batches]), x)
+        np.testing.assert_equal(
+            np.concatenate([b[1] for b in batches]), y)
+        self.assertEqual(batches[-1][0].shape, (2,))
+
+        # test ignore incomplete batch
+        it = MiniBatchIterator([x], batch_size=4,
+                               ignore_incomplete_batch=True)
+        self.assertEqual(it.num_batches, 2)
+        np.testing.assert_equal(
+            np.concatenate([b[0].copy() for b in it]), np.arange(8))
+
+    def test_use_views(self):
+        x = np.arange(10)
+        it = MiniBatchIterator([x], batch_size=4, use_views=True)
+        batches = [b for b, in it]
+        np.testing.assert_equal(np.concatenate(batches), x)
+        for b in batches:
+            self.assertIs(b.base, x)
+            self.assertFalse(b.flags.writeable)
+        self.assertTrue(x.flags.writeable)
+
+    def test_shuffle(self):
+        x = np.arange(10)
+        y = np.arange(10, 20)
+        it = MiniBatchIterator([x, y], batch_size=3, shuffle=True,
+                               random_state=np.random.RandomState(1234))
+        epochs = []
+        for _ in range(2):
+            batches = [(a.copy(), b.copy()) for a, b in it]
+            self.assertEqual(len(batches), 4)
+            x_epoch = np.concatenate([b[0] for b in batches])
+            y_epoch = np.concatenate([b[1] for b in batches])
+            np.testing.assert_equal(x_epoch + 10, y_epoch)
+            np.testing.assert_equal(np.sort(x_epoch), x)
+            epochs.append(x_epoch)
+        self.assertFalse(np.all(epochs[0] == epochs[1]))
+
+    def test_shuffle_block_size(self):
+        x = np.arange(100)
+        it = MiniBatchIterator([x], batch_size=10, shuffle=True,
+                               shuffle_block_size=25)
+        batches = [b.copy() for b, in it]
+        self.assertEqual(len(batches), 10)
+        x_epoch = np.concatenate(batches)
+        np.testing.assert_equal(np.sort(x_epoch), x)
+        # each block of 25 items should be contiguous in the epoch
+        for i in range(4):
+            block = x_epoch[i * 25: (i + 1) * 25] // 25
+            self.assertEqual(len(set(block)), 1)
+
+        # test the final block with less items
+        it = MiniBatchIterator([np.arange(10)], batch_size=3, shuffle=True,
+                               shuffle_block_size=4)
+        np.testing.assert_equal(
+            np.sort(np.concatenate([b.copy() for b, in it])), np.arange(10))
+
+    def test_indices(self):
+        x = np.arange(10)
+        y = np.arange(10, 20)
+        it = MiniBatchIterator([x, y], batch_size=3, indices=[1, 3, 5, 7])
+        self.assertEqual(it.data_count, 4)
+        np.testing.assert_equal(it.indices, [1, 3, 5, 7])
+        batches = [(a.copy(), b.copy()) for a, b in it]
+        self.assertEqual(len(batches), 2)
+        np.testing.assert_equal(batches[0][0], [1, 3, 5])
+        np.testing.assert_equal(batches[1][1], [17])
+
+        it = MiniBatchIterator([x, y], batch_size=3, indices=[1, 3, 5, 7],
+                               shuffle=True)
+        batches = [(a.copy(), b.copy()) for a, b in it]
+        np.testing.assert_equal(
+            np.sort(np.concatenate([b[0] for b in batches])), [1, 3, 5, 7])
+        np.testing.assert_equal(
+            np.concatenate([b[0] for b in batches]) + 10,
+            np.concatenate([b[1] for b in batches])
+        )
+
+        with self.assertRaisesRegex(IndexError, '`indices` out of range.'):
+            _ = MiniBatchIterator([x], batch_size=3, indices=[10])
+        with self.assertRaisesRegex(
+                ValueError, '`use_views` cannot be True when `indices` '
+                            'is specified.'):
+            _ = MiniBatchIterator([x], batch_size=3, indices=[1],
+                                  use_views=True)
+
+    def test_reuse_buffers(self):
+        x = np.arange(12, dtype=np.float32).reshape([6, 2])
+        it = MiniBatchIterator([x], batch_size=2, shuffle=True)
+        buffers = [b for b, in it]
+        self.assertEqual(len(buffers), 3)
+        for b in buffers:
+            self.assertIs(b, buffers[0])
+            self.assertEqual(b.dtype, np.float32)
+
+        it = MiniBatchIterator([x], batch_size=2, shuffle=True,
+                               num_buffers=2)
+        buffers = [b for b, in it]
+        self.assertIsNot(buffers[0], buffers[1])
+        self.assertIs(buffers[0], buffers[2])
+
+    def test_errors(self):
+        with self.assertRaisesRegex(ValueError, '`arrays` must not be empty.'):
+            _ = MiniBatchIterator([], batch_size=1)
+        with self.assertRaisesRegex(
+                ValueError, 'The length of specified arrays are not equal.'):
+            _ = MiniBatchIterator([np.arange(1), np.arange(2)], batch_size=1)
+        with self.assertRaisesRegex(
+                ValueError, '`batch_size` must be at least 1.'):
+            _ = MiniBatchIterator([np.arange(1)], batch_size=0)
+        with self.assertRaisesRegex(
+                ValueError, '`use_views` cannot be True when `shuffle` '
+                            'is True.'):
+            _ = MiniBatchIterator([np.arange(1)], batch_size=1,
+                                  shuffle=True, use_views=True)
+        with self.assertRaisesRegex(
+                ValueError, '`num_buffers` must be at least 1.'):
+            _ = MiniBatchIterator([np.arange(1)], batch_size=1,
+                                  num_buffers=0)
+        with self.assertRaisesRegex(
+                ValueError, '`shuffle_block_size` must be at least 1.'):
+            _ = MiniBatchIterator([np.arange(1)], batch_size=1,
+                                  shuffle=True, shuffle_block_size=0)
+
+
+class MemmapDatasetTestCase(TestCase):
+
+    def test_memmap_dataset(self):
+        with TemporaryDirectory() as tempdir:
+            x = np.arange(1000, dtype=np.int32)
+            y = np.arange(2000, dtype=np.float64).reshape([1000, 2])
+            np.save(os.path.join(tempdir, 'x.npy'), x)
+            np.save(os.path.join(tempdir, 'y.npy'), y)
+            dataset = MemmapDataset.from_npy_files(
+                [os.path.join(tempdir, 'x.npy'),
+                 os.path.join(tempdir, 'y.npy')]
+            )
+            self.assertEqual(dataset.data_count, 1000)
+            self.assertEqual(len(dataset.arrays), 2)
+            for a in dataset.arrays:
+                self.assertIsInstance(a, np.memmap)
+
+            # test the sequential iterator
+            it = dataset.iterator(batch_size=64, shuffle=False)
+            batches = [(a.copy(), b.copy()) for a, b in it]
+            np.testing.assert_equal(
+                np.concatenate([b[0] for b in batches]), x)
+            np.testing.assert_equal(
+                np.concatenate([b[1] for b in batches]), y)
+
+            # test the block-shuffled iterator
+            it = dataset.iterator(batch_size=64, block_size=125)
+            self.assertIsInstance(it, MiniBatchIterator)
+            batches = [(a.copy(), b.copy()) for a, b in it]
+            self.assertEqual(len(batches), 16)
+            x_epoch = np.concatenate([b[0] for b in batches])
+            y_epoch = np.concatenate([b[1] for b in batches])
+            np.testing.assert_equal(np.sort(x_epoch), x)
+            np.testing.assert_equal(y_epoch[:, 0], x_epoch * 2)
+            for i in range(8):
+                block = x_epoch[i * 125: (i + 1) * 125] // 125
+                self.assertEqual(len(set(block)), 1)
+
+            # test ignore incomplete batch
+            it = dataset.iterator(batch_size=64, block_size=128,
+                                  ignore_incomplete_batch=True)
+            self.assertEqual(len([b for b in it]), 15)
+
+    def test_errors(self):
+        with self.assertRaisesRegex(ValueError, '`arrays` must not be empty.'):
+            _ = MemmapDataset([])
+        with self.assertRaisesRegex(
+                TypeError, '.* is not a memory-mapped array.'):
+            _ = MemmapDataset([np.arange(10)])
+
+
+class BucketedMiniBatchIteratorTestCase(TestCase):
+
+    def test_bucketing(self):
+        lengths = [1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12]
+        sequences = [np.arange(n) + 1 for n in lengths]
+        labels = np.arange(len(lengths))
+        it = BucketedMiniBatchIterator(
+            sequences, batch_size=3, bucket_boundaries=[4, 8],
+            arrays=[labels], pad_value=-1, return_mask=True
+        )
+        self.assertEqual(it.data_count, 12)
+        self.assertEqual(it.batch_size, 3)
+        np.testing.assert_equal(it.bucket_boundaries, [4, 8])
+        self.assertEqual(it.bucket_sizes, [4, 4, 4])
+        self.assertIsNone(it.padding_efficiency)
+
+        seen = []
+        for padded, length, mask, label in it:
+            self.assertEqual(padded.shape, (len(label), np.max(length)))
+            np.testing.assert_equal(length, np.asarray(lengths)[label])
+            self.assertEqual(mask.shape, padded.shape)
+            np.testing.assert_equal(np.sum(mask, axis=1), length)
+            # each mini-batch should be taken from one bucket
+            buckets = np.searchsorted([4, 8], length)
+            self.assertEqual(len(set(buckets)), 1)
+            for row, n in zip(padded, length):
+                np.testing.assert_equal(row[:n], np.arange(n) + 1)
+                np.testing.assert_equal(row[n:], -1)
+            seen.extend(label)
+        self.assertEqual(sorted(seen), list(range(12)))
+        self.assertGreater(it.padding_efficiency, 0.5)
+        self.assertLessEqual(it.padding_efficiency, 1.)
+
+    def test_no_shuffle(self):
+        sequences = [np.ones([n, 2]) for n in [3, 1, 2, 5]]
+        it = BucketedMiniBatchIterator(sequences, batch_size=2,
+                                       bucket_boundaries=[2], shuffle=False)
+        batches = [(p.copy(), l.copy()) for p, l in it]
+        self.assertEqual(len(batches), 2)
+        np.testing.assert_equal(batches[0][1], [1, 2])
+        self.assertEqual(batches[0][0].shape, (2, 2, 2))
+        np.testing.assert_equal(batches[1][1], [3, 5])
+        self.assertEqual(batches[1][0].shape, (2, 5, 2))
+        np.testing.assert_equal(batches[1][0][0, 3:], 0)
+        self.assertAlmostEqual(it.padding_efficiency, 11. / 14)
+
+        # test ignore incomplete batch
+        it = BucketedMiniBatchIterator(sequences, batch_size=2,
+                                       bucket_boundaries=[1],
+                                       ignore_incomplete_batch=True)
+        self.assertEqual(it.bucket_sizes, [1, 3])
+        self.assertEqual(len(list(it)), 1)
+
+    def test_errors(self):
+        with self.assertRaisesRegex(
+                ValueError, '`sequences` must not be empty.'):
+            _ = BucketedMiniBatchIterator([], 1, [1])
+        with self.assertRaisesRegex(
+                ValueError, '`batch_size` must be at least 1.'):
+            _ = BucketedMiniBatchIterator([np.arange(1)], 0, [1])
+        with self.assertRaisesRegex(
+                ValueError, '`bucket_boundaries` must be a non-empty '
+                            'ascending list.'):
+            _ = BucketedMiniBatchIterator([np.arange(1)], 1, [2, 1])
+        with self.assertRaisesRegex(
+                ValueError, 'The length of specified arrays are not equal.'):
+            _ = BucketedMiniBatchIterator([np.arange(1)], 1, [1],
+                                          arrays=[np.arange(2)])
+        with self.assertRaisesRegex(
+                ValueError, 'The trailing dimensions of `sequences` '
+                            'do not agree.'):
+            _ = BucketedMiniBatchIterator(
+                [np.ones([1, 2]), np.ones([1, 3])], 1, [1])
+
+
+class ShardedDatasetTestCase(TestCase):
+
+    def test_sharded_dataset(self):
+        with TemporaryDirectory() as tempdir:
+            shards = []
+            for i, size in enumerate([10, 7, 0, 13, 5]):
+                x = np.arange(size) + i * 100
+                x_path = os.path.join(tempdir, 'x-%d.npy' % i)
+                y_path = os.path.join(tempdir, 'y-%d.npz' % i)
+                np.save(x_path, x)
+                np.savez(y_path, y=x * 2)
+                shards.append((x_path, y_path))
+            x_all = np.concatenate(
+                [np.arange(size) + i * 100
+                 for i, size in enumerate([10, 7, 0, 13, 5])]
+            )
+
+            # test opening the shards lazily
+            dataset = ShardedDataset(shards)
+            self.assertEqual(len(dataset.shards), 5)
+            x, y = dataset.open_shard(0)
+            self.assertIsInstance(x, np.memmap)
+            np.testing.assert_equal(y, np.arange(10) * 2)
+
+            # test the sequential iterator
+            batches = [(a.copy(), b.copy())
+                       for a, b in dataset.iterator(4, shuffle=False)]
+            self.assertEqual(len(batches), 11)
+            np.testing.assert_equal(
+                np.concatenate([b[0] for b in batches]), x_all)
+
+            # test the interleaved iterator
+            it = dataset.iterator(4, num_open_shards=2)
+            self.assertEqual(it.batch_size, 4)
+            for _ in range(2):
+                batches = [(a.copy(), b.copy()) for a, b in it]
+                self.assertEqual(len(batches), 11)
+                x_epoch = np.concatenate([b[0] for b in batches])
+                y_epoch = np.concatenate([b[1] for b in batches])
+                np.testing.assert_equal(np.sort(x_epoch), x_all)
+                np.testing.assert_equal(y_epoch, x_epoch * 2)
+                for b in batches:
+                    self.assertEqual(len(set(b[0] // 100)), 1)
+
+            # test ignore incomplete batch
+            it = dataset.iterator(4, ignore_incomplete_batch=True)
+            self.assertEqual(len(list(it)), 7)
+
+            # test single-file shards
+            dataset = ShardedDataset(
+                [os.path.join(tempdir, 'x-%d.npy' % i) for i in range(5)])
+            batches = [a.copy() for a, in dataset.iterator(4)]
+            np.testing.assert_equal(np.sort(np.concatenate(batches)), x_all)
+
+    def test_errors(self):
+        with self.assertRaisesRegex(ValueError, '`shards` must not be empty.'):
+            _ = ShardedDataset([])
+        with self.assertRaisesRegex(
+                ValueError, '`num_open_shards` must be at least 1.'):
+            _ = ShardedDataset(['a.npy']).iterator(1, num_open_shards=0)
+
+
+
+class WeightedMiniBatchSamplerTestCase(TestCase):
+
+    def test_sampling(self):
+        x = np.arange(10)
+        weights = np.asarray([0., 1., 2., 3., 4., 0., 0., 0., 0., 10.])
+        sampler = WeightedMiniBatchSampler(
+            [x, x * 2], batch_size=1000, weights=weights, num_batches=20,
+            return_indices=True, random_state=np.random.RandomState(1234))
+        self.assertEqual(sampler.num_batches, 20)
+        self.assertEqual(sampler.total_weight, 20.)
+        np.testing.assert_equal(sampler.weights, weights)
+
+        counts = np.zeros([10])
+        batches = 0
+        for a, b, indices in sampler:
+            np.testing.assert_equal(a, indices)
+            np.testing.assert_equal(b, indices * 2)
+            counts += np.bincount(indices, minlength=10)
+            batches += 1
+        self.assertEqual(batches, 20)
+        np.testing.assert_equal(counts[weights == 0], 0)
+        np.testing.assert_allclose(
+            counts / np.sum(counts), weights / np.sum(weights), atol=0.01)
+
+        # test the default weights and number of batches
+        sampler = WeightedMiniBatchSampler([x], batch_size=3)
+        self.assertEqual(sampler.num_batches, 4)
+        self.assertEqual(sampler.total_weight, 10.)
+        self.assertEqual([len(b) for b, in sampler], [3] * 4)
+
+    def test_update_weights(self):
+        rs = np.random.RandomState(1234)
+        weights = rs.random_sample(1000)
+        sampler = WeightedMiniBatchSampler(
+            [np.arange(1000)], batch_size=64, weights=weights,
+            return_indices=True, random_state=rs)
+        for _, indices in sampler:
+            new_weights = rs.random_sample(len(indices))
+            sampler.update_weights(indices, new_weights)
+            weights[indices] = new_weights
+            np.testing.assert_equal(sampler.weights, weights)
+            self.assertAlmostEqual(sampler.total_weight, np.sum(weights))
+
+        # test updating with a scalar, and sampling only the updated items
+        sampler.update_weights(np.arange(1000), 0.)
+        sampler.update_weights([3, 5], 1.)
+        self.assertEqual(sampler.total_weight, 2.)
+        for _, indices in sampler:
+            self.assertEqual(set(indices), {3, 5})
+
+        # test the importance weights
+        sampler.update_weights([5], 3.)
+        np.testing.assert_allclose(
+            sampler.get_importance_weights([3, 5]),
+            [4. / (1000 * 1.), 4. / (1000 * 3.)]
+        )
+
+    def test_zero_weights(self):
+        # the zero-weight items should never be drawn, even if the random
+        # values are rounded up to the total weight
+        weights = np.asarray([1., 0., 2., 0., 0., 3., 0.])
+        tree = _SumTree(weights)
+        self.assertEqual(tree.total, 6.)
+        values = np.concatenate([
+            np.linspace(0., tree.total, 1001),
+            [np.nextafter(tree.total, 0.), tree.total * (1. + 1e-12)]
+        ])
+        indices = tree.find(values)
+        self.assertTrue(np.all(weights[indices] > 0))
+        self.assertEqual(set(indices), {0, 2, 5})
+
+        # test after the weights are updated
+        tree.update(np.asarray([0, 2, 6]), [0., 0., 4.])
+        indices = tree.find(values * 7. / 6.)
+        self.assertEqual(set(indices), {5, 6})
+
+    def test_errors(self):
+        x = np.arange(10)
+        with self.assertRaisesRegex(
+                ValueError, 'The length of `weights` does not match '
+                            '`arrays`.'):
+            _ = WeightedMiniBatchSampler([x], 3, weights=np.ones(9))
+        with self.assertRaisesRegex(
+                ValueError, '`weights` must be non-negative and finite.'):
+            _ = WeightedMiniBatchSampler([x], 3, weights=-np.ones(10))
+        with self.assertRaisesRegex(
+                ValueError, 'The sum of `weights` must be positive.'):
+            _ = WeightedMiniBatchSampler([x], 3, weights=np.zeros(10))
+        with self.assertRaisesRegex(
+                ValueError, '`num_batches` must be at least 1.'):
+            _ = WeightedMiniBatchSampler([x], 3, num_batches=0)
+
+        sampler = WeightedMiniBatchSampler([x], 3)
+        with self.assertRaisesRegex(IndexError, '`indices` out of range.'):
+            sampler.update_weights([10], 1.)
+        with self.assertRaisesRegex(
+                ValueError, '`weights` must be non-negative and finite.'):
+            sampler.update_weights([1], np.nan)
+        sampler.update_weights(x, 0.)
+        with self.assertRaisesRegex(
+                ValueError, 'The sum of `weights` must be positive.'):
+            _ = list(sampler)
+
+
+class MultiWorkerShardingTestCase(TestCase):
+
+    def check_shards(self, factory, data_count, world_size=3):
+        shards = []
+        for rank in range(world_size):
+            shards.append(np.concatenate(
+                [np.copy(b[0]) for b in factory(rank, world_size)]))
+        # the shards should be disjoint and balanced
+        x = np.concatenate(shards)
+        self.assertEqual(len(set(x)), len(x))
+        self.assertEqual(len(x), data_count // world_size * world_size)
+        self.assertEqual(len(set(len(shard) for shard in shards)), 1)
+        return shards
+
+    def test_minibatch_iterator(self):
+        x = np.arange(100)
+        self.assertEqual(
+            [list(b) for b in minibatch_iterator(x, 15, rank=2,
+                                                 world_size=3)],
+            [list(range(66, 81)), list(range(81, 96)), list(range(96, 99))]
+        )
+        self.assertEqual(list(minibatch_iterator(x[:2], 1, rank=1,
+                                                 world_size=3)), [])
+
+        # test the sequential iterator
+        shards = self.check_shards(
+            lambda rank, world_size: MiniBatchIterator(
+                [x], batch_size=8, use_views=True, rank=rank,
+                world_size=world_size),
+            data_count=100
+        )
+        np.testing.assert_equal(np.concatenate(shards), np.arange(99))
+        it = MiniBatchIterator([x], batch_size=8, rank=1, world_size=3)
+        self.assertEqual(it.rank, 1)
+        self.assertEqual(it.world_size, 3)
+        self.assertEqual(it.data_count, 33)
+        self.assertEqual(it.num_batches, 5)
+
+        # test the shuffled iterators, from a shared seed
+        for kwargs in [{}, {'shuffle_block_size': 7},
+                       {'indices': np.arange(20, 100)}]:
+            shards = self.check_shards(
+                lambda rank, world_size: MiniBatchIterator(
+                    [x], batch_size=8, shuffle=True, rank=rank,
+                    world_size=world_size,
+                    random_state=np.random.RandomState(1234), **kwargs),
+                data_count=80 if 'indices' in kwargs else 100
+            )
+            if 'indices' in kwargs:
+                self.assertGreaterEqual(np.min(np.concatenate(shards)), 20)
+
+    def test_memmap_dataset(self):
+        with TemporaryDirectory() as tempdir:
+            path = os.path.join(tempdir, 'x.npy')
+            np.save(path, np.arange(1000))
+            dataset = MemmapDataset.from_npy_files([path])
+            for shuffle in (False, True):
+                self.check_shards(
+                    lambda rank, world_size: dataset.iterator(
+                        batch_size=32, shuffle=shuffle, block_size=100,
+                        random_state=np.random.RandomState(1234),
+                        rank=rank, world_size=world_size),
+                    data_count=1000
+                )
+
+    def test_bucketed_iterator(self):
+        rs = np.random.RandomState(1234)
+        sequences = [np.arange(rs.randint(1, 30)) for _ in range(100)]
+        for shuffle in (False, True):
+            batch_counts = []
+            items = []
+            for rank in range(3):
+                it = BucketedMiniBatchIterator(
+                    sequences, batch_size=8, bucket_boundaries=[5, 10, 20],
+                    arrays=[np.arange(100)], shuffle=shuffle,
+                    random_state=np.random.RandomState(1234), rank=rank,
+                    world_size=3
+                )
+                batches = [b[2].copy() for b in it]
+                batch_counts.append(len(batches))
+                items.extend(np.concatenate(batches))
+            self.assertEqual(len(set(batch_counts)), 1)
+            self.assertEqual(len(set(items)), len(items))
+
+    def test_sharded_dataset(self):
+        with TemporaryDirectory() as tempdir:
+            shards = []
+            for i, size in enumerate([10, 7, 0, 13, 5]):
+                path = os.path.join(tempdir, 'x-%d.npy' % i)
+                np.save(path, np.arange(size) + i * 100)
+                shards.append(path)
+            dataset = ShardedDataset(shards)
+            for shuffle in (False, True):
+                self.check_shards(
+                    lambda rank, world_size: dataset.iterator(
+                        2, shuffle=shuffle, num_open_shards=2,
+                        random_state=np.random.RandomState(1234),
+                        rank=rank, world_size=world_size),
+                    data_count=30   # 3 + 2 + 0 + 4 + 1 items per worker
+                )
+
+    def test_errors(self):
+        x = np.arange(10)
+        with self.assertRaisesRegex(
+                ValueError, '`world_size` must be at least 1.'):
+            _ = list(minibatch_iterator(x, 3, world_size=0))
+        with self.assertRaisesRegex(
+                ValueError, '`rank` must be at least 0 and less than '
+                            '`world_size`.'):
+            _ = MiniBatchIterator([x], 3, rank=2, world_size=2)
+        with self.assertRaisesRegex(
+                ValueError, '`random_state` must be specified when '
+                            '`shuffle` is True and `world_size` > 1.'):
+            _ = MiniBatchIterator([x], 3, shuffle=True, world_size=2)
+        with self.assertRaisesRegex(
+                ValueError, '`random_state` must be specified when '
+                            '`shuffle` is True and `world_size` > 1.'):
+            _ = BucketedMiniBatchIterator([x], 3, [5], world_size=2)
+        with self.assertRaisesRegex(
+                ValueError, '`random_state` must be specified when '
+                            '`shuffle` is True and `world_size` > 1.'):
+            _ = ShardedDataset(['a.npy']).iterator(1, world_size=2)
+
+
+class IteratorStateTestCase(TestCase):
+
+    def check_resume(self, factory, skip):
+        def copy_batch(b):
+            return tuple(np.copy(a) for a in b)
+
+        # take `skip` mini-batches, and save the state
+        it = factory()
+        _ = list(it)   # start from the second epoch
+        epoch = iter(it)
+        head = [copy_batch(next(epoch)) for _ in range(skip)]
+        state = json.loads(json.dumps(it.get_state()))
+        self.assertEqual(state['cursor'], skip)
+        tail = [copy_batch(b) for b in epoch]
+        next_epoch = [copy_batch(b) for b in it]
+        self.assertEqual(it.get_state()['cursor'], 0)
+        self.assertIsNone(it.get_state()['epoch_seed'])
+
+        # restore the state in a new iterator
+        it2 = factory()
+        it2.set_state(state)
+        self.assertEqual(it2.get_state(), state)
+        self.assertEqual(len(head) + len(tail), len(next_epoch))
+        for expected in (tail, next_epoch):
+            batches = [copy_batch(b) for b in it2]
+            self.assertEqual(len(batches), len(expected))
+            for a, b in zip(batches, expected):
+                np.testing.assert_equal(a, b)
+
+    def test_minibatch_iterator(self):
+        x = np.arange(100)
+        for kwargs in [{'shuffle': False}, {'shuffle': True},
+                       {'shuffle': True, 'shuffle_block_size': 7},
+                       {'shuffle': True, 'indices': np.arange(50, 100)}]:
+            self.check_resume(
+                lambda: MiniBatchIterator(
+                    [x, x * 2], batch_size=8,
+                    random_state=np.random.RandomState(1234), **kwargs),
+                skip=3
+            )
+
+        # test the iterator without explicit random state
+        it = MiniBatchIterator([x], batch_size=8, shuffle=True)
+        epoch = iter(it)
+        _ = next(epoch)
+        state = it.get_state()
+        self.assertIsNone(state['random_state'])
+        tail = [b.copy() for b, in epoch]
+        it2 = MiniBatchIterator([x], batch_size=8, shuffle=True)
+        it2.set_state(state)
+        np.testing.assert_equal([b.copy() for b, in it2], tail)
+
+    def test_weighted_sampler(self):
+        weights = np.random.RandomState(1234).random_sample(100)
+        self.check_resume(
+            lambda: WeightedMiniBatchSampler(
+                [np.arange(100)], batch_size=8, weights=weights,
+                random_state=np.random.RandomState(1234)),
+            skip=3
+        )
+
+    def test_memmap_dataset(self):
+        with TemporaryDirectory() as tempdir:
+            path = os.path.join(tempdir, 'x.npy')
+            np.save(path, np.arange(1000))
+            dataset = MemmapDataset.from_npy_files([path])
+            self.check_resume(
+                lambda: dataset.iterator(
+                    batch_size=32, block_size=100,
+                    random_state=np.random.RandomState(1234)),
+                skip=10
+            )
+
+    def test_bucketed_iterator(self):
+        rs = np.random.RandomState(1234)
+        sequences = [np.arange(rs.randint(1, 30)) for _ in range(100)]
+        self.check_resume(
+            lambda: BucketedMiniBatchIterator(
+                sequences, batch_size=8, bucket_boundaries=[5, 10, 20],
+                arrays=[np.arange(100)],
+                random_state=np.random.RandomState(1234)),
+            skip=5
+        )
+
+    def test_sharded_dataset(self):
+        with TemporaryDirectory() as tempdir:
+            shards = []
+            for i, size in enumerate([10, 7, 0, 13, 5]):
+                path = os.path.join(tempdir, 'x-%d.npy' % i)
+                np.save(path, np.arange(size) + i * 100)
+                shards.append(path)
+            dataset = ShardedDataset(shards)
+            for shuffle in (False, True):
+                self.check_resume(
+                    lambda: dataset.iterator(
+                        4, shuffle=shuffle, num_open_shards=2,
+                        random_state=np.random.RandomState(1234)),
+                    skip=5
+                )
+
+
 if __name__ == '__main__':
     unittest.main()
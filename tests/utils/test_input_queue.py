@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+import unittest
+
+import numpy as np
+import tensorflow as tf
+
+from tfsnippet.scaffold import train_loop
+from tfsnippet.utils import InputQueue, MiniBatchIterator
+from tests.helper import TestCase
+
+
+class InputQueueTestCase(TestCase):
+
+    def test_construction(self):
+        q = InputQueue([tf.float32, tf.int32], shapes=[[None, 2], [None]],
+                       capacity=3)
+        self.assertEqual(q.dtypes, [tf.float32, tf.int32])
+        self.assertEqual(q.capacity, 3)
+        x, y = q.inputs
+        self.assertEqual(x.dtype, tf.float32)
+        self.assertEqual(x.get_shape().as_list(), [None, 2])
+        self.assertEqual(y.get_shape().as_list(), [None])
+
+        with self.assertRaisesRegex(
+                ValueError, 'The length of `shapes` does not match '
+                            '`dtypes`.'):
+            _ = InputQueue([tf.float32], shapes=[[None], [None]])
+        with self.assertRaisesRegex(
+                ValueError, '`capacity` must be at least 1.'):
+            _ = InputQueue([tf.float32], capacity=0)
+
+    def test_feed(self):
+        x = np.arange(20, dtype=np.float32).reshape([10, 2])
+        y = np.arange(10, dtype=np.int32)
+        q = InputQueue([tf.float32, tf.int32], shapes=[[None, 2], [None]],
+                       capacity=2)
+        sum_x = tf.reduce_sum(q.inputs[0], axis=1)
+        out_y = q.inputs[1]
+
+        with self.get_session() as session:
+            # test feeding the mini-batches of an epoch
+            it = MiniBatchIterator([x, y], batch_size=3)
+            sums, ys = [], []
+            for i, index in enumerate(q.feed(it)):
+                self.assertEqual(index, i)
+                a, b = session.run([sum_x, out_y])
+                sums.append(a)
+                ys.append(b)
+            np.testing.assert_almost_equal(
+                np.concatenate(sums), np.sum(x, axis=1))
+            np.testing.assert_equal(np.concatenate(ys), y)
+            self.assertEqual(q.size(), 0)
+
+            # test closing the feeder before the epoch ends
+            feeder = q.feed(MiniBatchIterator([x, y], batch_size=1))
+            self.assertEqual(next(feeder), 0)
+            session.run(out_y)
+            feeder.close()
+            self.assertEqual(q.size(), 0)
+            self.assertEqual(list(feeder), [])
+
+            # test closing the feeder with a yielded mini-batch, which has
+            # never been dequeued
+            feeder = q.feed(MiniBatchIterator([x, y], batch_size=1))
+            self.assertEqual(next(feeder), 0)
+            feeder.close()
+            self.assertEqual(q.size(), 0)
+
+            # test the epoch boundaries in the train loop
+            with train_loop([], max_epoch=2) as loop:
+                for _ in loop.iter_epochs():
+                    ys = []
+                    it = MiniBatchIterator([x, y], batch_size=4)
+                    for _, _ in loop.iter_steps(q.feed(it)):
+                        ys.append(session.run(out_y))
+                    np.testing.assert_equal(np.concatenate(ys), y)
+                self.assertEqual(loop.step, 6)
+            self.assertEqual(q.size(), 0)
+
+    def test_feed_error(self):
+        def data_generator():
+            yield np.asarray([1.], dtype=np.float32)
+            raise ValueError('error from source')
+
+        q = InputQueue([tf.float32])
+        with self.get_session() as session:
+            feeder = q.feed(data_generator())
+            self.assertEqual(next(feeder), 0)
+            np.testing.assert_equal(session.run(q.inputs), [[1.]])
+            with self.assertRaisesRegex(ValueError, 'error from source'):
+                next(feeder)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,4 +1,5 @@
 # -*- coding: utf-8 -*-
+import json
 import unittest
 
 import numpy as np
@@ -147,6 +148,14 @@ class MiscTestCase(TestCase):
         self.assertAlmostEqual(acc.stddev, 2.8301943)
         self.assertAlmostEqual(acc.weight, 10.)
 
+        # test restoring the state
+        acc2 = MetricAccumulator()
+        acc2.set_state(json.loads(json.dumps(acc.get_state())))
+        self.assertEqual(acc2.counter, 3)
+        self.assertAlmostEqual(acc2.mean, 4.7)
+        self.assertAlmostEqual(acc2.square, 30.1)
+        self.assertAlmostEqual(acc2.weight, 10.)
+
         acc.reset()
         self.assertFalse(acc.has_value)
         self.assertEqual(acc.counter, 0)
@@ -165,6 +174,69 @@ class MiscTestCase(TestCase):
         self.assertAlmostEqual(acc.stddev, 0.)
         self.assertAlmostEqual(acc.weight, 1.)
 
+    def test_LogBucketHistogram(self):
+        # test empty initial values
+        h = LogBucketHistogram()
+        self.assertAlmostEqual(h.relative_accuracy, .01)
+        self.assertEqual(h.count, 0)
+        self.assertIsNone(h.min)
+        self.assertIsNone(h.max)
+        self.assertIsNone(h.quantile(.5))
+        self.assertEqual(h.buckets(), [])
+
+        # test the relative error of the estimated quantiles
+        x = np.random.RandomState(1234).lognormal(-4., 1., size=10000)
+        for v in x:
+            h.add(v)
+        self.assertEqual(h.count, 10000)
+        self.assertAlmostEqual(h.sum, np.sum(x))
+        self.assertAlmostEqual(h.sum_squares, np.sum(x ** 2))
+        self.assertEqual(h.min, np.min(x))
+        self.assertEqual(h.max, np.max(x))
+        self.assertEqual(h.quantile(0.), np.min(x))
+        self.assertEqual(h.quantile(1.), np.max(x))
+        sorted_x = np.sort(x)
+        for q in (.1, .5, .9, .99):
+            ans = sorted_x[int(q * (len(x) - 1))]
+            self.assertLessEqual(abs(h.quantile(q) / ans - 1.), .0101)
+        buckets = h.buckets()
+        self.assertEqual(sum(b[1] for b in buckets), 10000)
+        self.assertEqual(buckets[-1][0], np.max(x))
+        limits = [b[0] for b in buckets]
+        self.assertEqual(limits, sorted(limits))
+
+        # test restoring the state
+        h2 = LogBucketHistogram()
+        h2.set_state(json.loads(json.dumps(h.get_state())))
+        self.assertEqual(h2.count, 10000)
+        self.assertEqual(h2.buckets(), buckets)
+        self.assertEqual(h2.quantile(.9), h.quantile(.9))
+
+        # test the values out of range
+        h.reset()
+        self.assertEqual(h.count, 0)
+        for v in [0., 1e-9, 2e7]:
+            h.add(v)
+        self.assertEqual(h.buckets(), [(1e-6, 2), (2e7, 1)])
+        self.assertEqual(h.quantile(.5), 0.)
+
+        # test the number of buckets is constant
+        h = LogBucketHistogram(relative_accuracy=.1, min_value=1.,
+                               max_value=100.)
+        self.assertEqual(h.num_buckets, 25)
+
+        with self.assertRaisesRegex(
+                ValueError,
+                '`relative_accuracy` must be in range \\(0, 1\\).'):
+            _ = LogBucketHistogram(relative_accuracy=1.)
+        with self.assertRaisesRegex(
+                ValueError, '`min_value` must be positive and less than '
+                            '`max_value`.'):
+            _ = LogBucketHistogram(min_value=1., max_value=1.)
+        with self.assertRaisesRegex(
+                ValueError, '`q` must be in range \\[0, 1\\].'):
+            _ = h.quantile(1.5)
+
     def test_humanize_duration(self):
         cases = [
             (0.0, '0 sec'),
@@ -1,9 +1,12 @@
 # -*- coding: utf-8 -*-
+import os
 import unittest
 
+import numpy as np
 import tensorflow as tf
 
 from tfsnippet.utils import (VariableSaver,
+                             MiniBatchIterator,
                              TemporaryDirectory,
                              try_get_variable_value,
                              get_variable_values,
@@ -169,5 +172,113 @@ class SessionTestCase(TestCase):
                 saver2.restore()
                 self.assertEqual(get_values(sess), [101, 201, 300])
 
+    def test_VariableSaver_state_objects(self):
+        a = tf.get_variable('a', initializer=1, dtype=tf.int32)
+        it = MiniBatchIterator([np.arange(10)], batch_size=3, shuffle=True,
+                               random_state=np.random.RandomState(1234))
+
+        with TemporaryDirectory() as tempdir:
+            saver = VariableSaver([a], tempdir, state_objects={'it': it})
+            with self.get_session() as sess:
+                sess.run(tf.global_variables_initializer())
+                epoch1 = []
+                for step, (x,) in enumerate(it, 1):
+                    epoch1.append(x.copy())
+                    if step <= 3:
+                        saver.save(step)
+                epoch2 = [x.copy() for x, in it]
+
+            # only the states of the kept checkpoints should remain
+            self.assertEqual(
+                sorted(n for n in os.listdir(tempdir)
+                       if n.endswith(VariableSaver.STATE_FILE_SUFFIX)),
+                ['variables.dat-2.state.json', 'variables.dat-3.state.json']
+            )
+
+            # the restored iterator should resume at the 4th mini-batch
+            it2 = MiniBatchIterator([np.arange(10)], batch_size=3,
+                                    shuffle=True)
+            saver2 = VariableSaver([a], tempdir, state_objects={'it': it2})
+            with self.get_session():
+                saver2.restore()
+            self.assertEqual(it2.get_state()['cursor'], 3)
+            np.testing.assert_equal([x.copy() for x, in it2], epoch1[3:])
+            np.testing.assert_equal([x.copy() for x, in it2], epoch2)
+
+    def test_VariableSaver_async(self):
+        a = tf.get_variable('a', initializer=1, dtype=tf.int32)
+        b = tf.get_variable('b', initializer=np.arange(3, dtype=np.float32))
+        step = tf.get_variable('step', initializer=0, dtype=tf.int32)
+        it = MiniBatchIterator([np.arange(10)], batch_size=3)
+
+        with TemporaryDirectory() as tempdir:
+            saver = VariableSaver({'a': a, 'b': b}, tempdir, async_save=True,
+                                  state_objects={'it': it})
+            with self.get_session() as sess:
+                sess.run(tf.global_variables_initializer())
+                for i in range(1, 4):
+                    epoch = iter(it)
+                    _ = [next(epoch) for _ in range(i)]
+                    sess.run([tf.assign(a, i), tf.assign(step, i * 10)])
+                    saver.save(global_step=step)
+                    # the snapshot should not be affected by later updates
+                    sess.run(tf.assign(a, -1))
+                saver.wait()
+
+                # only the latest two versions should be kept, without
+                # any temporary file
+                file_names = sorted(os.listdir(tempdir))
+                self.assertFalse(any(
+                    n.startswith('variables.dat-10') or '.tmp' in n
+                    for n in file_names
+                ))
+                self.assertIn('variables.dat-20.index', file_names)
+                self.assertIn('variables.dat-30.meta', file_names)
+                self.assertIn('variables.dat-30.state.json', file_names)
+                self.assertEqual(
+                    saver.get_latest_file(),
+                    os.path.join(tempdir, 'variables.dat-30')
+                )
+
+                # restore the variables and the iterator
+                sess.run(tf.assign(b, [10., 20., 30.]))
+                saver.restore()
+                self.assertEqual(sess.run(a), 3)
+                np.testing.assert_equal(sess.run(b), [0., 1., 2.])
+                self.assertEqual(it.get_state()['cursor'], 3)
+
+                # test the checkpoints readable by a synchronous saver
+                sess.run(tf.assign(a, -1))
+                VariableSaver({'a': a, 'b': b}, tempdir).restore()
+                self.assertEqual(sess.run(a), 3)
+
+    def test_VariableSaver_async_restart(self):
+        with TemporaryDirectory() as tempdir:
+            for steps in ([1, 2], [3]):
+                # each run builds the saver in a new graph, like a restart
+                with tf.Graph().as_default() as graph:
+                    x = tf.get_variable('x', initializer=0, dtype=tf.int32)
+                    saver = VariableSaver([x], tempdir, async_save=True)
+                    with tf.Session(graph=graph) as sess:
+                        sess.run(x.initializer)
+                        for step in steps:
+                            saver.save(global_step=step, session=sess)
+                        saver.wait()
+
+            # the versions saved before the restart should also be purged
+            file_names = sorted(os.listdir(tempdir))
+            self.assertFalse(any(
+                n.startswith('variables.dat-1.') for n in file_names))
+            self.assertIn('variables.dat-2.index', file_names)
+            self.assertIn('variables.dat-3.index', file_names)
+
+            # the meta graph should be exported from the graph of `sess`
+            with tf.Graph().as_default():
+                tf.train.import_meta_graph(
+                    os.path.join(tempdir, 'variables.dat-3.meta'))
+                self.assertEqual(
+                    [v.op.name for v in tf.global_variables()], ['x'])
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -1,6 +1,10 @@
 # -*- coding: utf-8 -*-
 
+from .gradient_accumulator import *
 from .logging import *
 from .model import *
+from .multi_step import *
+from .profiling import *
+from .sweep import *
 from .train_loop import *
 from .validation import *
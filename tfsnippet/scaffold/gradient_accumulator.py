@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import six
+import tensorflow as tf
+
+from tfsnippet.utils import (VarScopeObject, reopen_variable_scope,
+                             get_default_session_or_error,
+                             lagacy_default_name_arg)
+
+__all__ = ['GradientAccumulator']
+
+
+class GradientAccumulator(VarScopeObject):
+    """Gradient accumulator over micro-batches.
+
+    This class splits one logical training step into several micro-batch
+    ``session.run`` calls, each of which adds the gradients of `loss`
+    w.r.t. `var_list` into the accumulation slots.  The average gradients
+    are then applied by `optimizer` once, at the end of the logical step.
+    In this way, a large effective batch size can be used, while the peak
+    memory of the activations is only proportional to the micro-batch size.
+    For example:
+
+        model = MyModel()
+        accumulator = GradientAccumulator(
+            tf.train.AdamOptimizer(), model.loss,
+            model.get_param_variables(), num_micro_batches=4,
+            global_step=model.get_global_step()
+        )
+        ensure_variables_initialized()
+
+        with train_loop(model.get_param_variables()) as loop:
+            for epoch in loop.iter_epochs():
+                for step, (x,) in loop.iter_steps(train_iterator):
+                    losses = accumulator.run([model.input_x], [x],
+                                             fetches=model.loss)
+                    loop.add_metrics(loss=np.mean(losses))
+
+    The gradients of the micro-batches are weighted by their sizes, thus
+    if `loss` is the average over the examples in a micro-batch, the
+    applied gradient equals the gradient of the average loss over the
+    whole logical batch.
+
+    Parameters
+    ----------
+    optimizer : tf.train.Optimizer
+        The optimizer to apply the accumulated gradients.
+
+    loss : tf.Tensor
+        The loss of a micro-batch.
+
+    var_list : list[tf.Variable] | dict[str, tf.Variable]
+        The variables to be optimized, e.g., ``Model.get_param_variables()``.
+
+    num_micro_batches : int
+        Number of micro-batches in each logical step.
+
+    global_step : tf.Variable
+        Optional global step variable, incremented by the optimizer
+        at each logical step.
+
+    name, scope : str
+        Optional name and scope of this accumulator.
+    """
+
+    @lagacy_default_name_arg
+    def __init__(self, optimizer, loss, var_list, num_micro_batches,
+                 global_step=None, name=None, scope=None):
+        if num_micro_batches < 1:
+            raise ValueError('`num_micro_batches` must be at least 1.')
+        if isinstance(var_list, dict):
+            var_list = [v for _, v in sorted(six.iteritems(var_list))]
+        var_list = list(var_list)
+        if not var_list:
+            raise ValueError('`var_list` must not be empty.')
+        super(GradientAccumulator, self).__init__(name=name, scope=scope)
+
+        self._optimizer = optimizer
+        self._num_micro_batches = num_micro_batches
+        grads_and_vars = [
+            (g, v) for g, v in optimizer.compute_gradients(loss, var_list)
+            if g is not None
+        ]
+        if not grads_and_vars:
+            raise ValueError('No gradient can be computed for `var_list`.')
+        self._var_list = [v for _, v in grads_and_vars]
+
+        with reopen_variable_scope(self.variable_scope):
+            self._weight = tf.placeholder_with_default(
+                tf.constant(1., dtype=tf.float32), shape=(), name='weight')
+            self._slots = [
+                tf.get_variable(
+                    'slot_%d' % i, dtype=v.dtype.base_dtype,
+                    shape=v.get_shape(), trainable=False,
+                    initializer=tf.zeros_initializer()
+                )
+                for i, v in enumerate(self._var_list)
+            ]
+            self._total_weight = tf.get_variable(
+                'total_weight', dtype=tf.float32, shape=(), trainable=False,
+                initializer=tf.zeros_initializer()
+            )
+
+            # accumulate the gradients of a micro-batch
+            accumulate_ops = [tf.assign_add(self._total_weight, self._weight)]
+            for (g, v), s in zip(grads_and_vars, self._slots):
+                g = tf.convert_to_tensor(g)     # densify `IndexedSlices`
+                accumulate_ops.append(tf.assign_add(
+                    s, g * tf.cast(self._weight, dtype=g.dtype)))
+            self._accumulate_op = tf.group(*accumulate_ops,
+                                           name='accumulate_op')
+
+            # apply the average gradients and reset the slots
+            total_weight = tf.maximum(self._total_weight, 1e-8)
+            apply_op = optimizer.apply_gradients(
+                [(s / tf.cast(total_weight, dtype=s.dtype.base_dtype), v)
+                 for s, v in zip(self._slots, self._var_list)],
+                global_step=global_step
+            )
+            with tf.control_dependencies([apply_op]):
+                self._apply_op = tf.group(*self._reset_ops(),
+                                          name='apply_op')
+            self._reset_op = tf.group(*self._reset_ops(), name='reset_op')
+
+    def _reset_ops(self):
+        return [tf.assign(s, tf.zeros_like(s)) for s in self._slots] + \
+            [tf.assign(self._total_weight, 0.)]
+
+    @property
+    def optimizer(self):
+        """Get the optimizer."""
+        return self._optimizer
+
+    @property
+    def num_micro_batches(self):
+        """Get the number of micro-batches in each logical step."""
+        return self._num_micro_batches
+
+    @property
+    def var_list(self):
+        """Get the variables which have gradients accumulated."""
+        return self._var_list
+
+    @property
+    def slots(self):
+        """Get the accumulation slot variables."""
+        return self._slots
+
+    @property
+    def accumulate_op(self):
+        """Get the operation to accumulate the gradients of a micro-batch.
+
+        The weight of the micro-batch can be fed via `weight`.
+        """
+        return self._accumulate_op
+
+    @property
+    def apply_op(self):
+        """Get the operation to apply the average gradients.
+
+        The accumulation slots will be reset after the gradients are applied.
+        """
+        return self._apply_op
+
+    @property
+    def reset_op(self):
+        """Get the operation to reset the accumulation slots."""
+        return self._reset_op
+
+    @property
+    def weight(self):
+        """Get the placeholder of the weight of a micro-batch (default 1.)."""
+        return self._weight
+
+    def run(self, placeholders, arrays, fetches=None, feed_dict=None,
+            session=None):
+        """Run one logical step over the micro-batches of `arrays`.
+
+        Parameters
+        ----------
+        placeholders : list[tf.Tensor]
+            The placeholders to be fed with the micro-batches.
+
+        arrays : list[np.ndarray]
+            The arrays of the logical batch, which are split into
+            `num_micro_batches` micro-batches along the first axis.
+
+        fetches : any
+            Optional operations or tensors to be fetched at each
+            micro-batch, along with the gradients.
+
+        feed_dict : dict[tf.Tensor, any]
+            Optional feed dict shared by all the micro-batches.
+
+        session : tf.Session
+            The session to run.  If not specified, use the active session.
+
+        Returns
+        -------
+        list[any]
+            The outputs of `fetches` at each micro-batch.
+        """
+        placeholders = list(placeholders)
+        arrays = [np.asarray(a) for a in arrays]
+        if len(placeholders) != len(arrays):
+            raise ValueError('The length of `arrays` does not match '
+                             '`placeholders`.')
+        if not arrays:
+            raise ValueError('`arrays` must not be empty.')
+        session = session or get_default_session_or_error()
+
+        count = len(arrays[0])
+        num_micro_batches = min(self._num_micro_batches, max(count, 1))
+        bounds = np.linspace(0, count, num_micro_batches + 1).astype(np.int64)
+        outputs = []
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            micro_feed_dict = dict(feed_dict or ())
+            for p, a in zip(placeholders, arrays):
+                micro_feed_dict[p] = a[start: end]
+            micro_feed_dict[self._weight] = float(end - start)
+            if fetches is None:
+                session.run(self._accumulate_op, feed_dict=micro_feed_dict)
+                outputs.append(None)
+            else:
+                outputs.append(session.run(
+                    [self._accumulate_op, fetches],
+                    feed_dict=micro_feed_dict
+                )[1])
+        session.run(self._apply_op)
+        return outputs
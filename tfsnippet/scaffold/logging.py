@@ -1,21 +1,29 @@
 # -*- coding: utf-8 -*-
-from collections import defaultdict, OrderedDict
+import threading
+import time
+from collections import defaultdict, deque, OrderedDict
 
 import six
 import numpy as np
 import tensorflow as tf
 
-from tfsnippet.utils import (MetricAccumulator, humanize_duration,
-                             get_default_session_or_error)
+from tfsnippet.utils import (MetricAccumulator, LogBucketHistogram,
+                             humanize_duration, get_default_session_or_error)
 
 __all__ = [
     'MetricFormatter',
     'MetricLogger',
     'SummaryWriter',
+    'AsyncSummaryWriter',
     'get_variables_summary',
 ]
 
 
+def _print_function(message):
+    """Default print function, that outputs `message` to stdout."""
+    print(message)
+
+
 class MetricFormatter(object):
     """Default class for training metric formatter.
 
@@ -55,6 +63,14 @@ class MetricFormatter(object):
             for key in sorted(six.iterkeys(metrics), key=sort_key)
         ]
 
+    def is_timing_metric(self, name):
+        """Whether or not the metric `name` is a time duration?
+
+        By default, metrics ending with "time" or "timer" are regarded as
+        time durations.
+        """
+        return name.endswith('time') or name.endswith('timer')
+
     def format_metric_value(self, name, value):
         """Format the value of specified metric.
 
@@ -102,15 +118,38 @@ class MetricLogger(object):
     ----------
     formatter : MetricFormatter
         Optional metric formatter for this logger.
+
+    percentiles : bool
+        Whether or not to collect the histograms of the timing metrics,
+        and to report their p50, p90, p99 and max values? (default False)
+
+        The histograms are `LogBucketHistogram`, using constant memory
+        for each metric.
     """
 
-    def __init__(self, formatter=None):
+    #: The percentiles reported for timing metrics.
+    PERCENTILES = (50, 90, 99)
+
+    def __init__(self, formatter=None, percentiles=False):
         if formatter is None:
             formatter = MetricFormatter()
         self._formatter = formatter
+        self._percentiles = percentiles
 
         # accumulators for various metrics
         self._metrics = defaultdict(MetricAccumulator)
+        self._histograms = defaultdict(LogBucketHistogram)
+
+    @property
+    def histograms(self):
+        """Get the histograms of the timing metrics.
+
+        Returns
+        -------
+        dict[str, LogBucketHistogram]
+            The non-empty histograms, if `percentiles` is enabled.
+        """
+        return {k: v for k, v in six.iteritems(self._histograms) if v.count}
 
     def clear(self):
         """Clear all the metrics."""
@@ -118,6 +157,44 @@ class MetricLogger(object):
         # accumulator object (so that they can be reused)
         for k, v in six.iteritems(self._metrics):
             v.reset()
+        for k, v in six.iteritems(self._histograms):
+            v.reset()
+
+    def get_state(self):
+        """Get the JSON-compatible state of the collected metrics.
+
+        Returns
+        -------
+        dict[str, any]
+            The state, which can be restored by `set_state`.
+        """
+        return {
+            'metrics': {k: v.get_state()
+                        for k, v in six.iteritems(self._metrics)
+                        if v.has_value},
+            'histograms': {k: v.get_state()
+                           for k, v in six.iteritems(self._histograms)
+                           if v.count},
+        }
+
+    def set_state(self, state):
+        """Restore the collected metrics.
+
+        Parameters
+        ----------
+        state : dict[str, any]
+            The state obtained by `get_state`.
+        """
+        self.clear()
+        for k, v in six.iteritems(state.get('metrics') or {}):
+            self._metrics[k].set_state(v)
+        for k, v in six.iteritems(state.get('histograms') or {}):
+            self._histograms[k].set_state(v)
+
+    def _add_metric(self, name, value):
+        self._metrics[name].add(value)
+        if self._percentiles and self._formatter.is_timing_metric(name):
+            self._histograms[name].add(value)
 
     def add_metrics(self, metrics=None, **kwargs):
         """Add metric values.
@@ -131,10 +208,10 @@ class MetricLogger(object):
             raise TypeError('`metrics` should be a dict.')
         if metrics:
             for k, v in six.iteritems(metrics):
-                self._metrics[k].add(v)
+                self._add_metric(k, v)
         if kwargs:
             for k, v in six.iteritems(kwargs):
-                self._metrics[k].add(v)
+                self._add_metric(k, v)
 
     def format_logs(self):
         """Format the metrics logs.
@@ -150,8 +227,18 @@ class MetricLogger(object):
                 name = k.replace('_', ' ')
                 val = self._formatter.format_metric_value(k, m.mean)
                 if m.counter > 1:
-                    std = ' (±%s)' % (
-                        self._formatter.format_metric_value(k, m.stddev))
+                    stats = ['±%s' % (
+                        self._formatter.format_metric_value(k, m.stddev))]
+                    h = self._histograms.get(k)
+                    if h is not None and h.count > 1:
+                        stats.extend(
+                            'p%d %s' % (p, self._formatter.format_metric_value(
+                                k, h.quantile(p * .01)))
+                            for p in self.PERCENTILES
+                        )
+                        stats.append('max %s' % (
+                            self._formatter.format_metric_value(k, h.max)))
+                    std = ' (%s)' % ', '.join(stats)
                 else:
                     std = ''
                 buf.append('%s: %s%s' % (name, val, std))
@@ -211,6 +298,37 @@ class SummaryWriter(object):
             summary = tf.summary.Summary(value=values)
             self._writer.add_summary(summary, global_step=global_step)
 
+    def add_histograms(self, global_step=None, histograms=None):
+        """Add histograms as summary.
+
+        Parameters
+        ----------
+        global_step : int | tf.Tensor | tf.Variable
+            The global step counter. (optional)
+
+        histograms : dict[str, LogBucketHistogram]
+            Dict of histograms, e.g., ``MetricLogger.histograms``.
+        """
+        values = []
+        for k, h in sorted(six.iteritems(histograms or {})):
+            if not h.count:
+                continue
+            buckets = h.buckets()
+            values.append(tf.summary.Summary.Value(
+                tag=k,
+                histo=tf.HistogramProto(
+                    min=h.min, max=h.max, num=h.count, sum=h.sum,
+                    sum_squares=h.sum_squares,
+                    bucket_limit=[b[0] for b in buckets],
+                    bucket=[b[1] for b in buckets],
+                )
+            ))
+        if values:
+            if isinstance(global_step, (tf.Tensor, tf.Variable)):
+                global_step = get_default_session_or_error().run(global_step)
+            self.add_summary(tf.summary.Summary(value=values),
+                             global_step=global_step)
+
     def add_summary(self, summary, global_step=None):
         """Add a summary object.
 
@@ -246,6 +364,210 @@ class SummaryWriter(object):
         )
 
 
+class AsyncSummaryWriter(SummaryWriter):
+    """Summary writer which buffers the metrics and writes them in background.
+
+    The metric values added at the same step are merged into one summary
+    proto, and the buffered summaries are written by a background thread,
+    once `max_buffer_steps` steps have been buffered, or `flush_interval`
+    seconds have elapsed since the last flush.  Thus `add_metrics` only
+    stores the values in memory, without blocking the training loop.
+
+        with contextlib.closing(AsyncSummaryWriter(
+                tf.summary.FileWriter(summary_dir))) as summary_writer:
+            with train_loop(param_vars,
+                            summary_writer=summary_writer) as loop:
+                ...
+
+    The step counter should be specified as an integer (e.g., `_TrainLoop`
+    passes its own step counter), or by a callable object, or be provided
+    by `step_counter`, so that no extra ``session.run`` is required.  A
+    `tf.Tensor` or `tf.Variable` is also accepted, but it would have to be
+    evaluated immediately in the calling thread.
+
+    Parameters
+    ----------
+    writer : tf.summary.FileWriter
+        The TensorFlow summary writer instance.
+
+    flush_interval : float
+        Maximum seconds between two flushes. (default 10.0)
+
+    max_buffer_steps : int
+        Flush once the buffered summaries of this number of steps.
+        (default 100)
+
+    max_queue_steps : int
+        Maximum number of buffered steps, if the background thread cannot
+        keep up with.  The oldest buffered summaries will be dropped when
+        exceeding this limit. (default 10000)
+
+    step_counter : () -> int
+        Optional callable object, which returns the step counter if
+        `global_step` is not specified.
+    """
+
+    def __init__(self, writer, flush_interval=10., max_buffer_steps=100,
+                 max_queue_steps=10000, step_counter=None):
+        if flush_interval <= 0:
+            raise ValueError('`flush_interval` must be positive.')
+        if max_buffer_steps < 1:
+            raise ValueError('`max_buffer_steps` must be at least 1.')
+        if max_queue_steps < max_buffer_steps:
+            raise ValueError('`max_queue_steps` must be at least '
+                             '`max_buffer_steps`.')
+        super(AsyncSummaryWriter, self).__init__(writer)
+        self._flush_interval = flush_interval
+        self._max_buffer_steps = max_buffer_steps
+        self._max_queue_steps = max_queue_steps
+        self._step_counter = step_counter
+
+        # the buffered events, each of which is a list of
+        # [global_step, OrderedDict of metric values, summary object]
+        self._buffer = deque()
+        self._buffer_lock = threading.Condition()
+        self._write_lock = threading.Lock()
+        self._writing_count = 0
+        self._dropped_count = 0
+        self._written_count = 0
+        self._last_flush_time = time.time()
+        self._closed = False
+        self._thread = threading.Thread(target=self._thread_main,
+                                        name='AsyncSummaryWriter')
+        self._thread.daemon = True
+        self._thread.start()
+
+    @property
+    def queue_depth(self):
+        """Get the number of buffered events which are not written yet."""
+        with self._buffer_lock:
+            return len(self._buffer) + self._writing_count
+
+    @property
+    def dropped_count(self):
+        """Get the number of events dropped due to `max_queue_steps`."""
+        return self._dropped_count
+
+    @property
+    def written_count(self):
+        """Get the number of events written to the underlying writer."""
+        return self._written_count
+
+    def _resolve_step(self, global_step):
+        if global_step is None and self._step_counter is not None:
+            global_step = self._step_counter()
+        elif isinstance(global_step, (tf.Tensor, tf.Variable)):
+            global_step = get_default_session_or_error().run(global_step)
+        elif callable(global_step):
+            global_step = global_step()
+        return int(global_step) if global_step is not None else None
+
+    def _put(self, global_step, values=None, summary=None):
+        """Put an event into the buffer, merging with the last one if
+        both of them are metric values at the same step."""
+        with self._buffer_lock:
+            if self._closed:
+                raise RuntimeError('The summary writer has been closed.')
+            last = self._buffer[-1] if self._buffer else None
+            if values is not None and last is not None and \
+                    last[1] is not None and last[0] == global_step:
+                last[1].update(values)
+            else:
+                self._buffer.append([global_step, values, summary])
+                while len(self._buffer) > self._max_queue_steps:
+                    self._buffer.popleft()
+                    self._dropped_count += 1
+            if len(self._buffer) >= self._max_buffer_steps:
+                self._buffer_lock.notify_all()
+
+    def _write_events(self):
+        """Write the events in the buffer to the underlying writer."""
+        with self._write_lock:
+            with self._buffer_lock:
+                events = list(self._buffer)
+                self._buffer.clear()
+                self._writing_count = len(events)
+                self._last_flush_time = time.time()
+            try:
+                for global_step, values, summary in events:
+                    if values is not None:
+                        summary = tf.summary.Summary(value=[
+                            tf.summary.Summary.Value(tag=k, simple_value=v)
+                            for k, v in six.iteritems(values)
+                        ])
+                    self._writer.add_summary(summary, global_step=global_step)
+                    self._written_count += 1
+            finally:
+                with self._buffer_lock:
+                    self._writing_count = 0
+
+    def _thread_main(self):
+        while True:
+            with self._buffer_lock:
+                while not self._closed:
+                    timeout = (self._last_flush_time + self._flush_interval -
+                               time.time())
+                    if timeout <= 0 or \
+                            len(self._buffer) >= self._max_buffer_steps:
+                        break
+                    self._buffer_lock.wait(timeout)
+                closed = self._closed
+            self._write_events()
+            if closed:
+                break
+
+    def flush(self):
+        """Write all the buffered events, and flush the underlying writer."""
+        self._write_events()
+        if self._writer is not None:
+            self._writer.flush()
+
+    def close(self):
+        """Write all the buffered events, and close the underlying writer."""
+        with self._buffer_lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._buffer_lock.notify_all()
+        self._thread.join()
+        super(AsyncSummaryWriter, self).close()
+
+    def add_metrics(self, global_step=None, metrics=None, **kwargs):
+        """Add scalar metrics into the buffer.
+
+        Parameters
+        ----------
+        global_step : int | () -> int | tf.Tensor | tf.Variable
+            The global step counter. (optional)
+
+        metrics, **kwargs
+            Dict of metric values.
+        """
+        if metrics is not None and not isinstance(metrics, (dict, OrderedDict)):
+            raise TypeError('%r should be a dict.' % (metrics,))
+        values = OrderedDict()
+        if metrics:
+            for k, v in six.iteritems(metrics):
+                values[k] = float(v)
+        for k, v in six.iteritems(kwargs):
+            values[k] = float(v)
+        if values:
+            self._put(self._resolve_step(global_step), values=values)
+
+    def add_summary(self, summary, global_step=None):
+        """Add a summary object into the buffer.
+
+        Parameters
+        ----------
+        summary : bytes | tf.summary.Summary
+            The summary object.
+
+        global_step : int | () -> int | tf.Tensor | tf.Variable
+            The global step counter. (optional)
+        """
+        self._put(self._resolve_step(global_step), summary=summary)
+
+
 def get_variables_summary(variables, title='Variables Summary'):
     """Get a formatted summary about the parameters.
 
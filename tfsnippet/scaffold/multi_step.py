@@ -0,0 +1,160 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import tensorflow as tf
+
+__all__ = ['multi_step_train_op', 'stack_steps']
+
+
+def multi_step_train_op(step_fn, inputs, metric_names=(), name=None):
+    """Build an operation which runs multiple training steps at once.
+
+    The training steps are run by an in-graph ``tf.while_loop`` over the
+    staged `inputs`, whose first dimension is the number of steps, such
+    that the overhead of ``session.run`` (and of the Python code around it)
+    is paid only once for every several steps.  For example:
+
+        input_x = tf.placeholder(tf.float32, shape=[None, None, 784])
+
+        def step_fn(x):
+            loss = build_loss(x)
+            return optimizer.minimize(loss), {'loss': loss}
+
+        train_op, metrics = multi_step_train_op(
+            step_fn, [input_x], metric_names=['loss'])
+
+        with train_loop(param_vars, max_epoch=10) as loop:
+            for epoch in loop.iter_epochs():
+                for step, (x,) in loop.iter_steps(train_iterator,
+                                                  steps_per_run=10):
+                    loop.run(train_op, feed_dict={input_x: x},
+                             metrics=metrics)
+
+    Note that the variables used by `step_fn` (including the slot variables
+    of the optimizer) must not be created inside the loop.  If the
+    optimizer creates slot variables (e.g., ``tf.train.AdamOptimizer``),
+    they should be created in advance, e.g., by building an ordinary
+    single-step training operation with the same optimizer.
+
+    Parameters
+    ----------
+    step_fn : (*tf.Tensor) -> (tf.Operation, dict[str, tf.Tensor])
+        Function to build one training step, given the inputs of this step.
+        It should return the training operation, and a dict of scalar
+        metric tensors, whose keys should match `metric_names`.
+
+    inputs : list[tf.Tensor]
+        The staged inputs, each of which has the number of steps as the
+        first dimension.  ``inputs[i][j]`` would be passed to `step_fn`
+        as the `i`-th input at the `j`-th step.
+
+    metric_names : collections.Iterable[str]
+        Names of the metrics returned by `step_fn`.
+
+    name : str
+        Optional name of this operation.
+
+    Returns
+    -------
+    (tf.Operation, dict[str, tf.Tensor])
+        The operation to run all the steps, and the dict of metrics
+        averaged over all the steps.
+    """
+    inputs = [tf.convert_to_tensor(x) for x in inputs]
+    if not inputs:
+        raise ValueError('`inputs` must not be empty.')
+    metric_names = list(metric_names)
+
+    with tf.name_scope(name, default_name='multi_step_train_op',
+                       values=inputs):
+        num_steps = tf.shape(inputs[0])[0]
+
+        def body(i, *sums):
+            step_inputs = [x[i] for x in inputs]
+            train_op, metrics = step_fn(*step_inputs)
+            metrics = metrics or {}
+            if sorted(metrics) != sorted(metric_names):
+                raise ValueError(
+                    'The metrics returned by `step_fn` do not match '
+                    '`metric_names`: %r vs %r.' %
+                    (sorted(metrics), sorted(metric_names))
+                )
+            # the next step must not be started before this step is done
+            with tf.control_dependencies([train_op]):
+                outputs = [i + 1]
+                for s, n in zip(sums, metric_names):
+                    m = tf.convert_to_tensor(metrics[n])
+                    m.get_shape().assert_has_rank(0)
+                    outputs.append(s + tf.cast(m, dtype=tf.float32))
+            return tuple(outputs)
+
+        loop_vars = [tf.constant(0, dtype=tf.int32)] + \
+            [tf.constant(0., dtype=tf.float32) for _ in metric_names]
+        outputs = tf.while_loop(
+            lambda i, *sums: i < num_steps,
+            body,
+            loop_vars,
+            back_prop=False,
+            parallel_iterations=1
+        )
+        if not isinstance(outputs, (tuple, list)):
+            outputs = [outputs]
+        op = tf.group(*outputs)
+        denominator = tf.cast(tf.maximum(num_steps, 1), dtype=tf.float32)
+        metrics = {
+            n: s / denominator for n, s in zip(metric_names, outputs[1:])
+        }
+    return op, metrics
+
+
+def stack_steps(iterable, steps_per_run):
+    """Stack the mini-batches of consecutive steps.
+
+    This method gathers `steps_per_run` consecutive mini-batches from
+    `iterable`, and stacks each of the arrays along a new first axis,
+    so as to be fed as the staged inputs of `multi_step_train_op`.
+    If the shapes of the arrays change (e.g., the last incomplete
+    mini-batch), the gathered mini-batches will be yielded early.
+    Each mini-batch is copied into the stacked arrays as soon as it
+    arrives, thus the buffers of `iterable` can be safely reused.
+
+    Parameters
+    ----------
+    iterable : collections.Iterable[tuple[np.ndarray]]
+        The mini-batches, each of which is a tuple of arrays.
+
+    steps_per_run : int
+        The maximum number of mini-batches to be stacked.
+
+    Yields
+    ------
+    tuple[np.ndarray]
+        The stacked arrays.  The first dimension is the number of steps.
+    """
+    if steps_per_run < 1:
+        raise ValueError('`steps_per_run` must be at least 1.')
+
+    # the mini-batches must be copied as soon as they arrive, since the
+    # iterator may reuse its buffers (e.g., `MiniBatchIterator`)
+    buffers = None
+    shapes = None
+    count = 0
+    for batch in iterable:
+        if not isinstance(batch, (tuple, list)):
+            batch = (batch,)
+        batch = [np.asarray(a) for a in batch]
+        batch_shapes = [a.shape for a in batch]
+        if count and batch_shapes != shapes:
+            yield tuple(b[:count] for b in buffers)
+            count = 0
+        if not count:
+            buffers = [np.empty((steps_per_run,) + a.shape, dtype=a.dtype)
+                       for a in batch]
+            shapes = batch_shapes
+        for b, a in zip(buffers, batch):
+            b[count] = a
+        count += 1
+        if count >= steps_per_run:
+            yield tuple(buffers)
+            count = 0
+    if count:
+        yield tuple(b[:count] for b in buffers)
@@ -0,0 +1,271 @@
+# -*- coding: utf-8 -*-
+import os
+import re
+from collections import defaultdict
+from logging import getLogger
+
+import six
+import tensorflow as tf
+from tensorflow.python.client import timeline
+
+from tfsnippet.utils import makedirs
+from .logging import SummaryWriter, _print_function
+
+__all__ = ['StepTracer']
+
+_OP_LABEL_PATTERN = re.compile(r'^.* = (.*?)\(.*\)$')
+
+
+def _op_type(node_stats):
+    """Get the operation type of `node_stats`, from its timeline label."""
+    m = _OP_LABEL_PATTERN.match(node_stats.timeline_label)
+    if m:
+        return m.group(1)
+    return node_stats.node_name.split(':', 1)[0]
+
+
+class StepTracer(object):
+    """Tracer of selected training steps, for profiling.
+
+    This class runs the selected steps with full TensorFlow tracing, i.e.,
+    ``tf.RunOptions(trace_level=tf.RunOptions.FULL_TRACE)``.  For each of
+    the traced steps, it writes the Chrome-trace timeline to
+    "timeline-<step>.json", and the serialized ``tf.RunMetadata`` to
+    "run_metadata-<step>.pb" under `output_dir`, and prints a short table
+    of the time spent on each type of operations.
+
+    The steps can be selected by `every_n_steps`, or by `step_range`.
+    A `StepTracer` is usually used via `_TrainLoop.run`:
+
+        tracer = StepTracer('./trace', every_n_steps=1000)
+        with train_loop(param_vars, step_tracer=tracer) as loop:
+            for epoch in loop.iter_epochs():
+                for step, (x, y) in loop.iter_steps(data_iterator):
+                    loop.run(train_op, feed_dict={input_x: x, input_y: y})
+
+    Note that only the session runs of `_TrainLoop.run` within the step
+    loop are traced.  Steps run by ``session.run`` directly, or by other
+    helpers such as `GradientAccumulator.run`, produce no trace.  If
+    ``loop.iter_steps(..., steps_per_run=n)`` is used, a traced run covers
+    all the `n` steps, and is selected only if the step counter after
+    these steps matches `every_n_steps` or `step_range`.
+
+    It can also be configured via environment variables (see `from_env`),
+    which is picked up by `train_loop` automatically, so as to profile
+    the production runs without code changes.
+
+    Parameters
+    ----------
+    output_dir : str
+        The directory where to save the timelines and run metadata.
+
+    every_n_steps : int
+        Trace a step if the step counter is a multiple of this number.
+
+    step_range : (int, int)
+        Trace the steps within the range of [start, stop).
+
+    summary_writer : SummaryWriter | tf.summary.FileWriter
+        If specified, will also add the run metadata to this writer.
+
+    print_function : (str) -> None
+        Function to print the op-type time table. (default `print`)
+
+    top_k : int
+        Number of the most time-consuming op types to print. (default 10)
+    """
+
+    #: Environment variable of the directory to save the traces.
+    ENV_OUTPUT_DIR = 'TFSNIPPET_TRACE_DIR'
+
+    #: Environment variable of `every_n_steps`, e.g., "1000".
+    ENV_EVERY_N_STEPS = 'TFSNIPPET_TRACE_EVERY_N_STEPS'
+
+    #: Environment variable of `step_range`, e.g., "100:110".
+    ENV_STEP_RANGE = 'TFSNIPPET_TRACE_STEPS'
+
+    def __init__(self, output_dir, every_n_steps=None, step_range=None,
+                 summary_writer=None, print_function=_print_function,
+                 top_k=10):
+        if every_n_steps is None and step_range is None:
+            raise ValueError('At least one of `every_n_steps` and '
+                             '`step_range` should be specified.')
+        if every_n_steps is not None and every_n_steps < 1:
+            raise ValueError('`every_n_steps` must be at least 1.')
+        if step_range is not None:
+            step_range = tuple(int(v) for v in step_range)
+            if len(step_range) != 2 or step_range[0] > step_range[1]:
+                raise ValueError('`step_range` must be a tuple of '
+                                 '(start, stop), where start <= stop.')
+        if isinstance(summary_writer, tf.summary.FileWriter):
+            summary_writer = SummaryWriter(summary_writer)
+
+        self._output_dir = os.path.abspath(output_dir)
+        self._every_n_steps = every_n_steps
+        self._step_range = step_range
+        self._summary_writer = summary_writer
+        self._print_function = print_function
+        self._top_k = top_k
+        self._trace_count = 0
+
+    @classmethod
+    def from_env(cls, output_dir=None, environ=None, **kwargs):
+        """Construct a `StepTracer` from the environment variables.
+
+        The steps are selected by ``TFSNIPPET_TRACE_EVERY_N_STEPS`` (e.g.,
+        "1000") and ``TFSNIPPET_TRACE_STEPS`` (e.g., "100:110"), while
+        ``TFSNIPPET_TRACE_DIR`` overrides `output_dir`.
+
+        Parameters
+        ----------
+        output_dir : str
+            The default directory where to save the traces.
+
+        environ : dict[str, str]
+            The environment variables. (default ``os.environ``)
+
+        **kwargs
+            Other arguments passed to the constructor.
+
+        Returns
+        -------
+        StepTracer | None
+            The step tracer, or None if no step is selected by the
+            environment variables, or the output directory is unknown.
+        """
+        if environ is None:
+            environ = os.environ
+        every_n_steps = environ.get(cls.ENV_EVERY_N_STEPS) or None
+        step_range = environ.get(cls.ENV_STEP_RANGE) or None
+        if every_n_steps is None and step_range is None:
+            return None
+
+        output_dir = environ.get(cls.ENV_OUTPUT_DIR) or output_dir
+        if output_dir is None:
+            getLogger(__name__).warning(
+                'Step tracing is disabled, since neither %s nor the '
+                'summary directory is specified.', cls.ENV_OUTPUT_DIR
+            )
+            return None
+        if every_n_steps is not None:
+            every_n_steps = int(every_n_steps)
+        if step_range is not None:
+            step_range = step_range.split(':')
+        return cls(output_dir, every_n_steps=every_n_steps,
+                   step_range=step_range, **kwargs)
+
+    @property
+    def output_dir(self):
+        """Get the directory where to save the traces."""
+        return self._output_dir
+
+    @property
+    def every_n_steps(self):
+        """Get the interval of the traced steps."""
+        return self._every_n_steps
+
+    @property
+    def step_range(self):
+        """Get the range of the traced steps."""
+        return self._step_range
+
+    @property
+    def trace_count(self):
+        """Get the number of traced steps."""
+        return self._trace_count
+
+    def should_trace(self, step):
+        """Whether or not the specified `step` should be traced?"""
+        if self._every_n_steps is not None and \
+                step % self._every_n_steps == 0:
+            return True
+        if self._step_range is not None and \
+                self._step_range[0] <= step < self._step_range[1]:
+            return True
+        return False
+
+    def trace(self, session, fetches, step, feed_dict=None):
+        """Run `fetches` in the session with full tracing.
+
+        Parameters
+        ----------
+        session : tf.Session
+            The session to run.
+
+        fetches : any
+            The operation or tensor (or a list / dict of them) to run.
+
+        step : int
+            The step counter, to name the output files.
+
+        feed_dict : dict[tf.Tensor, any]
+            Optional feed dict for running the session.
+
+        Returns
+        -------
+        any
+            The outputs of `fetches`.
+        """
+        options = tf.RunOptions(trace_level=tf.RunOptions.FULL_TRACE)
+        run_metadata = tf.RunMetadata()
+        outputs = session.run(fetches, feed_dict=feed_dict, options=options,
+                              run_metadata=run_metadata)
+        self._export(step, run_metadata)
+        self._trace_count += 1
+        return outputs
+
+    def _export(self, step, run_metadata):
+        makedirs(self._output_dir, exist_ok=True)
+        trace = timeline.Timeline(run_metadata.step_stats)
+        with open(os.path.join(self._output_dir,
+                               'timeline-%d.json' % step), 'w') as f:
+            f.write(trace.generate_chrome_trace_format())
+        with open(os.path.join(self._output_dir,
+                               'run_metadata-%d.pb' % step), 'wb') as f:
+            f.write(run_metadata.SerializeToString())
+        if self._summary_writer is not None:
+            self._summary_writer.writer.add_run_metadata(
+                run_metadata, 'step%d' % step, global_step=step)
+        if self._print_function is not None:
+            self._print_function(self.format_op_times(run_metadata, step))
+
+    def format_op_times(self, run_metadata, step):
+        """Format the time table of each type of operations.
+
+        Parameters
+        ----------
+        run_metadata : tf.RunMetadata
+            The traced run metadata.
+
+        step : int
+            The step counter, to be included in the title.
+
+        Returns
+        -------
+        str
+            The formatted time table, with the `top_k` most time-consuming
+            op types, sorted by their total time.
+        """
+        op_times = defaultdict(lambda: [0, 0])
+        for dev_stats in run_metadata.step_stats.dev_stats:
+            for node_stats in dev_stats.node_stats:
+                t = op_times[_op_type(node_stats)]
+                t[0] += 1
+                t[1] += node_stats.all_end_rel_micros
+        total_micros = sum(t[1] for t in six.itervalues(op_times))
+        items = sorted(six.iteritems(op_times), key=lambda x: -x[1][1])
+
+        name_len = max([len('Op Type')] +
+                       [len(k) for k, _ in items[:self._top_k]])
+        lines = [
+            'Traced step %d: %d op types in %.3f ms' % (
+                step, len(op_times), total_micros * 1e-3),
+            '%-*s  %8s  %12s  %7s' % (
+                name_len, 'Op Type', 'Count', 'Time (ms)', 'Ratio'),
+        ]
+        lines.append('-' * len(lines[-1]))
+        for name, (count, micros) in items[:self._top_k]:
+            ratio = float(micros) / total_micros if total_micros else 0.
+            lines.append('%-*s  %8d  %12.3f  %6.2f%%' % (
+                name_len, name, count, micros * 1e-3, ratio * 100))
+        return '\n'.join(lines)
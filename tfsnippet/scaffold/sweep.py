@@ -0,0 +1,365 @@
+# -*- coding: utf-8 -*-
+import math
+import multiprocessing
+import os
+import traceback
+from contextlib import contextmanager
+
+import six
+import tensorflow as tf
+
+from tfsnippet.utils import TemporaryDirectory, makedirs
+from .train_loop import train_loop, _parse_valid_metric, _print_function
+
+__all__ = ['SweepTrial', 'SweepRunner']
+
+
+class SweepTrial(object):
+    """A training run of a hyperparameter sweep.
+
+    Objects of this class are passed to the `train_fn` of `SweepRunner`,
+    in the worker processes.  `train_fn` should build the model according
+    to `config`, and train it within the `train_loop` of this trial, which
+    records the validation metrics and manages the epoch budget and the
+    checkpoints of this trial.
+
+    Parameters
+    ----------
+    index : int
+        Index of this trial in the sweep.
+
+    config : dict[str, any]
+        The hyperparameters of this trial.
+
+    work_dir : str
+        Directory for the files of this trial.
+
+    valid_metric : str | (str, bool)
+        The validation metric, see `train_loop`.
+    """
+
+    def __init__(self, index, config, work_dir, valid_metric='valid_loss'):
+        self.index = index
+        self.config = config
+        self.work_dir = work_dir
+        self.valid_metric = valid_metric
+
+        #: The max epoch of the current run, determined by the runner.
+        self.max_epoch = None
+        #: The number of completed rungs of successive halving.
+        self.rung = 0
+        #: Whether or not this trial has been terminated by the runner?
+        self.is_terminated = False
+        #: The formatted traceback, if the trial has failed.
+        self.error = None
+
+        # the results of the training loop
+        self.epoch = 0
+        self.step = 0
+        self.best_metric = None
+        self.final_metric = None
+
+    def __repr__(self):
+        return 'SweepTrial(index=%r, config=%r)' % (self.index, self.config)
+
+    @property
+    def checkpoint_dir(self):
+        """Get the directory of the training checkpoints."""
+        return os.path.join(self.work_dir, 'checkpoint')
+
+    @property
+    def status(self):
+        """Get the status text of this trial."""
+        if self.error is not None:
+            return 'error'
+        if self.is_terminated:
+            return 'terminated at rung %d' % self.rung
+        return 'finished'
+
+    @contextmanager
+    def train_loop(self, param_vars, **kwargs):
+        """Open the training loop of this trial.
+
+        The arguments are passed to `train_loop`, except that `max_epoch`,
+        `checkpoint_dir` and `valid_metric` are determined by this trial.
+        The training will be resumed from the checkpoint of the last rung.
+
+        Parameters
+        ----------
+        param_vars : list[tf.Variable] | dict[str, tf.Variable]
+            List or dict of variables, which should be optimized.
+
+        **kwargs
+            Other arguments of `train_loop`.
+
+        Yields
+        ------
+        _TrainLoop
+            The training loop context object.
+        """
+        kwargs['checkpoint_dir'] = self.checkpoint_dir
+        kwargs['valid_metric'] = self.valid_metric
+        if self.max_epoch is not None:
+            kwargs['max_epoch'] = self.max_epoch
+        with train_loop(param_vars, **kwargs) as loop:
+            try:
+                yield loop
+            finally:
+                self.epoch = loop.epoch
+                self.step = loop.step
+                self.best_metric = loop.best_valid_metric
+                self.final_metric = loop.last_valid_metric
+
+
+def _run_trial(args):
+    """Run `train_fn` for `trial` in a new graph and session."""
+    train_fn, trial, intra_op_threads, inter_op_threads = args
+    try:
+        makedirs(trial.work_dir, exist_ok=True)
+        session_config = tf.ConfigProto(
+            intra_op_parallelism_threads=intra_op_threads,
+            inter_op_parallelism_threads=inter_op_threads
+        )
+        with tf.Graph().as_default() as graph:
+            with tf.Session(graph=graph, config=session_config):
+                train_fn(trial)
+    except Exception:
+        trial.error = traceback.format_exc()
+    return trial
+
+
+class SweepRunner(object):
+    """Runner of hyperparameter sweeps over isolated training processes.
+
+    Each trial of the sweep runs `train_fn` in a worker process, within a
+    new graph and a new session, whose thread pools are limited by
+    `intra_op_threads` and `inter_op_threads`.  For example:
+
+        def train_fn(trial):
+            model = MyVAE(z_dim=trial.config['z_dim'])
+            model.build()
+            train_op = ...
+            ensure_variables_initialized()
+            with trial.train_loop(model.get_param_variables(),
+                                  early_stopping=True) as loop:
+                for epoch in loop.iter_epochs():
+                    for step, (x,) in loop.iter_steps(train_iterator):
+                        loop.run(train_op, feed_dict={model.input_x: x})
+                    loop.add_metrics(valid_loss=...)
+
+        runner = SweepRunner(
+            train_fn, [{'z_dim': z} for z in (8, 16, 32, 64)],
+            rung_epochs=[10, 30, 90], intra_op_threads=2
+        )
+        runner.run()
+        print(runner.format_table())
+
+    If more than one rung is specified in `rung_epochs`, the trials will be
+    trained by successive halving: all the trials are trained until the
+    epoch budget of the first rung, after which only the best
+    ``1 / reduction_factor`` of them (judged by the best validation
+    metric) are resumed from their checkpoints, and trained until the
+    budget of the next rung, and so on.
+
+    Note that `train_fn` and `configs` must be picklable, and no session
+    should be opened in the main process before calling `run`.  Each
+    worker process runs only one trial, since the thread pools of
+    TensorFlow cannot be re-configured within a process.
+
+    Parameters
+    ----------
+    train_fn : (SweepTrial) -> None
+        The picklable function to train a trial, which should train the
+        model within ``trial.train_loop(...)``.
+
+    configs : collections.Iterable[dict[str, any]]
+        The hyperparameters of each trial.
+
+    work_dir : str
+        Directory for the files of the trials.  If not specified, a
+        temporary directory will be used, and deleted after `run`.
+
+    num_workers : int
+        Number of concurrent worker processes.  If not specified, will use
+        the number of CPU cores divided by `intra_op_threads`.
+
+    intra_op_threads, inter_op_threads : int
+        The sizes of the thread pools of each session. (default 1)
+
+    max_epoch : int
+        The max epoch of each trial, if `rung_epochs` is not specified.
+
+    rung_epochs : list[int]
+        The increasing epoch budgets of the successive halving rungs.
+
+    reduction_factor : int
+        Only the best ``1 / reduction_factor`` trials will be promoted
+        to the next rung. (default 3)
+
+    valid_metric : str | (str, bool)
+        The validation metric, see `train_loop`. (default 'valid_loss')
+
+    print_function : (str) -> None
+        Function to print the progress messages.
+    """
+
+    def __init__(self, train_fn, configs, work_dir=None, num_workers=None,
+                 intra_op_threads=1, inter_op_threads=1, max_epoch=None,
+                 rung_epochs=None, reduction_factor=3,
+                 valid_metric='valid_loss', print_function=_print_function):
+        configs = list(configs)
+        if not configs:
+            raise ValueError('`configs` must not be empty.')
+        if intra_op_threads < 1 or inter_op_threads < 1:
+            raise ValueError('`intra_op_threads` and `inter_op_threads` '
+                             'must be at least 1.')
+        if num_workers is None:
+            num_workers = max(
+                multiprocessing.cpu_count() // intra_op_threads, 1)
+        if num_workers < 1:
+            raise ValueError('`num_workers` must be at least 1.')
+        if rung_epochs is None:
+            rung_epochs = [max_epoch]
+        else:
+            rung_epochs = [int(e) for e in rung_epochs]
+            if not rung_epochs or rung_epochs[0] < 1 or any(
+                    a >= b for a, b in zip(rung_epochs[:-1], rung_epochs[1:])):
+                raise ValueError('`rung_epochs` must be positive and '
+                                 'strictly increasing.')
+        if reduction_factor < 2:
+            raise ValueError('`reduction_factor` must be at least 2.')
+
+        self._train_fn = train_fn
+        self._configs = configs
+        self._work_dir = work_dir
+        self._num_workers = num_workers
+        self._intra_op_threads = intra_op_threads
+        self._inter_op_threads = inter_op_threads
+        self._rung_epochs = rung_epochs
+        self._reduction_factor = reduction_factor
+        self._valid_metric = valid_metric
+        self._smaller_is_better = _parse_valid_metric(valid_metric)[1]
+        self._print_function = print_function
+        self._trials = None
+
+    @property
+    def num_workers(self):
+        """Get the number of concurrent worker processes."""
+        return self._num_workers
+
+    @property
+    def rung_epochs(self):
+        """Get the epoch budgets of the successive halving rungs."""
+        return self._rung_epochs
+
+    @property
+    def trials(self):
+        """Get the trials of the last `run`, or None if not run."""
+        return self._trials
+
+    def _sort_key(self, trial):
+        if trial.error is not None or trial.best_metric is None:
+            return (1, 0.)
+        metric = trial.best_metric
+        return (0, metric if self._smaller_is_better else -metric)
+
+    def _run_rung(self, pool, trials, rung):
+        tasks = [(self._train_fn, t, self._intra_op_threads,
+                  self._inter_op_threads) for t in trials]
+        results = {}
+        for trial in pool.imap_unordered(_run_trial, tasks):
+            results[trial.index] = trial
+            if trial.error is not None:
+                self._print_function('Trial %d failed:\n%s' %
+                                     (trial.index, trial.error))
+        # the trials are copied across processes, thus must be replaced
+        for trial in trials:
+            result = results[trial.index]
+            result.rung = rung + 1
+            self._trials[trial.index] = result
+        return [self._trials[t.index] for t in trials]
+
+    def run(self):
+        """Run the sweep.
+
+        Returns
+        -------
+        list[SweepTrial]
+            The trials, in the order of `configs`.
+        """
+        if self._work_dir is None:
+            with TemporaryDirectory() as work_dir:
+                return self._run(work_dir)
+        return self._run(os.path.abspath(self._work_dir))
+
+    def _run(self, work_dir):
+        self._trials = [
+            SweepTrial(i, config, os.path.join(work_dir, 'trial_%d' % i),
+                       valid_metric=self._valid_metric)
+            for i, config in enumerate(self._configs)
+        ]
+        alive = list(self._trials)
+        # each worker process runs only one trial, such that the session
+        # config takes effect, and the memory is released afterwards
+        pool = multiprocessing.Pool(self._num_workers, maxtasksperchild=1)
+        try:
+            for rung, max_epoch in enumerate(self._rung_epochs):
+                if max_epoch is not None:
+                    self._print_function(
+                        'Rung %d/%d: training %d trials until epoch %d.' %
+                        (rung + 1, len(self._rung_epochs), len(alive),
+                         max_epoch)
+                    )
+                for trial in alive:
+                    trial.max_epoch = max_epoch
+                alive = self._run_rung(pool, alive, rung)
+
+                # promote the best trials to the next rung
+                if rung + 1 < len(self._rung_epochs):
+                    alive = [t for t in sorted(alive, key=self._sort_key)
+                             if t.error is None and t.best_metric is not None]
+                    keep = int(math.ceil(
+                        float(len(alive)) / self._reduction_factor))
+                    for trial in alive[keep:]:
+                        trial.is_terminated = True
+                    alive = alive[:keep]
+                    alive.sort(key=lambda t: t.index)
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+        return list(self._trials)
+
+    def format_table(self, trials=None):
+        """Format the results of the trials as a table.
+
+        Parameters
+        ----------
+        trials : list[SweepTrial]
+            The trials to be formatted. (default the trials of last `run`)
+
+        Returns
+        -------
+        str
+            The table of the trials, sorted from the best to the worst.
+        """
+        if trials is None:
+            trials = self._trials or []
+
+        def fmt_metric(v):
+            return '%.6g' % v if v is not None else '-'
+
+        header = ('trial', 'epoch', 'step', 'best', 'final', 'status',
+                  'config')
+        rows = [header]
+        for t in sorted(trials, key=self._sort_key):
+            config = ', '.join('%s=%r' % (k, v)
+                               for k, v in sorted(six.iteritems(t.config)))
+            rows.append((str(t.index), str(t.epoch), str(t.step),
+                         fmt_metric(t.best_metric),
+                         fmt_metric(t.final_metric), t.status, config))
+        widths = [max(len(r[i]) for r in rows) for i in range(len(header))]
+        return '\n'.join(
+            '  '.join(c.ljust(w) for c, w in zip(r, widths)).rstrip()
+            for r in rows
+        )
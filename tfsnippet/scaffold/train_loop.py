@@ -4,12 +4,16 @@ import time
 from collections import OrderedDict
 from contextlib import contextmanager
 
+import numpy as np
 import six
 import tensorflow as tf
 
-from tfsnippet.utils import MetricAccumulator
+from tfsnippet.utils import (MetricAccumulator, VariableSaver,
+                             get_default_session_or_error)
 from .logging import (SummaryWriter, get_variables_summary, MetricFormatter,
-                      MetricLogger)
+                      MetricLogger, _print_function)
+from .multi_step import stack_steps
+from .profiling import StepTracer
 from .validation import _EarlyStopping, early_stopping as open_early_stopping
 
 __all__ = [
@@ -18,11 +22,44 @@ __all__ = [
 
 _EPOCH_TIME_METRIC = 'epoch_time'
 _STEP_TIME_METRIC = 'step_time'
+_DATA_TIME_METRIC = 'data_time'
+_EXAMPLES_PER_SEC_METRIC = 'examples_per_sec'
 
 
-def _print_function(message):
-    """Default print function, that outputs `message` to stdout."""
-    print(message)
+def _count_examples(step_data, stacked, default):
+    """Count the examples in `step_data`, or return `default` if unknown."""
+    if isinstance(step_data, (tuple, list)) and step_data:
+        step_data = step_data[0]
+    if isinstance(step_data, np.ndarray):
+        ndims = 2 if stacked else 1
+        if len(step_data.shape) >= ndims:
+            return int(np.prod(step_data.shape[:ndims]))
+    return default
+
+
+def _parse_valid_metric(valid_metric):
+    """Parse the name of the validation metric and its order.
+
+    Parameters
+    ----------
+    valid_metric : str | (str, bool)
+        The `valid_metric` argument of `train_loop`.
+
+    Returns
+    -------
+    (str, bool)
+        The name of the metric, and whether or not smaller is better.
+    """
+    smaller_is_better = True
+    if valid_metric:
+        if isinstance(valid_metric, six.string_types):
+            smaller_is_better = not (
+                valid_metric.endswith('acc') or
+                valid_metric.endswith('accuracy')
+            )
+        else:
+            valid_metric, smaller_is_better = valid_metric
+    return valid_metric, smaller_is_better
 
 
 class _TrainLoop(object):
@@ -62,6 +99,14 @@ class _TrainLoop(object):
 
     max_epoch, max_step : int
         The configured maximum values for epoch and step counter.
+
+    step_tracer : StepTracer
+        Optional tracer of the selected steps, used by `run`.
+
+    checkpoint_saver : VariableSaver
+        Optional saver of the training checkpoints, used by
+        `save_checkpoint`.  The state of this loop should be included
+        in its `state_objects`.
     """
 
     def __init__(self,
@@ -76,8 +121,12 @@ class _TrainLoop(object):
                  initial_epoch,
                  initial_step,
                  max_epoch,
-                 max_step):
+                 max_step,
+                 step_tracer=None,
+                 checkpoint_saver=None):
         self._param_vars = param_vars
+        self._checkpoint_saver = checkpoint_saver
+        self._step_tracer = step_tracer
         self._print_function = print_function
         self._metric_formatter = metric_formatter
         self._early_stopping = early_stopping
@@ -87,7 +136,8 @@ class _TrainLoop(object):
 
         # metric accumulators
         self._step_metrics = MetricLogger(self._metric_formatter)
-        self._epoch_metrics = MetricLogger(self._metric_formatter)
+        self._epoch_metrics = MetricLogger(self._metric_formatter,
+                                           percentiles=True)
 
         # flag to track the context
         self._within_epoch = False
@@ -101,9 +151,15 @@ class _TrainLoop(object):
 
         # epoch and step context flags
         self._best_valid_metric = initial_valid_metric
+        self._last_valid_metric = None
         self._is_best_valid_metric = False
         self._epoch_start_time = None
         self._step_start_time = None
+        self._step_data_time = None
+        self._step_batch_size = None
+
+        # the validators running in background
+        self._async_validators = []
 
     def _commit_epoch_start_time(self):
         if self._epoch_start_time is not None:
@@ -114,8 +170,16 @@ class _TrainLoop(object):
     def _commit_step_start_time(self):
         if self._step_start_time is not None:
             duration = time.time() - self._step_start_time
-            self.add_metrics(metrics={_STEP_TIME_METRIC: duration})
+            metrics = {_STEP_TIME_METRIC: duration}
+            if self._step_data_time is not None:
+                metrics[_DATA_TIME_METRIC] = self._step_data_time
+                duration += self._step_data_time
+            if self._step_batch_size is not None and duration > 0:
+                metrics[_EXAMPLES_PER_SEC_METRIC] = \
+                    self._step_batch_size / duration
+            self.add_metrics(metrics=metrics)
             self._step_start_time = None
+            self._step_data_time = None
 
     @property
     def summary_writer(self):
@@ -160,11 +224,36 @@ class _TrainLoop(object):
         """Get the best valid metric."""
         return self._best_valid_metric
 
+    @property
+    def last_valid_metric(self):
+        """Get the last valid metric, or None if not added yet."""
+        return self._last_valid_metric
+
     @property
     def summary_writer(self):
         """Get the summary writer."""
         return self._summary_writer
 
+    @property
+    def step_tracer(self):
+        """Get the step tracer."""
+        return self._step_tracer
+
+    @property
+    def checkpoint_saver(self):
+        """Get the saver of the training checkpoints."""
+        return self._checkpoint_saver
+
+    @property
+    def should_stop(self):
+        """Whether or not the early-stopping patience has been exhausted?
+
+        If True, both `iter_epochs` and `iter_steps` will stop before
+        entering the next epoch or step.
+        """
+        return (self._early_stopping is not None and
+                self._early_stopping.should_stop)
+
     def iter_epochs(self):
         """Iterate through the epochs.
 
@@ -182,7 +271,8 @@ class _TrainLoop(object):
         def loop_condition():
             return (
                 (self._max_epoch is None or self._epoch < self._max_epoch) and
-                (self._max_step is None or self._step < self._max_step)
+                (self._max_step is None or self._step < self._max_step) and
+                not self.should_stop
             )
 
         if self._within_epoch:
@@ -193,7 +283,11 @@ class _TrainLoop(object):
                 self._within_epoch = True
                 self._epoch_start_time = time.time()
                 yield self._epoch
+                self._poll_async_validators()
                 self._commit_epoch_start_time()
+                self._within_epoch = False
+                if self._checkpoint_saver is not None:
+                    self.save_checkpoint()
         finally:
             self._within_epoch = False
             self._epoch_start_time = None
@@ -201,28 +295,60 @@ class _TrainLoop(object):
             self._epoch_metrics.clear()
             self._is_best_valid_metric = False
 
-    def iter_steps(self, data_generator=None):
+    def iter_steps(self, data_generator=None, batch_size=None,
+                   steps_per_run=1):
         """Iterate through the steps.
 
         This method can only be called when there's no other step loop
         is being iterated, and an epoch loop is active.
 
+        Besides the "step_time" metric, i.e., the time spent on the step
+        body, the time spent on waiting for the step data from
+        `data_generator` is recorded as the "data_time" metric, such that
+        one may tell whether the training is input-bound or compute-bound.
+        If `batch_size` is known, the "examples_per_sec" metric will also
+        be recorded, counting the actual number of examples if the step
+        data are NumPy arrays (e.g., the last incomplete mini-batch).
+
+        If `steps_per_run` is larger than 1, each iteration of this loop
+        would run several training steps at once, e.g., by an operation
+        built with `multi_step_train_op`.  The mini-batches of consecutive
+        steps are stacked by `stack_steps`, and the step counter advances
+        by the number of stacked steps at each iteration.  Note that the
+        step counter may exceed `max_step` by less than `steps_per_run`.
+
         Parameters
         ----------
         data_generator
             Optional iterable data to be yielded at every step.
 
             This is required if `max_step` is not configured, so as to
-            prevent an unstoppable step loop.
+            prevent an unstoppable step loop.  If the iterator obtained
+            from `data_generator` has a `close` method (e.g., a generator
+            or a `PrefetchIterator`), it will be closed on exit.
+
+        batch_size : int
+            Number of examples in each step, to compute the throughput.
+            If not specified, will use ``data_generator.batch_size`` if
+            available (e.g., a `MiniBatchIterator`).
+
+        steps_per_run : int
+            The maximum number of steps to run at each iteration.
+            (default 1)
 
         Yields
         ------
         int | (int, any)
             The global step counter (starting from 1), or the step
-            and data if `data_generator` is specified.
+            and data if `data_generator` is specified.  If `steps_per_run`
+            is larger than 1, the step counter will be the last step of
+            each iteration, and the data will be the stacked arrays.
         """
         def loop_condition():
-            return self._max_step is None or self._step < self._max_step
+            return (
+                (self._max_step is None or self._step < self._max_step) and
+                not self.should_stop
+            )
 
         if not self._within_epoch:
             raise RuntimeError('Step loop must be opened within active epoch '
@@ -233,31 +359,64 @@ class _TrainLoop(object):
             raise RuntimeError('`data_generator` is required when `max_step` '
                                'is not configured, so as to prevent an '
                                'unstoppable step loop.')
+        if steps_per_run < 1:
+            raise ValueError('`steps_per_run` must be at least 1.')
+
+        if batch_size is None:
+            batch_size = getattr(data_generator, 'batch_size', None)
 
+        data_iterator = None
         try:
             if data_generator is not None:
-                data_generator = iter(data_generator)
+                data_iterator = data_generator = iter(data_generator)
+                if steps_per_run > 1:
+                    data_generator = stack_steps(data_iterator, steps_per_run)
 
             while loop_condition():
                 # prepare for the step data
                 if data_generator is None:
-                    yield_obj = self._step + 1
+                    num_steps = steps_per_run
+                    if self._max_step is not None:
+                        num_steps = min(num_steps,
+                                        self._max_step - self._step)
+                    yield_obj = self._step + num_steps
                 else:
+                    data_start_time = time.time()
                     try:
                         step_data = next(data_generator)
                     except StopIteration:
                         break
-                    yield_obj = self._step + 1, step_data
+                    num_steps = 1
+                    if steps_per_run > 1:
+                        num_steps = len(step_data[0])
+                    yield_obj = self._step + num_steps, step_data
 
                 # yield this step
-                self._step += 1
+                self._step += num_steps
                 self._within_step = True
+                self._poll_async_validators()
                 self._step_start_time = time.time()
+                if data_generator is not None:
+                    self._step_data_time = \
+                        self._step_start_time - data_start_time
+                if batch_size is not None:
+                    self._step_batch_size = batch_size * num_steps
+                    if data_generator is not None:
+                        self._step_batch_size = _count_examples(
+                            step_data, steps_per_run > 1,
+                            self._step_batch_size
+                        )
                 yield yield_obj
                 self._commit_step_start_time()
         finally:
             self._within_step = False
             self._step_start_time = None
+            self._step_data_time = None
+            self._step_batch_size = None
+            # release the resources (e.g., background threads) held by
+            # the data iterator, if the step loop exits early
+            if data_iterator is not None and hasattr(data_iterator, 'close'):
+                data_iterator.close()
 
     def _require_context(self):
         if not self._within_epoch and not self._within_step:
@@ -326,33 +485,204 @@ class _TrainLoop(object):
         self._require_context()
         if metrics is not None and not isinstance(metrics, dict):
             raise TypeError('`metrics` should be a dict.')
-
+        if kwargs:
+            metrics = dict(metrics or ())
+            metrics.update(kwargs)
+        self._add_metrics(metrics, global_step=self.step)
+
+    def _add_metrics(self, metrics, global_step, session=None):
+        """Add metric values, which are evaluated at `global_step`.
+
+        The metrics will be added to the collectors of the active loops,
+        and written as summaries at `global_step`.  If `session` is
+        specified, the early-stopping context will save the parameters
+        from this session, if the validation metric is improved.
+        """
+        if not metrics:
+            return
         if self._within_epoch:
-            self._epoch_metrics.add_metrics(metrics, **kwargs)
+            self._epoch_metrics.add_metrics(metrics)
         if self._within_step:
-            self._step_metrics.add_metrics(metrics, **kwargs)
+            self._step_metrics.add_metrics(metrics)
         if self._summary_writer:
-            self._summary_writer.add_metrics(self.step, metrics, **kwargs)
-
-        def update_valid_metric(d):
-            v = d.get(self._valid_metric)
-            if v is not None:
-                if self._best_valid_metric is None or \
-                        (self._valid_metric_smaller_is_better and
-                         v < self._best_valid_metric) or \
-                        (not self._valid_metric_smaller_is_better and
-                         v > self._best_valid_metric):
-                    self._best_valid_metric = v
-                    self._is_best_valid_metric = True
-                else:
-                    self._is_best_valid_metric = False
-                if self._early_stopping:
-                     self._early_stopping.update(v, self.step)
-        if self._valid_metric:
-            if metrics:
-                update_valid_metric(metrics)
-            if kwargs:
-                update_valid_metric(kwargs)
+            self._summary_writer.add_metrics(global_step, metrics)
+
+        v = metrics.get(self._valid_metric) if self._valid_metric else None
+        if v is not None:
+            self._last_valid_metric = v
+            if self._early_stopping:
+                # the best metric should match the parameters restored by
+                # early-stopping, thus follow its criterion (e.g., min_delta)
+                improved = self._early_stopping.update(
+                    v, global_step, self.epoch, session=session)
+            else:
+                improved = (
+                    self._best_valid_metric is None or
+                    (self._valid_metric_smaller_is_better and
+                     v < self._best_valid_metric) or
+                    (not self._valid_metric_smaller_is_better and
+                     v > self._best_valid_metric)
+                )
+            if improved:
+                self._best_valid_metric = v
+            self._is_best_valid_metric = improved
+
+    def get_state(self):
+        """Get the JSON-compatible state of this training loop.
+
+        If called within an epoch, the epoch counter of the state will be
+        the last completed epoch, and the metrics collected so far in this
+        epoch will be included, such that the epoch can be resumed.
+
+        Returns
+        -------
+        dict[str, any]
+            The state, which can be restored by `set_state`.
+        """
+        def to_float(v):
+            return float(v) if v is not None else None
+
+        state = {
+            'epoch': self._epoch,
+            'step': self._step,
+            'best_valid_metric': to_float(self._best_valid_metric),
+            'last_valid_metric': to_float(self._last_valid_metric),
+            'epoch_metrics': None,
+            'step_metrics': None,
+            'early_stopping': None,
+        }
+        if self._within_epoch:
+            state['epoch'] -= 1
+            state['epoch_metrics'] = self._epoch_metrics.get_state()
+            state['step_metrics'] = self._step_metrics.get_state()
+        if self._early_stopping is not None:
+            state['early_stopping'] = self._early_stopping.get_state()
+        return state
+
+    def set_state(self, state):
+        """Restore the state of this training loop.
+
+        Parameters
+        ----------
+        state : dict[str, any]
+            The state obtained by `get_state`.
+        """
+        self._epoch = int(state['epoch'])
+        self._step = int(state['step'])
+        self._best_valid_metric = state.get('best_valid_metric')
+        self._last_valid_metric = state.get('last_valid_metric')
+        if state.get('epoch_metrics') is not None:
+            self._epoch_metrics.set_state(state['epoch_metrics'])
+        if state.get('step_metrics') is not None:
+            self._step_metrics.set_state(state['step_metrics'])
+        if self._early_stopping is not None and \
+                state.get('early_stopping') is not None:
+            self._early_stopping.set_state(state['early_stopping'])
+
+    def save_checkpoint(self):
+        """Save a checkpoint of the variables and the state of this loop.
+
+        The checkpoint will be restored by `train_loop` when it is opened
+        with the same `checkpoint_dir` again.  A checkpoint is saved at the
+        end of every epoch automatically, while this method may be called
+        at any time to save a checkpoint within an epoch.  In the latter
+        case, the interrupted epoch will be resumed, and the data iterators
+        should be included in `state_objects` of `train_loop`, so as to
+        resume from the next mini-batch.
+        """
+        if self._checkpoint_saver is None:
+            raise RuntimeError('`checkpoint_dir` has not been configured.')
+        if self._early_stopping is not None:
+            # the checkpoint state should match the early-stopping directory
+            self._early_stopping.flush()
+        self._checkpoint_saver.save(self._step)
+
+    def _restore_checkpoint(self):
+        """Restore the variables and the state from the newest checkpoint."""
+        saver = self._checkpoint_saver
+        if saver is not None and saver.get_latest_file():
+            saver.restore()
+            self.println('Resumed from the checkpoint at epoch %d, step %d.' %
+                         (self._epoch, self._step))
+
+    def _poll_async_validators(self, wait=False):
+        """Deliver the metrics of finished `AsyncValidator`s."""
+        for validator in list(self._async_validators):
+            validator.poll(wait=wait)
+
+    def run(self, fetches, feed_dict=None, metrics=None, metrics_interval=1,
+            session=None):
+        """Run `fetches` in the session, along with tensor-valued metrics.
+
+        The metric tensors are fetched by the same ``session.run`` call as
+        `fetches` (e.g., the training operation), and their values are
+        added by `add_metrics`, so that monitoring the training requires no
+        extra session round-trip.  For example:
+
+            for step, (x, y) in loop.iter_steps(data_iterator):
+                loop.run(train_op, feed_dict={input_x: x, input_y: y},
+                         metrics={'loss': loss, 'grad_norm': grad_norm},
+                         metrics_interval=10)
+
+        If `step_tracer` is configured, and the current step is selected
+        by the tracer, the session will be run with full tracing.
+
+        Parameters
+        ----------
+        fetches : any
+            The operation or tensor (or a list / dict of them) to run.
+            Can be None if only the metrics should be fetched.
+
+        feed_dict : dict[tf.Tensor, any]
+            Optional feed dict for running the session.
+
+        metrics : dict[str, tf.Tensor]
+            Optional dict of metric tensors.
+
+        metrics_interval : int
+            Fetch the metrics only if the step counter is a multiple of
+            this interval. (default 1)
+
+            Ignored if there is no active step loop, i.e., the metrics are
+            always fetched within an epoch loop.
+
+        session : tf.Session
+            The session to run.  If not specified, use the active session.
+
+        Returns
+        -------
+        any
+            The outputs of `fetches`.
+        """
+        self._require_context()
+        if metrics is not None and not isinstance(metrics, dict):
+            raise TypeError('`metrics` should be a dict.')
+        if metrics_interval < 1:
+            raise ValueError('`metrics_interval` must be at least 1.')
+        session = session or get_default_session_or_error()
+
+        if metrics and (not self._within_step or
+                        self._step % metrics_interval == 0):
+            names = list(metrics)
+            metric_tensors = [metrics[n] for n in names]
+            if fetches is None:
+                outputs, values = None, self._session_run(
+                    session, metric_tensors, feed_dict)
+            else:
+                outputs, values = self._session_run(
+                    session, [fetches, metric_tensors], feed_dict)
+            self.add_metrics(metrics=dict(zip(names, values)))
+            return outputs
+        if fetches is not None:
+            return self._session_run(session, fetches, feed_dict)
+
+    def _session_run(self, session, fetches, feed_dict):
+        tracer = self._step_tracer
+        if tracer is not None and self._within_step and \
+                tracer.should_trace(self._step):
+            return tracer.trace(session, fetches, self._step,
+                                feed_dict=feed_dict)
+        return session.run(fetches, feed_dict=feed_dict)
 
     def add_summary(self, summary):
         """Add a summary object.
@@ -404,11 +734,16 @@ class _TrainLoop(object):
         collector.  Otherwise if there's only an epoch loop, it will
         print metrics from the epoch metrics accumulator.
 
+        The epoch logs also include the p50, p90, p99 and max values of the
+        timing metrics, whose histograms will be written as summaries if
+        `summary_writer` is configured.
+
         The metrics of corresponding loop context will be cleared after
         the logs are printed.  Besides, the epoch or step timer will be
         committed as metric immediately when this method is called.
         So it must be called at the end of an epoch or a step.
         """
+        self._poll_async_validators()
         if self._within_step:
             self._commit_step_start_time()
             metrics = self._step_metrics
@@ -421,6 +756,9 @@ class _TrainLoop(object):
         best_mark = ' (*)' if self._is_best_valid_metric else ''
         self.println('%s%s' % (metrics.format_logs(), best_mark),
                      with_tag=True)
+        if self._summary_writer and not self._within_step:
+            self._summary_writer.add_histograms(
+                self.step, histograms=metrics.histograms)
         self._is_best_valid_metric = False
         metrics.clear()
 
@@ -437,7 +775,11 @@ def train_loop(param_vars,
                initial_epoch=0,
                initial_step=0,
                max_epoch=None,
-               max_step=None):
+               max_step=None,
+               step_tracer=None,
+               checkpoint_dir=None,
+               checkpoint_vars=None,
+               state_objects=None):
     """Open a training loop context.
 
     This method should open a context for training loop, and provide an object
@@ -505,11 +847,17 @@ def train_loop(param_vars,
     initial_valid_metric : float | tf.Tensor | tf.Variable
         The initial value of the metric used for early-stopping.
 
-    early_stopping : bool
+    early_stopping : bool | dict
         Whether or not to do early-stopping? (default False)
 
         If True, early-stopping will be applied on `param_vars`, according
-        to the `valid_metric`.
+        to the `valid_metric`.  If a dict is specified, it will be used as
+        the keyword arguments of `early_stopping` from
+        `tfsnippet.scaffold.validation`, e.g., ``{'patience': 5,
+        'min_delta': 1e-4}``.  The loop will end as soon as the patience
+        is exhausted.  The best validation metric will then be judged by
+        early-stopping, e.g., improvements less than `min_delta` will not
+        be regarded as the best.
 
     initial_epoch, initial_step : int | tf.Tensor | tf.Variable
         The initial epoch and step counter (default 0).
@@ -520,6 +868,35 @@ def train_loop(param_vars,
     max_epoch, max_step : int | tf.Tensor | tf.Variable
         The configured maximum values for epoch and step counter.
 
+    step_tracer : StepTracer
+        Tracer of the selected steps run by `_TrainLoop.run`.
+
+        If not specified, will construct one by ``StepTracer.from_env``,
+        saving the traces to `summary_dir` by default.
+
+    checkpoint_dir : str
+        Directory to save the training checkpoints.  (default None)
+
+        If specified, a checkpoint of `checkpoint_vars`, `state_objects`
+        and the loop state (i.e., the epoch and step counters, the best
+        validation metric, the metrics collected in the interrupted epoch,
+        and the early-stopping state) will be saved at the end of every
+        epoch, and by ``loop.save_checkpoint()``.  If this directory
+        already contains a checkpoint, the newest one will be restored on
+        entering the loop, overriding the initial counters and metric.
+        The early-stopping parameters will be saved in the sub-directory
+        "early_stopping", unless its `save_dir` is specified.
+
+    checkpoint_vars : list[tf.Variable] | dict[str, tf.Variable]
+        The variables to be saved in the checkpoints, which should include
+        the optimizer slots and the global step, in order to resume the
+        training exactly.  (default ``tf.global_variables()``)
+
+    state_objects : dict[str, any]
+        Optional dict of objects with ``get_state()`` and ``set_state(state)``
+        methods (e.g., the training data iterators), whose states will be
+        saved in the checkpoints.  The key "train_loop" is reserved.
+
     Yields
     ------
     _TrainLoop
@@ -539,16 +916,7 @@ def train_loop(param_vars,
     if isinstance(max_step, (tf.Variable, tf.Tensor)):
         max_step = int(max_step.eval())
 
-    smaller_is_better = True
-    if valid_metric:
-        if isinstance(valid_metric, six.string_types):
-            valid_metric = valid_metric
-            smaller_is_better = not (
-                valid_metric.endswith('acc') or
-                valid_metric.endswith('accuracy')
-            )
-        else:
-            valid_metric, smaller_is_better = valid_metric
+    valid_metric, smaller_is_better = _parse_valid_metric(valid_metric)
 
     close_summary_writer = False
     if isinstance(summary_writer, tf.summary.FileWriter):
@@ -565,6 +933,13 @@ def train_loop(param_vars,
             'got %r.' % (summary_writer,)
         )
 
+    if step_tracer is None:
+        step_tracer = StepTracer.from_env(
+            output_dir=summary_dir, summary_writer=summary_writer,
+            print_function=print_function
+        )
+
+    loop = None
     try:
         loop = _TrainLoop(
             param_vars=param_vars,
@@ -579,15 +954,40 @@ def train_loop(param_vars,
             initial_step=initial_step,
             max_epoch=max_epoch,
             max_step=max_step,
+            step_tracer=step_tracer,
         )
+        if checkpoint_dir is not None:
+            checkpoint_dir = os.path.abspath(checkpoint_dir)
+            if checkpoint_vars is None:
+                checkpoint_vars = tf.global_variables()
+            state_objects = dict(state_objects or ())
+            state_objects['train_loop'] = loop
+            loop._checkpoint_saver = VariableSaver(
+                checkpoint_vars, checkpoint_dir, state_objects=state_objects)
+
         if early_stopping and len(param_vars) > 0:
-            with open_early_stopping(param_vars,
-                                     initial_metric=initial_valid_metric,
-                                     smaller_is_better=smaller_is_better) as es:
+            es_kwargs = {}
+            if isinstance(early_stopping, dict):
+                es_kwargs.update(early_stopping)
+            es_kwargs.setdefault('initial_metric', initial_valid_metric)
+            es_kwargs.setdefault('smaller_is_better', smaller_is_better)
+            if checkpoint_dir is not None and not es_kwargs.get('save_dir'):
+                # the best parameters should survive the restarts
+                es_kwargs['save_dir'] = os.path.join(
+                    checkpoint_dir, 'early_stopping')
+                es_kwargs.setdefault('cleanup', False)
+            with open_early_stopping(param_vars, **es_kwargs) as es:
                 loop._early_stopping = es
+                loop._restore_checkpoint()
                 yield loop
+                loop._poll_async_validators(wait=True)
         else:
+            loop._restore_checkpoint()
             yield loop
+            loop._poll_async_validators(wait=True)
     finally:
+        if loop is not None:
+            for validator in list(loop._async_validators):
+                validator.close()
         if close_summary_writer:
             summary_writer.close()
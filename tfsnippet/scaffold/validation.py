@@ -3,25 +3,101 @@ from __future__ import absolute_import
 
 import os
 import shutil
+import sys
+import threading
+import time
 import warnings
 from contextlib import contextmanager
 from logging import getLogger
 
+import six
 import tensorflow as tf
-from tfsnippet.utils import VariableSaver, TemporaryDirectory, makedirs
+from tfsnippet.utils import (VariableSaver, TemporaryDirectory, makedirs,
+                             get_default_session_or_error, humanize_duration)
 
 __all__ = [
     'early_stopping',
     '_EarlyStopping',
+    'AsyncValidator',
 ]
 
 
+class _VariableSnapshot(object):
+    """In-memory snapshot of the variable values.
+
+    This class provides the same `save` and `restore` methods as
+    `VariableSaver`, but holds the saved values as NumPy arrays in memory.
+    The assign operations for restoring are created only once.
+
+    Parameters
+    ----------
+    variables : list[tf.Variable] | dict[str, tf.Variable]
+        List or dict of variables to be memorized.
+    """
+
+    def __init__(self, variables):
+        if isinstance(variables, dict):
+            variables = [v for _, v in sorted(six.iteritems(variables))]
+        self._variables = list(variables)
+        with tf.name_scope('variable_snapshot'):
+            self._placeholders = [
+                tf.placeholder(dtype=v.dtype.base_dtype, shape=v.get_shape())
+                for v in self._variables
+            ]
+            self._assign_op = tf.group(*[
+                tf.assign(v, p)
+                for v, p in zip(self._variables, self._placeholders)
+            ])
+        self._values = None
+
+    @property
+    def variables(self):
+        """Get the list of variables to be memorized."""
+        return self._variables
+
+    @property
+    def values(self):
+        """Get or set the memorized values (or None if not saved)."""
+        return self._values
+
+    @values.setter
+    def values(self, values):
+        self._values = values
+
+    def save(self, global_step=None, session=None):
+        """Memorize the current values of the variables."""
+        session = session or get_default_session_or_error()
+        self._values = session.run(self._variables)
+
+    def restore(self, session=None):
+        """Restore the memorized values of the variables, if saved."""
+        if self._values is not None:
+            session = session or get_default_session_or_error()
+            session.run(
+                self._assign_op,
+                feed_dict=dict(zip(self._placeholders, self._values))
+            )
+
+
+def _variables_nbytes(variables):
+    """Get the total bytes of `variables`, or None if any shape is unknown."""
+    if isinstance(variables, dict):
+        variables = list(six.itervalues(variables))
+    ret = 0
+    for v in variables:
+        count = v.get_shape().num_elements()
+        if count is None:
+            return None
+        ret += count * v.dtype.base_dtype.size
+    return ret
+
+
 class _EarlyStopping(object):
     """Class to hold the best loss within an early-stopping context.
 
     Parameters
     ----------
-    saver : VariableSaver
+    saver : VariableSaver | _VariableSnapshot
         The variable saver for early-stopping.
 
     best_metric : float
@@ -29,15 +105,97 @@ class _EarlyStopping(object):
 
     smaller_is_better : bool
         Whether or not the less, the better loss? (default True)
+
+    patience : int
+        Stop training if the metric has not been improved for this number
+        of epochs or steps. (default None, never stop)
+
+    patience_unit : {'epoch', 'step'}
+        The unit of `patience`. (default 'epoch')
+
+        If the corresponding counter is not given to `update`, the number
+        of `update` calls will be used as the counter instead.
+
+    min_delta : float
+        Minimum change of the metric to be regarded as an improvement.
+        (default 0.)
+
+    min_save_interval : float
+        Minimum seconds between two saves. (default None)
+
+        Improvements within this interval after the last save are still
+        recorded as the best metric, but their parameters are only
+        memorized in `pending`, and saved by the first `update` after the
+        interval, by `flush`, or on exit.
+
+    pending : _VariableSnapshot
+        The snapshot to memorize the parameters of the pending improvement,
+        required if `min_save_interval` is specified.
     """
 
-    def __init__(self, saver, best_metric=None, smaller_is_better=True):
+    def __init__(self, saver, best_metric=None, smaller_is_better=True,
+                 patience=None, patience_unit='epoch', min_delta=0.,
+                 min_save_interval=None, pending=None):
+        if patience is not None and patience < 1:
+            raise ValueError('`patience` must be at least 1.')
+        if patience_unit not in ('epoch', 'step'):
+            raise ValueError('`patience_unit` must be either \'epoch\' or '
+                             '\'step\'.')
+        if min_delta < 0:
+            raise ValueError('`min_delta` must be non-negative.')
+        if min_save_interval is not None and pending is None:
+            raise ValueError('`pending` must be specified along with '
+                             '`min_save_interval`.')
         self._saver = saver
         self._best_metric = best_metric
         self._smaller_is_better = smaller_is_better
+        self._patience = patience
+        self._patience_unit = patience_unit
+        self._min_delta = min_delta
+        self._min_save_interval = min_save_interval
+        self._pending = pending
+        self._pending_step = None
+        self._pending_session = None
         self._ever_updated = False
+        self._update_count = 0
+        self._best_counter = None
+        self._should_stop = False
+        self._last_save_time = None
+        self._save_count = 0
+        self._save_time = 0.
+
+    def _save(self, global_step, session=None):
+        """Save the variables via the saver, and count the time."""
+        start_time = time.time()
+        if session is not None:
+            self._saver.save(global_step, session=session)
+        else:
+            self._saver.save(global_step)
+        self._last_save_time = time.time()
+        self._save_time += self._last_save_time - start_time
+        self._save_count += 1
+        # the pending improvement is superseded by this save
+        self._discard_pending()
+
+    def _discard_pending(self):
+        if self._pending is not None:
+            self._pending.values = None
+        self._pending_step = None
+        self._pending_session = None
+
+    def _is_throttled(self):
+        return (self._min_save_interval is not None and
+                self._last_save_time is not None and
+                time.time() - self._last_save_time < self._min_save_interval)
+
+    def _is_improved(self, metric):
+        if self._best_metric is None:
+            return True
+        if self._smaller_is_better:
+            return metric < self._best_metric - self._min_delta
+        return metric > self._best_metric + self._min_delta
 
-    def update(self, metric, global_step=None):
+    def update(self, metric, global_step=None, epoch=None, session=None):
         """Update the best metric.
 
         Parameters
@@ -48,20 +206,102 @@ class _EarlyStopping(object):
         global_step : int
             Optional global step counter.
 
+        epoch : int
+            Optional epoch counter.
+
+        session : tf.Session
+            The session holding the variable values, at which `metric` has
+            been evaluated.  If specified, the improvement will be saved
+            from this session immediately, regardless of
+            `min_save_interval`.
+
         Returns
         -------
         bool
             Whether or not the best loss has been updated?
         """
         self._ever_updated = True
-        if self._best_metric is None or \
-                (self._smaller_is_better and metric < self._best_metric) or \
-                (not self._smaller_is_better and metric > self._best_metric):
-            self._saver.save(global_step)
+        self._update_count += 1
+        counter = epoch if self._patience_unit == 'epoch' else global_step
+        if counter is None:
+            counter = self._update_count
+
+        if self._is_improved(metric):
             self._best_metric = metric
+            self._best_counter = counter
+            if session is None and self._is_throttled():
+                # memorize the parameters of this improvement, and save
+                # them later, since the variables may change before that
+                session = get_default_session_or_error()
+                self._pending.save(session=session)
+                self._pending_step = global_step
+                self._pending_session = session
+            else:
+                self._save(global_step, session)
             return True
+
+        if self.has_pending and not self._is_throttled():
+            self.flush()
+        if self._patience is not None:
+            if self._best_counter is None:
+                # the initial best metric has never been improved
+                self._best_counter = counter - 1
+            if counter - self._best_counter >= self._patience:
+                self._should_stop = True
         return False
 
+    def flush(self):
+        """Save the parameters of the pending improvement, if any."""
+        if not self.has_pending:
+            return
+        pending, session = self._pending, self._pending_session
+        current = session.run(pending.variables)
+        pending.restore(session=session)
+        try:
+            self._save(self._pending_step, session)
+        finally:
+            # put back the current values of the variables
+            pending.values = current
+            pending.restore(session=session)
+            pending.values = None
+
+    def get_state(self):
+        """Get the JSON-compatible state of this early-stopping context.
+
+        The saved parameters are not included.  They should be kept in the
+        saving directory, in order to resume from this state, thus `flush`
+        should be called before saving this state.
+
+        Returns
+        -------
+        dict[str, any]
+            The state, which can be restored by `set_state`.
+        """
+        best_metric = self._best_metric
+        if best_metric is not None:
+            best_metric = float(best_metric)
+        return {
+            'best_metric': best_metric,
+            'ever_updated': self._ever_updated,
+            'update_count': self._update_count,
+            'best_counter': self._best_counter,
+            'should_stop': self._should_stop,
+        }
+
+    def set_state(self, state):
+        """Restore the state of this early-stopping context.
+
+        Parameters
+        ----------
+        state : dict[str, any]
+            The state obtained by `get_state`.
+        """
+        self._best_metric = state['best_metric']
+        self._ever_updated = bool(state['ever_updated'])
+        self._update_count = int(state['update_count'])
+        self._best_counter = state['best_counter']
+        self._should_stop = bool(state['should_stop'])
+
     @property
     def best_metric(self):
         """Get the current best loss."""
@@ -72,11 +312,74 @@ class _EarlyStopping(object):
         """Check whether or not `update` method has ever been called."""
         return self._ever_updated
 
+    @property
+    def should_stop(self):
+        """Whether or not the patience has been exhausted?"""
+        return self._should_stop
+
+    @property
+    def has_pending(self):
+        """Whether or not there is an improvement not saved yet?"""
+        return self._pending is not None and self._pending.values is not None
+
+    @property
+    def in_memory(self):
+        """Whether or not the best parameters are memorized in memory?"""
+        return isinstance(self._saver, _VariableSnapshot)
+
+    @property
+    def save_count(self):
+        """Get the number of times that the parameters have been saved."""
+        return self._save_count
+
+    @property
+    def save_time(self):
+        """Get the total seconds spent on saving the parameters."""
+        return self._save_time
+
+
+@contextmanager
+def _early_stopping_scope(es, restore_on_error, cleanup_dir):
+    """Restore the best parameters of `es` on exit, and cleanup."""
+    saver = es._saver
+    try:
+        yield es
+    except Exception as ex:
+        if isinstance(ex, KeyboardInterrupt) or restore_on_error:
+            es.flush()
+            saver.restore()
+        raise
+    else:
+        es.flush()
+        saver.restore()
+    finally:
+        if cleanup_dir is not None:
+            try:
+                if os.path.exists(cleanup_dir):
+                    shutil.rmtree(cleanup_dir)
+            except Exception:
+                getLogger(__name__).error(
+                    'Failed to cleanup validation save dir %r.',
+                    cleanup_dir, exc_info=True
+                )
+        if not es.ever_updated:
+            warnings.warn(
+                'Early-stopping metric has never been updated. '
+                'The variables will keep their latest values. '
+                'Did you forget to add corresponding metric?'
+            )
+        getLogger(__name__).debug(
+            'Early-stopping saved the parameters %d time(s) in %s.',
+            es.save_count, humanize_duration(es.save_time)
+        )
+
 
 @contextmanager
 def early_stopping(param_vars, initial_metric=None, save_dir=None,
                    smaller_is_better=True, restore_on_error=False,
-                   cleanup=True, name=None):
+                   cleanup=True, memory_budget=256 * 1024 * 1024,
+                   patience=None, patience_unit='epoch', min_delta=0.,
+                   min_save_interval=None, name=None):
     """Open a context to memorize the values of parameters at best metric.
 
     This method will open a context with an object to memorize the best
@@ -89,8 +392,22 @@ def early_stopping(param_vars, initial_metric=None, save_dir=None,
             ...
 
     Where ``es.update(loss, global_step)`` should cause the parameters to
-    be saved on disk if `loss` is better than the current best metric.
-    One may also get the best metric via ``es.best_metric``.
+    be memorized if `loss` is better than the current best metric.
+    One may also get the best metric via ``es.best_metric``, and the
+    number of times and the seconds spent on saving the parameters via
+    ``es.save_count`` and ``es.save_time``.
+
+    If `save_dir` is not specified, and the total size of the parameters
+    does not exceed `memory_budget`, the parameters will be memorized as
+    NumPy arrays in memory.  Otherwise they will be saved on disk via
+    `VariableSaver`.
+
+    If `patience` is specified, ``es.should_stop`` will become True once
+    the metric has not been improved by at least `min_delta` for `patience`
+    epochs or steps, which should be checked to end the training.  Also,
+    if `min_save_interval` is specified, the parameters of improvements
+    within this interval after the last save will be memorized in memory,
+    and saved once the interval has passed, or on exit.
 
     Note that if no loss is given via ``es.update``, then the variables
     would keep their latest values when exiting the early-stopping context.
@@ -108,7 +425,8 @@ def early_stopping(param_vars, initial_metric=None, save_dir=None,
 
     save_dir : str
         The directory where to save the variable values.
-        If not specified, will use a temporary directory.
+        If not specified, will memorize the values in memory, or use a
+        temporary directory if exceeding `memory_budget`.
 
     smaller_is_better : bool
         Whether or not the less, the better loss? (default True)
@@ -123,6 +441,31 @@ def early_stopping(param_vars, initial_metric=None, save_dir=None,
         This argument will be ignored if `save_dir` is None, while
         the temporary directory will always be deleted on exit.
 
+    memory_budget : int
+        Maximum total bytes of the parameters to be memorized in memory.
+        (default 256MB)
+
+        This argument will be ignored if `save_dir` is specified.
+
+    patience : int
+        Stop training if the metric has not been improved for this number
+        of epochs or steps. (default None, never stop)
+
+    patience_unit : {'epoch', 'step'}
+        The unit of `patience`. (default 'epoch')
+
+    min_delta : float
+        Minimum change of the metric to be regarded as an improvement.
+        (default 0.)
+
+    min_save_interval : float
+        Minimum seconds between two saves. (default None)
+
+        Improvements within this interval after the last save are still
+        recorded as the best metric.  The parameters of the last of them
+        will be memorized in memory, and saved by the first ``es.update``
+        after the interval, or on exit.
+
     name : str
         Optional name of this scope.
 
@@ -135,48 +478,204 @@ def early_stopping(param_vars, initial_metric=None, save_dir=None,
         raise ValueError('`param_vars` must not be empty.')
 
     if save_dir is None:
-        with TemporaryDirectory() as tempdir:
-            with early_stopping(param_vars, initial_metric=initial_metric,
-                                save_dir=tempdir, cleanup=False,
-                                smaller_is_better=smaller_is_better,
-                                restore_on_error=restore_on_error,
-                                name=name) as es:
-                yield es
-
-    else:
-        if isinstance(initial_metric, (tf.Tensor, tf.Variable)):
-            initial_metric = initial_metric.eval()
-
-        with tf.name_scope(name):
+        nbytes = _variables_nbytes(param_vars)
+        if nbytes is None or nbytes > memory_budget:
+            with TemporaryDirectory() as tempdir:
+                with early_stopping(param_vars, initial_metric=initial_metric,
+                                    save_dir=tempdir, cleanup=False,
+                                    smaller_is_better=smaller_is_better,
+                                    restore_on_error=restore_on_error,
+                                    patience=patience,
+                                    patience_unit=patience_unit,
+                                    min_delta=min_delta,
+                                    min_save_interval=min_save_interval,
+                                    name=name) as es:
+                    yield es
+            return
+
+    if isinstance(initial_metric, (tf.Tensor, tf.Variable)):
+        initial_metric = initial_metric.eval()
+
+    with tf.name_scope(name):
+        if save_dir is None:
+            saver = _VariableSnapshot(param_vars)
+            cleanup_dir = None
+        else:
             saver = VariableSaver(param_vars, save_dir)
             save_dir = os.path.abspath(save_dir)
             makedirs(save_dir, exist_ok=True)
+            cleanup_dir = save_dir if cleanup else None
+        pending = None
+        if min_save_interval is not None:
+            pending = _VariableSnapshot(param_vars)
+
+        es = _EarlyStopping(saver,
+                            best_metric=initial_metric,
+                            smaller_is_better=smaller_is_better,
+                            patience=patience,
+                            patience_unit=patience_unit,
+                            min_delta=min_delta,
+                            min_save_interval=min_save_interval,
+                            pending=pending)
+        with _early_stopping_scope(es, restore_on_error, cleanup_dir):
+            yield es
+
+
+class AsyncValidator(object):
+    """Validator which runs on a snapshot of parameters in background.
+
+    This class takes a snapshot of the current values of `param_vars`
+    (which is usually fast), loads the snapshot into a separate session on
+    the same graph, and computes the validation metrics in a background
+    thread, such that the training loop is not blocked by validation.
+    The metrics are delivered back to the training loop (and to its
+    early-stopping context) once available, keyed by the step at which the
+    snapshot has been taken.  For example:
+
+        with train_loop(param_vars, early_stopping=True) as loop:
+            validator = AsyncValidator(
+                loop, lambda sess: {'valid_loss': sess.run(valid_loss)})
+            for epoch in loop.iter_epochs():
+                for step, (x, y) in loop.iter_steps(train_iterator):
+                    loop.run(train_op, feed_dict={input_x: x, input_y: y})
+                    if step % 1000 == 0:
+                        validator.submit()
+
+    The finished validations are delivered by the training loop at the
+    beginning of each step, before printing logs, at the end of each epoch,
+    and at the end of the training loop (which waits for the running one).
+    At most one validation runs at a time: `submit` does nothing and returns
+    False if the previous validation has not been delivered.
+
+    Note that `valid_fn` should only run the existing tensors of the graph,
+    and all the variables which the validation depends on should be
+    included in `param_vars`, since the other variables of the separate
+    session only have their initial values.
 
-            es = _EarlyStopping(saver,
-                                best_metric=initial_metric,
-                                smaller_is_better=smaller_is_better)
+    Parameters
+    ----------
+    loop : _TrainLoop
+        The training loop, where to deliver the validation metrics.
 
-            try:
-                yield es
-            except Exception as ex:
-                if isinstance(ex, KeyboardInterrupt) or restore_on_error:
-                    saver.restore()
-                raise
-            else:
-                saver.restore()
-            finally:
-                if cleanup:
-                    try:
-                        if os.path.exists(save_dir):
-                            shutil.rmtree(save_dir)
-                    except Exception:
-                        getLogger(__name__).error(
-                            'Failed to cleanup validation save dir %r.',
-                            save_dir, exc_info=True
-                        )
-                if not es.ever_updated:
-                    warnings.warn(
-                        'Early-stopping metric has never been updated. '
-                        'The variables will keep their latest values. '
-                        'Did you forget to add corresponding metric?'
-                    )
+    valid_fn : (tf.Session) -> dict[str, float]
+        Function to compute the validation metrics in the given session.
+
+    param_vars : list[tf.Variable] | dict[str, tf.Variable]
+        The variables to be copied. (default ``loop.param_vars``)
+
+    session : tf.Session
+        The session where to take the snapshot.
+        If not specified, use the active session.
+
+    config : tf.ConfigProto
+        Optional config of the separate validation session.
+    """
+
+    def __init__(self, loop, valid_fn, param_vars=None, session=None,
+                 config=None):
+        if param_vars is None:
+            param_vars = loop.param_vars
+        if not param_vars:
+            raise ValueError('`param_vars` must not be empty.')
+        session = session or get_default_session_or_error()
+
+        self._loop = loop
+        self._valid_fn = valid_fn
+        self._session = session
+        with tf.name_scope('async_validator'):
+            self._snapshot = _VariableSnapshot(param_vars)
+            self._init_op = tf.group(
+                tf.variables_initializer(tf.global_variables()),
+                tf.variables_initializer(tf.local_variables())
+            )
+        self._valid_session = tf.Session(graph=session.graph, config=config)
+        self._initialized = False
+        self._thread = None
+        self._step = None
+        self._result = None
+        self._exc_info = None
+        self._closed = False
+        loop._async_validators.append(self)
+
+    @property
+    def session(self):
+        """Get the separate validation session."""
+        return self._valid_session
+
+    @property
+    def is_running(self):
+        """Whether or not a validation has not been delivered?"""
+        return self._thread is not None
+
+    def _thread_main(self):
+        try:
+            if not self._initialized:
+                self._valid_session.run(self._init_op)
+                self._initialized = True
+            self._snapshot.restore(session=self._valid_session)
+            self._result = dict(self._valid_fn(self._valid_session) or {})
+        except Exception:
+            self._exc_info = sys.exc_info()
+
+    def submit(self):
+        """Start a validation on the snapshot at the current step.
+
+        Returns
+        -------
+        bool
+            Whether or not the validation has been started?
+        """
+        if self._closed:
+            raise RuntimeError('The validator has been closed.')
+        if self._thread is not None:
+            return False
+        self._step = self._loop.step
+        self._snapshot.values = self._session.run(self._snapshot.variables)
+        self._result = self._exc_info = None
+        self._thread = threading.Thread(target=self._thread_main,
+                                        name='AsyncValidator')
+        self._thread.daemon = True
+        self._thread.start()
+        return True
+
+    def poll(self, wait=False):
+        """Deliver the finished validation to the training loop.
+
+        Parameters
+        ----------
+        wait : bool
+            Whether or not to wait for the running validation?
+
+        Returns
+        -------
+        bool
+            Whether or not any validation metrics have been delivered?
+        """
+        if self._thread is None:
+            return False
+        if not wait and self._thread.is_alive():
+            return False
+        self._thread.join()
+        self._thread = None
+        if self._exc_info is not None:
+            exc_info, self._exc_info = self._exc_info, None
+            six.reraise(*exc_info)
+        # the separate session holds the snapshot until the next `submit`,
+        # thus early-stopping can save the parameters from it
+        self._loop._add_metrics(self._result, global_step=self._step,
+                                session=self._valid_session)
+        return True
+
+    def close(self):
+        """Wait for the running validation, and close the session.
+
+        The running validation will not be delivered.
+        """
+        if not self._closed:
+            self._closed = True
+            if self._thread is not None:
+                self._thread.join()
+                self._thread = None
+            self._valid_session.close()
+            if self in self._loop._async_validators:
+                self._loop._async_validators.remove(self)
@@ -1,8 +1,10 @@
 # -*- coding: utf-8 -*-
 
 from .configutils import *
+from .dataflow import *
 from .datautils import *
 from .deprecation import *
+from .input_queue import *
 from .misc import *
 from .osutils import *
 from .reuse import *
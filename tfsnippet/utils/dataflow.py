@@ -0,0 +1,954 @@
+# -*- coding: utf-8 -*-
+import ctypes
+import functools
+import hashlib
+import json
+import multiprocessing
+import os
+import sys
+import threading
+import time
+import traceback
+import types
+from logging import getLogger
+
+import numpy as np
+import six
+from six.moves import cPickle as pickle, queue
+
+from .datautils import (minibatch_slices_iterator, MiniBatchIterator,
+                        MemmapDataset, _check_arrays_length)
+
+__all__ = ['PrefetchIterator', 'ProcessMapIterator', 'TransformCache']
+
+
+class _EndOfData(object):
+    """Marker object indicating the end of the source iterator."""
+
+
+class _ErrorItem(object):
+    """Wrapper of the exception raised when fetching an item."""
+
+    def __init__(self, exc_info):
+        self.exc_info = exc_info
+
+
+class PrefetchIterator(object):
+    """Iterator which prefetches items from another iterable in background.
+
+    This class wraps any iterable object (e.g., a generator of mini-batches),
+    fetching its items in one or more background worker threads, and
+    storing them in a bounded queue.  In this way, the construction of
+    mini-batches (slicing, fancy-indexing and any user preprocessing) can be
+    overlapped with the training step, instead of sitting on the critical
+    path of the training loop.  An example of using this iterator is:
+
+        with train_loop(param_vars, max_epoch=10) as loop:
+            for epoch in loop.iter_epochs():
+                data_iterator = PrefetchIterator(
+                    zip(minibatch_iterator(data_x, batch_size),
+                        minibatch_iterator(data_y, batch_size)),
+                    capacity=4
+                )
+                for step, (x, y) in loop.iter_steps(data_iterator):
+                    ...
+
+    The items are always yielded in the same order as the source iterable,
+    even if more than one worker thread is used.  Any exception raised by
+    the source iterable, or by `map_func`, will be re-raised in the consumer
+    thread, at the position of the item which caused the exception.
+
+    Note that the source iterable is consumed only once.  A new instance of
+    `PrefetchIterator` should be constructed for every epoch.
+
+    Parameters
+    ----------
+    iterable : collections.Iterable
+        The source iterable object.
+
+    capacity : int
+        Maximum number of prefetched items in the queue. (default 2)
+
+    num_workers : int
+        Number of background worker threads. (default 1)
+
+        Fetching items from the source iterable is serialized among the
+        workers, thus more than one worker is only useful when `map_func`
+        is specified, and it releases the GIL (e.g., heavy NumPy routines).
+
+    map_func : (any) -> any
+        Optional function to transform each item in the worker threads.
+    """
+
+    def __init__(self, iterable, capacity=2, num_workers=1, map_func=None):
+        if capacity < 1:
+            raise ValueError('`capacity` must be at least 1.')
+        if num_workers < 1:
+            raise ValueError('`num_workers` must be at least 1.')
+        self._iterable = iterable
+        self._capacity = capacity
+        self._num_workers = num_workers
+        self._map_func = map_func
+
+        # the states of the worker threads
+        self._source = None
+        self._source_lock = threading.Lock()
+        self._next_fetch = 0        # sequence number of the next fetched item
+        self._next_put = 0          # sequence number of the next queued item
+        self._put_cond = threading.Condition()
+        self._source_exhausted = False
+        self._queue = None
+        self._workers = None
+        self._closed = False
+        self._finished = False
+
+        # statistics of the consumer
+        self._wait_time = 0.
+        self._last_wait_time = 0.
+        self._counter = 0
+
+    @property
+    def capacity(self):
+        """Get the maximum number of prefetched items."""
+        return self._capacity
+
+    @property
+    def num_workers(self):
+        """Get the number of worker threads."""
+        return self._num_workers
+
+    @property
+    def wait_time(self):
+        """Get the total seconds the consumer has waited on the queue."""
+        return self._wait_time
+
+    @property
+    def last_wait_time(self):
+        """Get the seconds the consumer waited for the last item."""
+        return self._last_wait_time
+
+    @property
+    def counter(self):
+        """Get the number of items which have been yielded."""
+        return self._counter
+
+    def _start(self):
+        self._source = iter(self._iterable)
+        self._queue = queue.Queue(self._capacity)
+        self._workers = []
+        for i in range(self._num_workers):
+            worker = threading.Thread(target=self._worker_main,
+                                      name='PrefetchIterator-%d' % i)
+            worker.daemon = True
+            worker.start()
+            self._workers.append(worker)
+
+    def _fetch(self):
+        """Fetch the next item from the source, with its sequence number."""
+        with self._source_lock:
+            if self._source_exhausted or self._closed:
+                return None, None
+            seq = self._next_fetch
+            self._next_fetch += 1
+            try:
+                item = next(self._source)
+            except StopIteration:
+                self._source_exhausted = True
+                item = _EndOfData()
+            except Exception:
+                self._source_exhausted = True
+                item = _ErrorItem(sys.exc_info())
+        return seq, item
+
+    def _put(self, seq, item):
+        """Put `item` into the queue, after all the preceding items."""
+        with self._put_cond:
+            while self._next_put != seq and not self._closed:
+                self._put_cond.wait()
+        while not self._closed:
+            try:
+                self._queue.put(item, timeout=0.1)
+            except queue.Full:
+                continue
+            else:
+                break
+        with self._put_cond:
+            self._next_put += 1
+            self._put_cond.notify_all()
+
+    def _worker_main(self):
+        while not self._closed:
+            seq, item = self._fetch()
+            if seq is None:
+                break
+            if self._map_func is not None and \
+                    not isinstance(item, (_EndOfData, _ErrorItem)):
+                try:
+                    item = self._map_func(item)
+                except Exception:
+                    with self._source_lock:
+                        self._source_exhausted = True
+                    item = _ErrorItem(sys.exc_info())
+            self._put(seq, item)
+
+    def close(self):
+        """Stop the worker threads and release the source iterator.
+
+        This method will be called automatically when all the items have
+        been consumed, or when an error has been re-raised.  It should be
+        called manually if the iteration is interrupted, unless the iterator
+        is consumed by `_TrainLoop.iter_steps`, which closes the data
+        iterator on exit.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        self._finished = True
+        if self._workers is not None:
+            with self._put_cond:
+                self._put_cond.notify_all()
+            # drain the queue so that no worker is blocked on `put`
+            try:
+                while True:
+                    self._queue.get_nowait()
+            except queue.Empty:
+                pass
+            for worker in self._workers:
+                worker.join()
+            self._workers = None
+            self._queue = None
+        if self._source is not None:
+            if hasattr(self._source, 'close'):
+                self._source.close()
+            self._source = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._finished:
+            raise StopIteration()
+        if self._workers is None:
+            self._start()
+
+        start_time = time.time()
+        item = self._queue.get()
+        self._last_wait_time = time.time() - start_time
+        self._wait_time += self._last_wait_time
+
+        if isinstance(item, _EndOfData):
+            self.close()
+            raise StopIteration()
+        elif isinstance(item, _ErrorItem):
+            self.close()
+            six.reraise(*item.exc_info)
+        self._counter += 1
+        return item
+
+    next = __next__
+
+
+def _as_array_tuple(outputs):
+    """Get the tuple of arrays of `outputs` if they can be shared."""
+    if isinstance(outputs, np.ndarray):
+        return (outputs,)
+    if isinstance(outputs, tuple) and \
+            all(isinstance(o, np.ndarray) for o in outputs):
+        return outputs
+    return None
+
+
+def _arrays_nbytes(arrays, alignment=16):
+    """Get the bytes of aligned `arrays` in a shared buffer."""
+    return sum((a.nbytes + alignment - 1) // alignment * alignment
+               for a in arrays)
+
+
+def _process_map_worker(transform, buffers, task_queue, result_queue):
+    """Main function of the worker processes of `ProcessMapIterator`."""
+    while True:
+        task = task_queue.get()
+        if task is None:
+            break
+        seq, slot, batch = task
+        try:
+            outputs = transform(pickle.loads(batch))
+            arrays = _as_array_tuple(outputs)
+            buffer = buffers[slot]
+            if arrays is not None and \
+                    _arrays_nbytes(arrays) <= len(buffer):
+                # write the arrays into the shared buffer, and send
+                # only the meta data back through the queue
+                meta = []
+                offset = 0
+                for a in arrays:
+                    a = np.ascontiguousarray(a)
+                    target = np.frombuffer(buffer, dtype=a.dtype,
+                                           count=a.size, offset=offset)
+                    target[...] = a.reshape([-1])
+                    meta.append((a.dtype.str, a.shape, offset))
+                    offset += _arrays_nbytes((a,))
+                is_tuple = not isinstance(outputs, np.ndarray)
+                result_queue.put((seq, 'shared', (meta, is_tuple)))
+            else:
+                # pickle the outputs here, since the queue pickles its
+                # items lazily in a background thread, where the errors
+                # cannot be reported
+                result_queue.put(
+                    (seq, 'pickled',
+                     pickle.dumps(outputs, pickle.HIGHEST_PROTOCOL)))
+        except Exception as ex:
+            tb = traceback.format_exc()
+            try:
+                ex = pickle.dumps(ex, pickle.HIGHEST_PROTOCOL)
+            except Exception:
+                ex = None
+            result_queue.put((seq, 'error', (ex, tb)))
+
+
+class ProcessMapIterator(object):
+    """Iterator which maps a transform over items in worker processes.
+
+    This class maps a picklable `transform` over the items of another
+    iterable (e.g., a `MiniBatchIterator`), in a pool of worker processes.
+    Unlike threads, the worker processes are not limited by the GIL, thus
+    this class is suitable for CPU-heavy preprocessing written in pure
+    NumPy or Python.  For example:
+
+        def augment(batch):
+            x, y = batch
+            return random_crop(x), y
+
+        for epoch in loop.iter_epochs():
+            data_iterator = ProcessMapIterator(
+                train_iterator, augment, num_workers=4)
+            for step, (x, y) in loop.iter_steps(data_iterator):
+                ...
+
+    The outputs are yielded in the same order as the source items.
+    If the outputs of `transform` are a NumPy array or a tuple of NumPy
+    arrays, they are sent back to the consumer through shared memory
+    buffers instead of pickling, and the yielded arrays are views of these
+    buffers.  A buffer will be reused once the next item is requested,
+    so the yielded arrays should be copied if they are required to live
+    longer.  Other outputs, or outputs larger than `buffer_size`, are
+    sent back by pickling.
+
+    At most `backlog` items are being processed or waiting to be consumed
+    at any time.  The worker processes are shut down when all the items
+    have been consumed, when an error is raised, or when `close` is
+    called (e.g., by `_TrainLoop.iter_steps` when the step loop exits).
+
+    Parameters
+    ----------
+    iterable : collections.Iterable
+        The source iterable object.
+
+    transform : (any) -> any
+        The picklable function to transform each item.
+
+    num_workers : int
+        Number of worker processes.  If not specified, will use the
+        number of CPU cores.
+
+    backlog : int
+        Maximum number of pending items. (default ``2 * num_workers``)
+
+    buffer_size : int
+        Size in bytes of each shared memory buffer.
+
+        If not specified, the first item will be transformed in the
+        consumer process, and 1.5 times the size of its outputs will be
+        used as the buffer size.
+    """
+
+    def __init__(self, iterable, transform, num_workers=None, backlog=None,
+                 buffer_size=None):
+        if num_workers is None:
+            num_workers = multiprocessing.cpu_count()
+        if num_workers < 1:
+            raise ValueError('`num_workers` must be at least 1.')
+        if backlog is None:
+            backlog = 2 * num_workers
+        if backlog < 1:
+            raise ValueError('`backlog` must be at least 1.')
+        self._iterable = iterable
+        self._transform = transform
+        self._num_workers = num_workers
+        self._backlog = backlog
+        self._buffer_size = buffer_size
+
+        self._source = None
+        self._source_exhausted = False
+        self._first_outputs = None
+        self._buffers = None
+        self._task_queue = None
+        self._result_queue = None
+        self._workers = None
+        self._free_slots = None
+        self._pending = {}      # dict of seq -> slot, for submitted items
+        self._results = {}      # dict of seq -> received results
+        self._next_submit = 0
+        self._next_yield = 0
+        self._held_slot = None  # the slot of the last yielded item
+        self._started = False
+        self._closed = False
+
+    @property
+    def num_workers(self):
+        """Get the number of worker processes."""
+        return self._num_workers
+
+    @property
+    def backlog(self):
+        """Get the maximum number of pending items."""
+        return self._backlog
+
+    @property
+    def buffer_size(self):
+        """Get the size in bytes of each shared memory buffer."""
+        return self._buffer_size
+
+    def _start(self):
+        self._started = True
+        self._source = iter(self._iterable)
+
+        # determine the buffer size by the first item if not specified
+        if self._buffer_size is None:
+            try:
+                first = next(self._source)
+            except StopIteration:
+                self._source_exhausted = True
+                self._buffer_size = 0
+                return
+            outputs = self._transform(first)
+            self._first_outputs = (outputs,)
+            arrays = _as_array_tuple(outputs)
+            nbytes = _arrays_nbytes(arrays) if arrays is not None else 0
+            self._buffer_size = (nbytes * 3 + 1) // 2
+
+        # start the worker processes
+        self._buffers = [
+            multiprocessing.RawArray(ctypes.c_byte, max(self._buffer_size, 1))
+            for _ in range(self._backlog + 1)
+        ]
+        self._free_slots = list(range(len(self._buffers)))
+        self._task_queue = multiprocessing.Queue()
+        self._result_queue = multiprocessing.Queue()
+        self._workers = []
+        for _ in range(self._num_workers):
+            worker = multiprocessing.Process(
+                target=_process_map_worker,
+                args=(self._transform, self._buffers, self._task_queue,
+                      self._result_queue)
+            )
+            worker.daemon = True
+            worker.start()
+            self._workers.append(worker)
+
+    def _submit(self):
+        """Submit the source items until the backlog is full."""
+        while not self._source_exhausted and \
+                len(self._pending) < self._backlog and self._free_slots:
+            try:
+                batch = next(self._source)
+            except StopIteration:
+                self._source_exhausted = True
+                break
+            slot = self._free_slots.pop()
+            seq = self._next_submit
+            self._next_submit += 1
+            self._pending[seq] = slot
+            # pickle the item immediately, since the source iterator
+            # might reuse its buffers (e.g., `MiniBatchIterator`), while
+            # the queue pickles its items lazily in a background thread
+            self._task_queue.put(
+                (seq, slot, pickle.dumps(batch, pickle.HIGHEST_PROTOCOL)))
+
+    def _receive(self, seq):
+        """Receive the results until the result of `seq` is available."""
+        while seq not in self._results:
+            for worker in self._workers:
+                if not worker.is_alive() and worker.exitcode != 0:
+                    raise RuntimeError(
+                        'Worker process exited unexpectedly with code %r.' %
+                        (worker.exitcode,)
+                    )
+            try:
+                result_seq, kind, payload = \
+                    self._result_queue.get(timeout=1)
+            except queue.Empty:
+                continue
+            self._results[result_seq] = (kind, payload)
+        return self._results.pop(seq)
+
+    def close(self):
+        """Shutdown the worker processes and release the source iterator."""
+        if self._closed:
+            return
+        self._closed = True
+        if self._workers is not None:
+            for _ in self._workers:
+                self._task_queue.put(None)
+            # keep draining the result queue, otherwise the worker
+            # processes might block on flushing their results
+            deadline = time.time() + 10
+            while any(w.is_alive() for w in self._workers) and \
+                    time.time() < deadline:
+                try:
+                    self._result_queue.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            for worker in self._workers:
+                if worker.is_alive():
+                    worker.terminate()
+                worker.join()
+            self._task_queue.close()
+            self._result_queue.close()
+            self._workers = None
+        self._buffers = None
+        self._pending.clear()
+        self._results.clear()
+        if self._source is not None:
+            if hasattr(self._source, 'close'):
+                self._source.close()
+            self._source = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._closed:
+            raise StopIteration()
+        if not self._started:
+            self._start()
+        if self._first_outputs is not None:
+            outputs, = self._first_outputs
+            self._first_outputs = None
+            return outputs
+
+        # release the buffer of the last yielded item
+        if self._held_slot is not None:
+            self._free_slots.append(self._held_slot)
+            self._held_slot = None
+
+        try:
+            self._submit()
+            seq = self._next_yield
+            if seq not in self._pending:
+                # all the items have been consumed
+                self.close()
+                raise StopIteration()
+            kind, payload = self._receive(seq)
+        except StopIteration:
+            raise
+        except Exception:
+            self.close()
+            raise
+
+        slot = self._pending.pop(seq)
+        self._next_yield += 1
+        if kind == 'error':
+            self.close()
+            ex, tb = payload
+            if ex is not None:
+                try:
+                    ex = pickle.loads(ex)
+                except Exception:
+                    ex = None
+            if ex is None:
+                raise RuntimeError('Error in worker process:\n%s' % tb)
+            raise ex
+        elif kind == 'pickled':
+            self._free_slots.append(slot)
+            return pickle.loads(payload)
+        else:
+            meta, is_tuple = payload
+            buffer = self._buffers[slot]
+            arrays = tuple(
+                np.frombuffer(buffer, dtype=np.dtype(dtype),
+                              count=int(np.prod(shape)),
+                              offset=offset).reshape(shape)
+                for dtype, shape, offset in meta
+            )
+            self._held_slot = slot
+            return arrays if is_tuple else arrays[0]
+
+    next = __next__
+
+
+def _code_fingerprint(code):
+    """Get the fingerprint bytes of a code object, including nested ones."""
+    parts = [code.co_code, repr(code.co_names).encode('utf-8')]
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            parts.append(_code_fingerprint(const))
+        elif isinstance(const, frozenset):
+            # the order of a frozenset may vary between processes
+            parts.append(repr(sorted(repr(c) for c in const)).encode('utf-8'))
+        else:
+            parts.append(repr(const).encode('utf-8'))
+    return b'\x00'.join(parts)
+
+
+def _transform_fingerprint(transform):
+    """Get the fingerprint bytes of a transform function."""
+    if isinstance(transform, functools.partial):
+        return b'\x00'.join([
+            _transform_fingerprint(transform.func),
+            pickle.dumps((transform.args,
+                          sorted((transform.keywords or {}).items())),
+                         protocol=2),
+        ])
+    func = getattr(transform, '__func__', transform)   # bound methods
+    if hasattr(func, '__code__'):
+        return b'\x00'.join([
+            repr((func.__module__, func.__name__)).encode('utf-8'),
+            _code_fingerprint(func.__code__),
+            repr(func.__defaults__).encode('utf-8'),
+        ])
+
+    # other callable objects (e.g., NumPy ufuncs), which are identified by
+    # the code of their classes, and by their pickled states if possible
+    cls = type(transform)
+    parts = [repr((cls.__module__, cls.__name__)).encode('utf-8')]
+    call = getattr(cls.__call__, '__code__', None)
+    if call is not None:
+        parts.append(_code_fingerprint(call))
+    try:
+        parts.append(pickle.dumps(transform, protocol=2))
+    except Exception:
+        pass
+    return b'\x00'.join(parts)
+
+
+def _arrays_fingerprint(arrays, chunk_bytes=1 << 24):
+    """Get the SHA-1 hex digest of the content of `arrays`."""
+    h = hashlib.sha1()
+    for a in arrays:
+        h.update(repr((a.dtype.str, a.shape)).encode('utf-8'))
+        row_bytes = max(a.nbytes // max(len(a), 1), 1)
+        # hash in chunks, to avoid copying large memory-mapped arrays
+        for s in minibatch_slices_iterator(
+                len(a), max(chunk_bytes // row_bytes, 1)):
+            h.update(np.ascontiguousarray(a[s]).tobytes())
+    return h.hexdigest()
+
+
+class TransformCache(object):
+    """On-disk cache of the deterministically transformed data items.
+
+    Deterministic preprocessing (e.g., tokenization, normalization and
+    feature hashing) needs not to be computed again at every epoch.  This
+    class applies `transform` to the mini-batches of `arrays` during the
+    first epoch, and writes the outputs into fixed-size records of ".npy"
+    files in `cache_dir` at the same time.  Later epochs (as well as later
+    runs of the program) read the memory-mapped records instead, and
+    shuffle the data at the record level.  For example:
+
+        cache = TransformCache([raw_x, raw_y], preprocess, 'cache/train')
+        train_iterator = cache.iterator(batch_size=64, shuffle=True)
+        for epoch in loop.iter_epochs():
+            for step, (x, y) in loop.iter_steps(train_iterator):
+                ...
+            loop.add_metrics(cache_hits=cache.hit_count,
+                             cache_read_mb_per_sec=(
+                                 cache.read_throughput / 1048576.))
+
+    The cache is identified by a fingerprint of the content of `arrays`
+    and the code of `transform`, which is stored along with the records.
+    The cache is rebuilt if the fingerprint does not match.  Note that
+    only the code of `transform` itself is included, thus the changes
+    of the functions called by `transform` cannot be detected.  Specify
+    `fingerprint` explicitly in such case, or to avoid hashing of huge
+    arrays.
+
+    Parameters
+    ----------
+    arrays : collections.Iterable[np.ndarray]
+        The source arrays, whose lengths must be equal.
+
+    transform : (tuple[np.ndarray]) -> np.ndarray | tuple[np.ndarray]
+        The deterministic transform of a mini-batch of source arrays.
+        The outputs must be arrays with one fixed-size record for each
+        data item in the mini-batch.
+
+    cache_dir : str
+        The directory to store the cache files.
+
+    fingerprint : str
+        Optional explicit fingerprint of the source arrays and the
+        transform, instead of computing it from their content and code.
+    """
+
+    #: Name of the file storing the fingerprint of the cached records.
+    META_FILE = 'meta.json'
+
+    def __init__(self, arrays, transform, cache_dir, fingerprint=None):
+        arrays = tuple(arrays)
+        if not arrays:
+            raise ValueError('`arrays` must not be empty.')
+        self._arrays = arrays
+        self._data_count = _check_arrays_length(arrays)
+        self._transform = transform
+        self._cache_dir = os.path.abspath(cache_dir)
+        if fingerprint is None:
+            h = hashlib.sha1()
+            h.update(_arrays_fingerprint(arrays).encode('utf-8'))
+            h.update(_transform_fingerprint(transform))
+            fingerprint = h.hexdigest()
+        self._fingerprint = fingerprint
+        self._dataset = None
+        self._hit_count = 0
+        self._miss_count = 0
+        self._read_bytes = 0
+        self._read_time = 0.
+        self._open_cache()
+
+    @property
+    def arrays(self):
+        """Get the source arrays."""
+        return self._arrays
+
+    @property
+    def data_count(self):
+        """Get the number of data items."""
+        return self._data_count
+
+    @property
+    def cache_dir(self):
+        """Get the directory of the cache files."""
+        return self._cache_dir
+
+    @property
+    def fingerprint(self):
+        """Get the fingerprint of the source arrays and the transform."""
+        return self._fingerprint
+
+    @property
+    def is_cached(self):
+        """Whether or not the transformed records have been cached?"""
+        return self._dataset is not None
+
+    @property
+    def dataset(self):
+        """Get the `MemmapDataset` of the cached records (if cached)."""
+        return self._dataset
+
+    @property
+    def hit_count(self):
+        """Get the number of mini-batches read from the cache."""
+        return self._hit_count
+
+    @property
+    def miss_count(self):
+        """Get the number of mini-batches computed by the transform."""
+        return self._miss_count
+
+    @property
+    def read_bytes(self):
+        """Get the number of bytes read from the cache."""
+        return self._read_bytes
+
+    @property
+    def read_time(self):
+        """Get the total seconds spent on reading from the cache."""
+        return self._read_time
+
+    @property
+    def read_throughput(self):
+        """Get the bytes per second of reading from the cache.
+        Returns None if nothing has been read yet."""
+        if self._read_time > 0:
+            return self._read_bytes / self._read_time
+
+    def _record_path(self, index):
+        return os.path.join(self._cache_dir, 'records-%d.npy' % index)
+
+    def _open_cache(self):
+        """Open the cached records, if the fingerprint matches."""
+        meta_path = os.path.join(self._cache_dir, self.META_FILE)
+        if not os.path.isfile(meta_path):
+            return
+        with open(meta_path, 'r') as f:
+            meta = json.load(f)
+        if meta.get('fingerprint') != self._fingerprint or \
+                meta.get('data_count') != self._data_count:
+            getLogger(__name__).info(
+                'The transform cache at %r is outdated.', self._cache_dir)
+            return
+        self._dataset = MemmapDataset.from_npy_files(
+            [self._record_path(i) for i in range(meta['array_count'])])
+
+    def _create_records(self, outputs):
+        """Create the memory-mapped record files for `outputs`."""
+        if not os.path.isdir(self._cache_dir):
+            os.makedirs(self._cache_dir)
+        # remove the meta file first, so that an interrupted building will
+        # never be regarded as a valid cache
+        meta_path = os.path.join(self._cache_dir, self.META_FILE)
+        if os.path.exists(meta_path):
+            os.remove(meta_path)
+        return tuple(
+            np.lib.format.open_memmap(
+                self._record_path(i), mode='w+', dtype=o.dtype,
+                shape=(self._data_count,) + o.shape[1:]
+            )
+            for i, o in enumerate(outputs)
+        )
+
+    def _commit_records(self, records):
+        """Flush the record files, and write the meta file."""
+        for r in records:
+            r.flush()
+        meta_path = os.path.join(self._cache_dir, self.META_FILE)
+        with open(meta_path + '.tmp', 'w') as f:
+            json.dump({'fingerprint': self._fingerprint,
+                       'data_count': self._data_count,
+                       'array_count': len(records)}, f)
+        os.rename(meta_path + '.tmp', meta_path)
+        getLogger(__name__).info(
+            'Built the transform cache of %d records at %r.',
+            self._data_count, self._cache_dir)
+        self._open_cache()
+
+    def _apply(self, batch):
+        """Apply the transform on `batch`, and check the outputs."""
+        outputs = self._transform(batch)
+        if isinstance(outputs, np.ndarray):
+            outputs = (outputs,)
+        elif not isinstance(outputs, tuple) or \
+                not all(isinstance(o, np.ndarray) for o in outputs):
+            raise TypeError('The outputs of `transform` must be an array or '
+                            'a tuple of arrays.')
+        if any(len(o) != len(batch[0]) for o in outputs):
+            raise ValueError('The outputs of `transform` must have one '
+                             'record for each data item.')
+        return outputs
+
+    def iterator(self, batch_size, shuffle=True, ignore_incomplete_batch=False,
+                 random_state=None):
+        """Get a mini-batch iterator over the transformed data.
+
+        Parameters
+        ----------
+        batch_size : int
+            Size of each mini-batch.
+
+        shuffle : bool
+            Whether or not to shuffle the data at each epoch? (default True)
+
+        ignore_incomplete_batch : bool
+            Whether or not to ignore the final batch if it contains less
+            than ``batch-size`` number of items?  (default False)
+
+            Even if True, the final items are still transformed and
+            cached during the first epoch.
+
+        random_state : np.random.RandomState
+            Optional random state for shuffling.
+            If not specified, will use the global random state of NumPy.
+
+        Returns
+        -------
+        collections.Iterable[tuple[np.ndarray]]
+            The mini-batch iterator.  The mini-batches read from the cache
+            are gathered into pre-allocated buffers (see
+            `MiniBatchIterator`), and will be overwritten by later ones.
+        """
+        if batch_size < 1:
+            raise ValueError('`batch_size` must be at least 1.')
+        return _TransformCacheIterator(
+            self, batch_size=batch_size, shuffle=shuffle,
+            ignore_incomplete_batch=ignore_incomplete_batch,
+            random_state=random_state
+        )
+
+
+class _TransformCacheIterator(object):
+    """Mini-batch iterator of `TransformCache`."""
+
+    def __init__(self, cache, batch_size, shuffle, ignore_incomplete_batch,
+                 random_state):
+        self._cache = cache
+        self._batch_size = batch_size
+        self._shuffle = shuffle
+        self._ignore_incomplete_batch = ignore_incomplete_batch
+        self._random_state = random_state
+        self._cached_iterator = None
+
+    @property
+    def batch_size(self):
+        """Get the size of each mini-batch."""
+        return self._batch_size
+
+    def _iter_cached(self):
+        """Iterate through the mini-batches read from the cache."""
+        cache = self._cache
+        if self._cached_iterator is None:
+            self._cached_iterator = MiniBatchIterator(
+                cache.dataset.arrays, batch_size=self._batch_size,
+                shuffle=self._shuffle,
+                ignore_incomplete_batch=self._ignore_incomplete_batch,
+                random_state=self._random_state
+            )
+        it = iter(self._cached_iterator)
+        while True:
+            start_time = time.time()
+            try:
+                batch = next(it)
+            except StopIteration:
+                break
+            cache._read_time += time.time() - start_time
+            cache._read_bytes += sum(b.nbytes for b in batch)
+            cache._hit_count += 1
+            yield batch
+
+    def _iter_building(self):
+        """Iterate through the transformed mini-batches, and cache them."""
+        cache = self._cache
+        data_count = cache.data_count
+        if self._shuffle:
+            random_state = self._random_state or np.random
+            order = random_state.permutation(data_count)
+        else:
+            order = None
+        records = None
+        for s in minibatch_slices_iterator(data_count, self._batch_size):
+            if order is not None:
+                # sorting the indices makes both reads and writes faster,
+                # while the mini-batches are still randomly composed
+                indices = np.sort(order[s])
+                batch = tuple(np.take(a, indices, axis=0)
+                              for a in cache.arrays)
+            else:
+                indices = s
+                batch = tuple(a[s] for a in cache.arrays)
+            outputs = cache._apply(batch)
+            if records is None:
+                records = cache._create_records(outputs)
+            for r, o in zip(records, outputs):
+                r[indices] = o
+            cache._miss_count += 1
+            if not self._ignore_incomplete_batch or \
+                    len(outputs[0]) == self._batch_size:
+                yield outputs
+        if records is not None:
+            cache._commit_records(records)
+
+    def __iter__(self):
+        if self._cache.is_cached:
+            return self._iter_cached()
+        return self._iter_building()
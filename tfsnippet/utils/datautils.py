@@ -1,9 +1,15 @@
 # -*- coding: utf-8 -*-
+import itertools
+import mmap
+
 import numpy as np
+import six
 
 __all__ = [
     'minibatch_slices_iterator', 'minibatch_iterator', 'split_numpy_arrays',
-    'split_numpy_array',
+    'split_numpy_array', 'split_indices', 'stratified_split_indices',
+    'kfold_indices', 'MiniBatchIterator', 'MemmapDataset',
+    'BucketedMiniBatchIterator', 'ShardedDataset', 'WeightedMiniBatchSampler',
 ]
 
 
@@ -38,7 +44,8 @@ def minibatch_slices_iterator(length, batch_size,
         yield slice(start, length, 1)
 
 
-def minibatch_iterator(array, batch_size, ignore_incomplete_batch=False):
+def minibatch_iterator(array, batch_size, ignore_incomplete_batch=False,
+                       rank=0, world_size=1):
     """Iterate through all the mini-batches.
 
     Parameters
@@ -53,20 +60,63 @@ def minibatch_iterator(array, batch_size, ignore_incomplete_batch=False):
         Whether or not to ignore the final batch if it contains less
         than ``batch-size`` number of items?  (default False)
 
+    rank, world_size : int
+        Iterate only through the `rank`-th of `world_size` disjoint,
+        contiguous shards of equal sizes.  (default 0 and 1)
+
     Yields
     ------
     sliced array
         Sliced array of each mini-batch.  The last mini-batch may contain
         less elements than `batch_size`.
     """
-    for s in minibatch_slices_iterator(len(array), batch_size,
+    _check_rank(rank, world_size)
+    start, stop = _shard_range(len(array), rank, world_size)
+    for s in minibatch_slices_iterator(stop - start, batch_size,
                                        ignore_incomplete_batch):
-        yield array[s]
+        yield array[s.start + start: s.stop + start]
+
+
+def _check_rank(rank, world_size):
+    """Check the `rank` and `world_size` arguments."""
+    if world_size < 1:
+        raise ValueError('`world_size` must be at least 1.')
+    if rank < 0 or rank >= world_size:
+        raise ValueError('`rank` must be at least 0 and less than '
+                         '`world_size`.')
+
+
+def _shard_range(data_count, rank, world_size):
+    """Get the range ``[start, stop)`` of the `rank`-th shard.
+
+    All the shards have ``data_count // world_size`` items, thus the last
+    ``data_count % world_size`` items are not included in any shard.
+    """
+    shard_size = data_count // world_size
+    return rank * shard_size, (rank + 1) * shard_size
+
+
+def _get_split_size(data_count, portion, size):
+    """Determine the size of the second half, by `portion` or `size`."""
+    if size is None:
+        if portion is None:
+            raise ValueError('At least one of `portion` and `size` should '
+                             'be specified.')
+        if portion < 0.0 or portion > 1.0:
+            raise ValueError('`portion` must range from 0.0 to 1.0.')
+        elif portion < 0.5:
+            size = data_count - int(data_count * (1.0 - portion))
+        else:
+            size = int(data_count * portion)
+    return min(max(size, 0), data_count)
 
 
 def split_numpy_arrays(arrays, portion=None, size=None, shuffle=True):
     """Split NumPy arrays into two halves, by portion or by size.
 
+    If `shuffle` is True, the two halves will be copies of the data.
+    Use `split_indices` instead to split large arrays without copying.
+
     Parameters
     ----------
     arrays : collections.Iterable[np.ndarray]
@@ -97,25 +147,18 @@ def split_numpy_arrays(arrays, portion=None, size=None, shuffle=True):
         return (), ()
 
     # check the length of provided arrays
-    data_count = len(arrays[0])
-    for array in arrays[1:]:
-        if len(array) != data_count:
-            raise ValueError('The length of specified arrays are not equal.')
+    data_count = _check_arrays_length(arrays)
 
-    # determine the size for second half
-    if size is None:
-        if portion < 0.0 or portion > 1.0:
-            raise ValueError('`portion` must range from 0.0 to 1.0.')
-        elif portion < 0.5:
-            size = data_count - int(data_count * (1.0 - portion))
-        else:
-            size = int(data_count * portion)
-
-    # shuffle the data if necessary
+    # shuffle the data if necessary, gathering each half only once
     if shuffle:
-        indices = np.arange(data_count)
-        np.random.shuffle(indices)
-        arrays = tuple(a[indices] for a in arrays)
+        left, right = split_indices(data_count, portion=portion, size=size)
+        return (
+            tuple(np.take(a, left, axis=0) for a in arrays),
+            tuple(np.take(a, right, axis=0) for a in arrays)
+        )
+
+    # determine the size for second half
+    size = _get_split_size(data_count, portion, size)
 
     # return directly if each side remains no data after splitting
     if size <= 0:
@@ -155,3 +198,1487 @@ def split_numpy_array(array, portion=None, size=None, shuffle=True):
     (a,), (b,) = split_numpy_arrays((array,), portion=portion, size=size,
                                     shuffle=shuffle)
     return a, b
+
+
+def split_indices(data_count, portion=None, size=None, shuffle=True,
+                  random_state=None):
+    """Split the indices of data into two halves, by portion or by size.
+
+    Unlike `split_numpy_arrays`, this method does not copy any data.
+    The indices of each half can be passed to `MiniBatchIterator`, so
+    that the data will only be gathered when each mini-batch is taken.
+
+        train_idx, valid_idx = split_indices(len(data_x), portion=0.2)
+        train_iterator = MiniBatchIterator(
+            [data_x, data_y], batch_size=64, shuffle=True, indices=train_idx)
+
+    Parameters
+    ----------
+    data_count : int
+        The number of data items.
+
+    portion : float
+        Portion of the second half.  Ignored if `size` is specified.
+
+    size : int
+        Size of the second half.
+
+    shuffle : bool
+        Whether or not to shuffle before splitting?
+
+    random_state : np.random.RandomState
+        Optional random state for shuffling.
+        If not specified, will use the global random state of NumPy.
+
+    Returns
+    -------
+    (np.ndarray, np.ndarray)
+        The indices of the two halves.
+    """
+    size = _get_split_size(data_count, portion, size)
+    if shuffle:
+        indices = (random_state or np.random).permutation(data_count)
+    else:
+        indices = np.arange(data_count)
+    return indices[: data_count - size], indices[data_count - size:]
+
+
+def stratified_split_indices(labels, portion=None, size=None, shuffle=True,
+                             random_state=None):
+    """Split the indices of data into two halves, stratified by labels.
+
+    The items of each label will be splitted into two halves at the same
+    portion, such that the distribution of labels are (approximately)
+    identical in the two halves.  Like `split_indices`, this method does
+    not copy any data.
+
+    Parameters
+    ----------
+    labels : np.ndarray
+        The 1-D array of labels.
+
+    portion : float
+        Portion of the second half.  Ignored if `size` is specified.
+
+    size : int
+        Size of the second half.  Because of stratification, the size of
+        each label is rounded by the largest remainder method, so that the
+        total size of the second half is exactly `size`.
+
+    shuffle : bool
+        Whether or not to shuffle before splitting?
+
+        If False, the indices of each half will be sorted in ascending order.
+
+    random_state : np.random.RandomState
+        Optional random state for shuffling.
+        If not specified, will use the global random state of NumPy.
+
+    Returns
+    -------
+    (np.ndarray, np.ndarray)
+        The indices of the two halves.
+    """
+    labels = np.asarray(labels)
+    data_count = len(labels)
+    size = _get_split_size(data_count, portion, size)
+    random_state = random_state or np.random
+
+    # group the indices by labels
+    _, label_ids = np.unique(labels, return_inverse=True)
+    label_ids = label_ids.reshape([-1])
+    order = np.argsort(label_ids, kind='mergesort')
+    label_counts = np.bincount(label_ids)
+
+    # determine the size of the second half for each label
+    if data_count > 0:
+        exact_sizes = label_counts * (float(size) / data_count)
+    else:
+        exact_sizes = label_counts.astype(np.float64)
+    label_sizes = np.floor(exact_sizes).astype(np.int64)
+    remainder = size - np.sum(label_sizes)
+    if remainder > 0:
+        largest = np.argsort(label_sizes - exact_sizes, kind='mergesort')
+        label_sizes[largest[:remainder]] += 1
+
+    # split the indices of each label
+    left, right = [], []
+    start = 0
+    for count, label_size in zip(label_counts, label_sizes):
+        group = order[start: start + count]
+        if shuffle:
+            group = random_state.permutation(group)
+        left.append(group[: count - label_size])
+        right.append(group[count - label_size:])
+        start += count
+
+    left = np.concatenate(left) if left else np.arange(0)
+    right = np.concatenate(right) if right else np.arange(0)
+    if shuffle:
+        return random_state.permutation(left), random_state.permutation(right)
+    return np.sort(left), np.sort(right)
+
+
+def kfold_indices(data_count, k, labels=None, shuffle=True,
+                  random_state=None):
+    """Generate the indices of k-fold cross validation.
+
+    Like `split_indices`, this method does not copy any data.
+
+    Parameters
+    ----------
+    data_count : int
+        The number of data items.
+
+    k : int
+        The number of folds, at least 2.
+
+    labels : np.ndarray
+        If specified, the folds will be stratified by these labels.
+
+    shuffle : bool
+        Whether or not to shuffle before splitting the folds?
+
+    random_state : np.random.RandomState
+        Optional random state for shuffling.
+        If not specified, will use the global random state of NumPy.
+
+    Yields
+    ------
+    (np.ndarray, np.ndarray)
+        The training and testing indices of each fold, sorted in
+        ascending order.
+    """
+    if k < 2:
+        raise ValueError('`k` must be at least 2.')
+    random_state = random_state or np.random
+
+    # assign each data item to a fold
+    if labels is not None:
+        labels = np.asarray(labels)
+        if len(labels) != data_count:
+            raise ValueError('The length of `labels` does not match '
+                             '`data_count`.')
+        _, label_ids = np.unique(labels, return_inverse=True)
+        label_ids = label_ids.reshape([-1])
+        if shuffle:
+            # shuffle within each label by sorting with random tie-breaks
+            order = np.lexsort((random_state.random_sample(data_count),
+                                label_ids))
+        else:
+            order = np.argsort(label_ids, kind='mergesort')
+    elif shuffle:
+        order = random_state.permutation(data_count)
+    else:
+        order = np.arange(data_count)
+
+    # assign contiguous chunks of `order` to the folds, or deal the items
+    # out to the folds in turn if stratified, so that the items of each
+    # label are distributed evenly among the folds
+    fold_ids = np.empty([data_count], dtype=np.int64)
+    if labels is not None:
+        fold_ids[order] = np.arange(data_count) % k
+    else:
+        fold_ids[order] = np.arange(data_count) * k // max(data_count, 1)
+
+    for i in range(k):
+        test_mask = fold_ids == i
+        yield np.where(~test_mask)[0], np.where(test_mask)[0]
+
+
+def _check_arrays_length(arrays):
+    """Check whether or not `arrays` have equal lengths, and get the length."""
+    data_count = len(arrays[0])
+    for array in arrays[1:]:
+        if len(array) != data_count:
+            raise ValueError('The length of specified arrays are not equal.')
+    return data_count
+
+
+def _block_shuffled_indices(length, block_size, random_state):
+    """Get the block-shuffled permutation of ``np.arange(length)``.
+
+    The indices are divided into contiguous blocks of `block_size`, the
+    order of the blocks is shuffled, then the indices within each block
+    are shuffled.
+
+    Returns
+    -------
+    (np.ndarray, np.ndarray)
+        The shuffled indices, and the order of the blocks.
+    """
+    block_count = (length + block_size - 1) // block_size
+    block_order = random_state.permutation(block_count)
+    indices = np.empty([length], dtype=np.int64)
+    pos = 0
+    for block in block_order:
+        start = block * block_size
+        size = min(block_size, length - start)
+        indices[pos: pos + size] = start + random_state.permutation(size)
+        pos += size
+    return indices, block_order
+
+
+def _dump_random_state(random_state):
+    """Dump the state of a `np.random.RandomState` as JSON-compatible list."""
+    name, keys, pos, has_gauss, cached_gaussian = random_state.get_state()
+    return [str(name), [int(k) for k in keys], int(pos), int(has_gauss),
+            float(cached_gaussian)]
+
+
+def _load_random_state(random_state, state):
+    """Restore a `np.random.RandomState` from `_dump_random_state`."""
+    name, keys, pos, has_gauss, cached_gaussian = state
+    random_state.set_state((str(name), np.asarray(keys, dtype=np.uint32),
+                            int(pos), int(has_gauss),
+                            float(cached_gaussian)))
+
+
+class _ResumableIterator(object):
+    """Base class of the mini-batch iterators with resumable states.
+
+    At the beginning of each shuffled epoch, a seed is drawn from the random
+    state, and all the random orders of this epoch are generated from this
+    seed.  Together with the number of mini-batches yielded in this epoch,
+    the position of the iterator can be saved and restored compactly,
+    without storing the permutation, and without replaying the epoch.
+    """
+
+    _random_state = None
+    _shuffle = False
+    _epoch_seed = None
+    _cursor = 0
+    _resuming = False
+
+    def get_state(self):
+        """Get the state of this iterator.
+
+        The state can be saved along with the variables, for example, by
+        the `state_objects` argument of `VariableSaver`, and be restored
+        by `set_state`, such that a restored iterator will resume at the
+        exact next mini-batch.
+
+        Note that the global random state of NumPy is not included, if
+        `random_state` is not specified for this iterator.  Besides, the
+        mini-batches which have been prefetched from this iterator (e.g.,
+        by a `PrefetchIterator`) are regarded as yielded.
+
+        Returns
+        -------
+        dict[str, any]
+            The state of this iterator, consisting of JSON-compatible
+            values: the random state, the seed of the current epoch and
+            the number of mini-batches yielded in the current epoch.
+        """
+        if self._random_state is not None:
+            random_state = _dump_random_state(self._random_state)
+        else:
+            random_state = None
+        return {
+            'random_state': random_state,
+            'epoch_seed': self._epoch_seed,
+            'cursor': self._cursor,
+        }
+
+    def set_state(self, state):
+        """Restore the state of this iterator.
+
+        The next epoch of this iterator will resume at the mini-batch
+        right after the last yielded one when `state` was taken.
+
+        Parameters
+        ----------
+        state : dict[str, any]
+            The state obtained by `get_state`.
+        """
+        if state.get('random_state') is not None:
+            if self._random_state is None:
+                self._random_state = np.random.RandomState()
+            _load_random_state(self._random_state, state['random_state'])
+        epoch_seed = state.get('epoch_seed')
+        self._epoch_seed = int(epoch_seed) if epoch_seed is not None else None
+        self._cursor = int(state.get('cursor', 0))
+        self._resuming = True
+
+    def _begin_epoch(self):
+        """Begin a new epoch, or resume the epoch restored by `set_state`.
+
+        Returns
+        -------
+        int
+            Number of the mini-batches to be skipped in this epoch.
+        """
+        if self._resuming:
+            self._resuming = False
+            if self._epoch_seed is not None or self._cursor > 0:
+                return self._cursor
+        self._cursor = 0
+        self._epoch_seed = None
+        if self._shuffle:
+            random_state = self._random_state or np.random
+            self._epoch_seed = int(random_state.randint(0, 2 ** 31 - 1))
+        return 0
+
+    def _end_epoch(self):
+        """Mark the end of the current epoch."""
+        self._epoch_seed = None
+        self._cursor = 0
+
+    def _epoch_random_state(self):
+        """Get a random state for generating the orders of current epoch."""
+        return np.random.RandomState(self._epoch_seed)
+
+
+class MiniBatchIterator(_ResumableIterator):
+    """Mini-batch iterator over several aligned arrays.
+
+    Each time this object is iterated, it iterates through one epoch of
+    the mini-batches, each of which is a tuple of arrays.  For example:
+
+        train_iterator = MiniBatchIterator(
+            [train_x, train_y], batch_size=64, shuffle=True)
+        for epoch in loop.iter_epochs():
+            for step, (x, y) in loop.iter_steps(train_iterator):
+                ...
+
+    If `shuffle` is True, one permutation of indices will be drawn at the
+    beginning of each epoch, and each mini-batch will be gathered into
+    pre-allocated buffers by ``np.take(..., out=...)``.  Neither the whole
+    dataset, nor any single mini-batch, will be copied into newly allocated
+    arrays.  As a result, the arrays of a mini-batch will be overwritten
+    when a later mini-batch is gathered into the same buffers.  The caller
+    should copy the arrays if they are required to live longer.
+
+    If more than one mini-batch should be alive at the same time (e.g.,
+    when this iterator is wrapped by a `PrefetchIterator`), `num_buffers`
+    should be set to at least the number of alive mini-batches (e.g.,
+    ``capacity + 2`` for a `PrefetchIterator`).  The buffers will then be
+    used in turn.
+
+    Parameters
+    ----------
+    arrays : collections.Iterable[np.ndarray]
+        The arrays to be iterated, whose lengths must be equal.
+
+    batch_size : int
+        Size of each mini-batch.
+
+    shuffle : bool
+        Whether or not to shuffle the data at each epoch? (default False)
+
+    ignore_incomplete_batch : bool
+        Whether or not to ignore the final batch if it contains less
+        than ``batch-size`` number of items?  (default False)
+
+    use_views : bool
+        Whether or not to yield read-only views of the arrays, instead of
+        copying the data into the buffers?  (default False)
+
+        This option is only available when `shuffle` is False.
+
+    num_buffers : int
+        Number of buffers to be used in turn. (default 1)
+
+    random_state : np.random.RandomState
+        Optional random state for shuffling.
+        If not specified, will use the global random state of NumPy.
+
+    shuffle_block_size : int
+        If specified, shuffle the data at the level of contiguous blocks
+        of this size, then shuffle the data within each block.
+
+        This keeps the reads mostly sequential, which is much faster
+        than full random access if the arrays are memory-mapped from
+        files (see `MemmapDataset`).
+
+    indices : np.ndarray
+        If specified, iterate only through the data items at these indices
+        (e.g., the indices obtained by `split_indices`), gathering each
+        mini-batch without copying the whole subset.
+
+    rank, world_size : int
+        If `world_size` is larger than 1, iterate only through the
+        `rank`-th of `world_size` disjoint shards of each epoch, for
+        data-parallel training in several processes.  (default 0 and 1)
+
+        Each epoch is first ordered (and shuffled) as a whole, then split
+        into `world_size` contiguous shards of ``n // world_size`` items,
+        so that every worker has the same number of mini-batches.  The
+        remaining ``n % world_size`` items are skipped in that epoch.  If
+        `shuffle` is True, `random_state` must be specified, and must be
+        seeded identically in all the workers, in order to derive the
+        same permutation without any coordination.
+
+    The position of this iterator can be saved by `get_state` and restored
+    by `set_state`, in order to resume an interrupted epoch.
+    """
+
+    def __init__(self, arrays, batch_size, shuffle=False,
+                 ignore_incomplete_batch=False, use_views=False,
+                 num_buffers=1, random_state=None, shuffle_block_size=None,
+                 indices=None, rank=0, world_size=1):
+        arrays = tuple(arrays)
+        if not arrays:
+            raise ValueError('`arrays` must not be empty.')
+        if batch_size < 1:
+            raise ValueError('`batch_size` must be at least 1.')
+        if use_views and shuffle:
+            raise ValueError('`use_views` cannot be True when `shuffle` '
+                             'is True.')
+        if num_buffers < 1:
+            raise ValueError('`num_buffers` must be at least 1.')
+        if shuffle_block_size is not None and shuffle_block_size < 1:
+            raise ValueError('`shuffle_block_size` must be at least 1.')
+        if use_views and indices is not None:
+            raise ValueError('`use_views` cannot be True when `indices` '
+                             'is specified.')
+        _check_rank(rank, world_size)
+        if shuffle and world_size > 1 and random_state is None:
+            raise ValueError('`random_state` must be specified when '
+                             '`shuffle` is True and `world_size` > 1.')
+
+        self._arrays = arrays
+        self._data_count = _check_arrays_length(arrays)
+        if indices is not None:
+            indices = np.asarray(indices, dtype=np.int64).reshape([-1])
+            if len(indices) > 0 and (np.min(indices) < 0 or
+                                     np.max(indices) >= self._data_count):
+                raise IndexError('`indices` out of range.')
+            self._data_count = len(indices)
+        self._indices = indices
+
+        # `_data_count` is the size of the shard of this worker, while
+        # `_full_count` is the number of data items in a whole epoch
+        self._full_count = self._data_count
+        self._shard_start, shard_stop = _shard_range(
+            self._full_count, rank, world_size)
+        self._data_count = shard_stop - self._shard_start
+        self._rank = rank
+        self._world_size = world_size
+        self._batch_size = batch_size
+        self._shuffle = shuffle
+        self._ignore_incomplete_batch = ignore_incomplete_batch
+        self._use_views = use_views
+        self._num_buffers = num_buffers
+        self._random_state = random_state
+        self._shuffle_block_size = shuffle_block_size
+        self._buffers = None
+        self._buffer_index = 0
+
+    @property
+    def arrays(self):
+        """Get the arrays to be iterated."""
+        return self._arrays
+
+    @property
+    def data_count(self):
+        """Get the number of data items in an epoch (of this worker)."""
+        return self._data_count
+
+    @property
+    def rank(self):
+        """Get the rank of this worker."""
+        return self._rank
+
+    @property
+    def world_size(self):
+        """Get the number of workers."""
+        return self._world_size
+
+    @property
+    def indices(self):
+        """Get the indices of the data items to be iterated, if specified."""
+        return self._indices
+
+    @property
+    def batch_size(self):
+        """Get the size of each mini-batch."""
+        return self._batch_size
+
+    @property
+    def shuffle(self):
+        """Whether or not to shuffle the data at each epoch?"""
+        return self._shuffle
+
+    @property
+    def num_batches(self):
+        """Get the number of mini-batches in an epoch."""
+        if self._ignore_incomplete_batch:
+            return self._data_count // self._batch_size
+        return (self._data_count + self._batch_size - 1) // self._batch_size
+
+    def _next_buffers(self):
+        """Get the next group of buffers to be filled."""
+        if self._buffers is None:
+            self._buffers = [
+                tuple(np.empty((self._batch_size,) + a.shape[1:],
+                               dtype=a.dtype)
+                      for a in self._arrays)
+                for _ in range(self._num_buffers)
+            ]
+        ret = self._buffers[self._buffer_index]
+        self._buffer_index = (self._buffer_index + 1) % self._num_buffers
+        return ret
+
+    def _gather(self, indices):
+        """Gather the mini-batch at `indices` into the next buffers."""
+        count = len(indices)
+        buffers = self._next_buffers()
+        if count < self._batch_size:
+            buffers = tuple(b[:count] for b in buffers)
+        for a, b in zip(self._arrays, buffers):
+            # mode 'clip' avoids the internal buffering of 'raise' mode,
+            # while all the indices are known to be valid
+            np.take(a, indices, axis=0, out=b, mode='clip')
+        return buffers
+
+    def _slice(self, s):
+        """Get the mini-batch at slice `s` of the shard."""
+        s = slice(s.start + self._shard_start, s.stop + self._shard_start)
+        if self._indices is not None:
+            return self._gather(self._indices[s])
+        if self._use_views:
+            ret = []
+            for a in self._arrays:
+                v = a[s]
+                v.flags.writeable = False
+                ret.append(v)
+            return tuple(ret)
+        count = s.stop - s.start
+        buffers = self._next_buffers()
+        if count < self._batch_size:
+            buffers = tuple(b[:count] for b in buffers)
+        for a, b in zip(self._arrays, buffers):
+            b[...] = a[s]
+        return buffers
+
+    def _epoch_indices(self):
+        """Get the permutation of indices for the current epoch."""
+        random_state = self._epoch_random_state()
+        if self._shuffle_block_size is not None:
+            ret = _block_shuffled_indices(
+                self._full_count, self._shuffle_block_size, random_state)[0]
+        else:
+            ret = random_state.permutation(self._full_count)
+        ret = ret[self._shard_start: self._shard_start + self._data_count]
+        if self._indices is not None:
+            ret = self._indices[ret]
+        return ret
+
+    def __iter__(self):
+        skip = self._begin_epoch()
+        slices = itertools.islice(
+            minibatch_slices_iterator(
+                self._data_count, self._batch_size,
+                ignore_incomplete_batch=self._ignore_incomplete_batch
+            ),
+            skip, None
+        )
+        if self._shuffle:
+            indices = self._epoch_indices()
+            for s in slices:
+                batch = self._gather(indices[s])
+                self._cursor += 1
+                yield batch
+        else:
+            for s in slices:
+                batch = self._slice(s)
+                self._cursor += 1
+                yield batch
+        self._end_epoch()
+
+
+class MemmapDataset(object):
+    """Dataset of aligned arrays, memory-mapped from files on disk.
+
+    This class holds a set of memory-mapped arrays, whose sizes might be
+    larger than the physical memory.  Shuffling such arrays with a random
+    permutation would thrash the page cache, thus the mini-batch iterator
+    of this dataset shuffles the data at the level of contiguous blocks,
+    then shuffles within each block (see `MiniBatchIterator`).  Besides,
+    the dataset advises the kernel to read ahead the next block while the
+    current block is being iterated, if ``madvise`` is available.
+
+        dataset = MemmapDataset.from_npy_files(['x.npy', 'y.npy'])
+        train_iterator = dataset.iterator(batch_size=64, shuffle=True)
+        for epoch in loop.iter_epochs():
+            for step, (x, y) in loop.iter_steps(train_iterator):
+                ...
+
+    Parameters
+    ----------
+    arrays : collections.Iterable[np.memmap]
+        The memory-mapped arrays, whose lengths must be equal.
+    """
+
+    def __init__(self, arrays):
+        arrays = tuple(arrays)
+        if not arrays:
+            raise ValueError('`arrays` must not be empty.')
+        for a in arrays:
+            if not isinstance(a, np.memmap):
+                raise TypeError('%r is not a memory-mapped array.' % (a,))
+        self._arrays = arrays
+        self._data_count = _check_arrays_length(arrays)
+
+    @classmethod
+    def from_npy_files(cls, paths, mode='r'):
+        """Open a dataset from ".npy" files.
+
+        Parameters
+        ----------
+        paths : collections.Iterable[str]
+            Paths of the ".npy" files, one for each array.
+
+        mode : {'r', 'r+', 'c'}
+            The mode to open the memory-mapped arrays. (default 'r')
+
+        Returns
+        -------
+        MemmapDataset
+            The memory-mapped dataset.
+        """
+        return cls(np.load(path, mmap_mode=mode) for path in paths)
+
+    @property
+    def arrays(self):
+        """Get the memory-mapped arrays."""
+        return self._arrays
+
+    @property
+    def data_count(self):
+        """Get the number of data items."""
+        return self._data_count
+
+    def advise(self, advice, start=0, stop=None):
+        """Advise the kernel about the access pattern of the data.
+
+        Parameters
+        ----------
+        advice : int
+            One of the ``mmap.MADV_*`` constants, e.g., ``MADV_RANDOM``,
+            ``MADV_SEQUENTIAL`` or ``MADV_WILLNEED``.
+
+        start, stop : int
+            The range of the data items to be advised.
+            If not specified, advise on all the data items.
+
+        Returns
+        -------
+        bool
+            Whether or not the advice has been applied to all arrays?
+            Returns False if ``madvise`` is not available.
+        """
+        if stop is None:
+            stop = self._data_count
+        applied = True
+        for a in self._arrays:
+            applied = _madvise_rows(a, advice, start, stop) and applied
+        return applied
+
+    def iterator(self, batch_size, shuffle=True, block_size=1024,
+                 ignore_incomplete_batch=False, num_buffers=1,
+                 random_state=None, rank=0, world_size=1):
+        """Get a mini-batch iterator over this dataset.
+
+        Parameters
+        ----------
+        batch_size : int
+            Size of each mini-batch.
+
+        shuffle : bool
+            Whether or not to shuffle the data at each epoch? (default True)
+
+        block_size : int
+            Number of data items in each contiguous block. (default 1024)
+
+            The data will be shuffled at the level of these blocks, then
+            shuffled within each block.  It should be much larger than
+            `batch_size`, while a block of all arrays should fit in the
+            page cache comfortably.
+
+        ignore_incomplete_batch, num_buffers, random_state, rank, world_size
+            Other arguments passed to `MiniBatchIterator`.
+
+        Returns
+        -------
+        MiniBatchIterator
+            The mini-batch iterator.
+        """
+        return _MemmapMiniBatchIterator(
+            self,
+            batch_size=batch_size,
+            shuffle=shuffle,
+            ignore_incomplete_batch=ignore_incomplete_batch,
+            num_buffers=num_buffers,
+            random_state=random_state,
+            shuffle_block_size=block_size,
+            rank=rank,
+            world_size=world_size,
+        )
+
+
+def _madvise_rows(array, advice, start, stop):
+    """Call ``madvise`` on the rows ``[start, stop)`` of a memmap array."""
+    mm = getattr(array, '_mmap', None)
+    if mm is None or not hasattr(mm, 'madvise') or stop <= start:
+        return False
+    # `np.memmap` maps the file from an offset aligned to the allocation
+    # granularity, thus the array might begin in the middle of the mapping
+    array_offset = array.offset % mmap.ALLOCATIONGRANULARITY
+    row_bytes = array.strides[0] if array.ndim > 0 else array.itemsize
+    begin = array_offset + start * row_bytes
+    end = array_offset + stop * row_bytes
+    begin -= begin % mmap.PAGESIZE
+    try:
+        mm.madvise(advice, begin, min(end, len(mm)) - begin)
+    except (OSError, ValueError):
+        return False
+    return True
+
+
+class _MemmapMiniBatchIterator(MiniBatchIterator):
+    """Mini-batch iterator of `MemmapDataset`."""
+
+    def __init__(self, dataset, **kwargs):
+        super(_MemmapMiniBatchIterator, self).__init__(
+            dataset.arrays, **kwargs)
+        self._dataset = dataset
+
+    def __iter__(self):
+        if not self._shuffle:
+            if hasattr(mmap, 'MADV_SEQUENTIAL'):
+                self._dataset.advise(mmap.MADV_SEQUENTIAL)
+            for batch in super(_MemmapMiniBatchIterator, self).__iter__():
+                yield batch
+            return
+
+        # the data within a block is accessed randomly
+        if hasattr(mmap, 'MADV_RANDOM'):
+            self._dataset.advise(mmap.MADV_RANDOM)
+        will_need = getattr(mmap, 'MADV_WILLNEED', None)
+        block_size = self._shuffle_block_size
+        skip = self._begin_epoch()
+        indices, block_order = _block_shuffled_indices(
+            self._full_count, block_size, self._epoch_random_state())
+        shard_start = self._shard_start
+
+        # the position in `indices` where the next block begins
+        next_block = 0
+        block_end = 0
+        for s in itertools.islice(
+                minibatch_slices_iterator(
+                    self._data_count, self._batch_size,
+                    ignore_incomplete_batch=self._ignore_incomplete_batch),
+                skip, None):
+            s = slice(s.start + shard_start, s.stop + shard_start)
+            # read ahead the block after the one being iterated, except
+            # for the blocks skipped by a resumed epoch or other workers
+            while block_end < s.stop + block_size and \
+                    next_block < len(block_order):
+                start = block_order[next_block] * block_size
+                stop = min(start + block_size, self._full_count)
+                if will_need is not None and \
+                        block_end + stop - start > s.start:
+                    self._dataset.advise(will_need, start, stop)
+                block_end += stop - start
+                next_block += 1
+            batch = self._gather(indices[s])
+            self._cursor += 1
+            yield batch
+        self._end_epoch()
+
+
+class BucketedMiniBatchIterator(_ResumableIterator):
+    """Mini-batch iterator over variable-length sequences, with bucketing.
+
+    The sequences are grouped into buckets of similar lengths, and each
+    mini-batch is taken from only one bucket, and is padded to the maximum
+    length within this mini-batch.  This wastes much less computation on
+    the padding than padding every mini-batch to the global maximum length.
+
+        it = BucketedMiniBatchIterator(
+            sequences, batch_size=32, bucket_boundaries=[10, 20, 40],
+            arrays=[labels], return_mask=True)
+        for epoch in loop.iter_epochs():
+            for step, (x, length, mask, y) in loop.iter_steps(it):
+                ...
+            loop.add_metrics(padding_efficiency=it.padding_efficiency)
+
+    Each time this object is iterated, it iterates through one epoch.
+    If `shuffle` is True, the sequences within each bucket are shuffled,
+    and the mini-batches of all buckets are shuffled together, so that the
+    training stays stochastic.  The mini-batches are gathered into
+    pre-allocated buffers (one group for each bucket), and the yielded
+    arrays will be overwritten by later mini-batches of the same bucket.
+
+    Parameters
+    ----------
+    sequences : list[np.ndarray]
+        The sequences, each of which is an array of shape ``(length, ...)``.
+        The trailing dimensions and the dtype of all sequences must agree.
+
+    batch_size : int
+        Size of each mini-batch.
+
+    bucket_boundaries : list[int]
+        The ascending inclusive upper bounds of the sequence lengths in
+        each bucket.  Sequences longer than the last boundary are put
+        into an extra bucket.
+
+    arrays : collections.Iterable[np.ndarray]
+        Optional arrays aligned with `sequences` (e.g., the labels),
+        which should be yielded along with the padded sequences.
+
+    pad_value : any
+        The value for padding. (default 0)
+
+    return_mask : bool
+        Whether or not to yield the mask of the padded sequences, where
+        1 indicates an item in the sequence and 0 indicates padding?
+        (default False)
+
+    shuffle : bool
+        Whether or not to shuffle the data at each epoch? (default True)
+
+    ignore_incomplete_batch : bool
+        Whether or not to ignore the final batch of each bucket if it
+        contains less than ``batch-size`` number of items?  (default False)
+
+    random_state : np.random.RandomState
+        Optional random state for shuffling.
+        If not specified, will use the global random state of NumPy.
+
+    rank, world_size : int
+        If `world_size` is larger than 1, yield only the `rank`-th of every
+        `world_size` mini-batches of each epoch, for data-parallel training
+        in several processes.  (default 0 and 1)
+
+        The remaining mini-batches, which are less than `world_size`, are
+        skipped in that epoch, so that every worker has the same number of
+        mini-batches.  If `shuffle` is True, `random_state` must be
+        specified, and must be seeded identically in all the workers.
+
+    Yields
+    ------
+    tuple[np.ndarray]
+        The padded sequences of shape ``(batch_size, max_length, ...)``,
+        the lengths of shape ``(batch_size,)``, the mask of shape
+        ``(batch_size, max_length)`` if `return_mask` is True, and
+        the mini-batches of `arrays`.
+    """
+
+    def __init__(self, sequences, batch_size, bucket_boundaries, arrays=None,
+                 pad_value=0, return_mask=False, shuffle=True,
+                 ignore_incomplete_batch=False, random_state=None, rank=0,
+                 world_size=1):
+        sequences = [np.asarray(seq) for seq in sequences]
+        if not sequences:
+            raise ValueError('`sequences` must not be empty.')
+        if batch_size < 1:
+            raise ValueError('`batch_size` must be at least 1.')
+        _check_rank(rank, world_size)
+        if shuffle and world_size > 1 and random_state is None:
+            raise ValueError('`random_state` must be specified when '
+                             '`shuffle` is True and `world_size` > 1.')
+        bucket_boundaries = np.asarray(bucket_boundaries, dtype=np.int64)
+        if len(bucket_boundaries) < 1 or \
+                np.any(bucket_boundaries[1:] <= bucket_boundaries[:-1]):
+            raise ValueError('`bucket_boundaries` must be a non-empty '
+                             'ascending list.')
+        arrays = tuple(arrays or ())
+        _check_arrays_length((sequences,) + arrays)
+
+        # store the sequences in a flat array, with the offsets
+        item_shape = sequences[0].shape[1:]
+        for seq in sequences:
+            if seq.shape[1:] != item_shape:
+                raise ValueError('The trailing dimensions of `sequences` '
+                                 'do not agree.')
+        self._lengths = np.asarray([len(seq) for seq in sequences],
+                                   dtype=np.int64)
+        self._offsets = np.concatenate([[0], np.cumsum(self._lengths)])
+        self._flat = np.concatenate(sequences, axis=0)
+        self._item_shape = item_shape
+
+        # assign the sequences to buckets
+        bucket_ids = np.searchsorted(bucket_boundaries, self._lengths)
+        self._buckets = [
+            np.where(bucket_ids == i)[0]
+            for i in range(len(bucket_boundaries) + 1)
+        ]
+
+        self._arrays = arrays
+        self._batch_size = batch_size
+        self._bucket_boundaries = bucket_boundaries
+        self._pad_value = pad_value
+        self._return_mask = return_mask
+        self._shuffle = shuffle
+        self._ignore_incomplete_batch = ignore_incomplete_batch
+        self._random_state = random_state
+        self._rank = rank
+        self._world_size = world_size
+        self._buffers = {}
+        self._padding_efficiency = None
+
+    @property
+    def data_count(self):
+        """Get the number of sequences."""
+        return len(self._lengths)
+
+    @property
+    def batch_size(self):
+        """Get the size of each mini-batch."""
+        return self._batch_size
+
+    @property
+    def bucket_boundaries(self):
+        """Get the inclusive upper bounds of the sequence lengths."""
+        return self._bucket_boundaries
+
+    @property
+    def bucket_sizes(self):
+        """Get the number of sequences in each bucket (including the extra
+        bucket for sequences longer than the last boundary)."""
+        return [len(b) for b in self._buckets]
+
+    @property
+    def padding_efficiency(self):
+        """Get the ratio of the sequence items to the padded items, in the
+        last (or current) epoch.  Returns None if not iterated yet."""
+        return self._padding_efficiency
+
+    def _get_buffers(self, bucket):
+        """Get the buffers of specified bucket."""
+        if bucket not in self._buffers:
+            max_length = int(np.max(self._lengths[self._buckets[bucket]]))
+            padded = np.empty(
+                (self._batch_size, max_length) + self._item_shape,
+                dtype=self._flat.dtype
+            )
+            lengths = np.empty((self._batch_size,), dtype=np.int32)
+            mask = np.empty((self._batch_size, max_length), dtype=np.float32)
+            extra = tuple(
+                np.empty((self._batch_size,) + a.shape[1:], dtype=a.dtype)
+                for a in self._arrays
+            )
+            self._buffers[bucket] = (padded, lengths, mask, extra)
+        return self._buffers[bucket]
+
+    def _gather(self, bucket, indices):
+        """Gather the mini-batch of `bucket` at `indices`."""
+        padded, lengths, mask, extra = self._get_buffers(bucket)
+        count = len(indices)
+        batch_lengths = self._lengths[indices]
+        max_length = int(np.max(batch_lengths))
+
+        padded = padded[:count, :max_length]
+        padded.fill(self._pad_value)
+        for i, (idx, length) in enumerate(zip(indices, batch_lengths)):
+            start = self._offsets[idx]
+            padded[i, :length] = self._flat[start: start + length]
+        lengths = lengths[:count]
+        lengths[:] = batch_lengths
+
+        ret = [padded, lengths]
+        if self._return_mask:
+            mask = mask[:count, :max_length]
+            np.less(np.arange(max_length).reshape([1, -1]),
+                    batch_lengths.reshape([-1, 1]), out=mask, casting='unsafe')
+            ret.append(mask)
+        for a, b in zip(self._arrays, extra):
+            b = b[:count]
+            np.take(a, indices, axis=0, out=b, mode='clip')
+            ret.append(b)
+        return tuple(ret), count * max_length
+
+    def __iter__(self):
+        skip = self._begin_epoch()
+        random_state = self._epoch_random_state() if self._shuffle else None
+
+        # generate the mini-batches of all buckets
+        batches = []
+        for bucket, bucket_indices in enumerate(self._buckets):
+            if self._shuffle:
+                bucket_indices = random_state.permutation(bucket_indices)
+            for s in minibatch_slices_iterator(
+                    len(bucket_indices), self._batch_size,
+                    ignore_incomplete_batch=self._ignore_incomplete_batch):
+                batches.append((bucket, bucket_indices[s]))
+        if self._shuffle:
+            batches = [batches[i]
+                       for i in random_state.permutation(len(batches))]
+        if self._world_size > 1:
+            # take every `world_size` mini-batches, dropping the remainder
+            count = len(batches) // self._world_size * self._world_size
+            batches = batches[self._rank: count: self._world_size]
+
+        # iterate through the mini-batches
+        item_count = 0
+        padded_count = 0
+        for bucket, indices in batches[skip:]:
+            batch, batch_padded_count = self._gather(bucket, indices)
+            item_count += int(np.sum(self._lengths[indices]))
+            padded_count += batch_padded_count
+            if padded_count > 0:
+                self._padding_efficiency = float(item_count) / padded_count
+            self._cursor += 1
+            yield batch
+        self._end_epoch()
+
+
+def _open_shard(files):
+    """Open the arrays of a shard lazily, memory-mapping ".npy" files."""
+    arrays = []
+    for path in files:
+        if path.endswith('.npz'):
+            # arrays in ".npz" files cannot be memory-mapped, thus they
+            # are read into memory only when the shard is opened
+            with np.load(path) as npz:
+                arrays.extend(npz[k] for k in npz.files)
+        else:
+            arrays.append(np.load(path, mmap_mode='r'))
+    return tuple(arrays)
+
+
+class ShardedDataset(object):
+    """Dataset of aligned arrays, stored in many ".npy" or ".npz" shards.
+
+    Constructing this dataset only records the paths of the shard files.
+    The shards are opened lazily (memory-mapped for ".npy" files) during
+    iteration, and only `num_open_shards` shards are open at the same time,
+    thus the startup time and the memory usage do not depend on the total
+    size of the dataset.
+
+        dataset = ShardedDataset(sorted(glob.glob('data/part-*.npy')))
+        train_iterator = dataset.iterator(batch_size=64, num_open_shards=4)
+        for epoch in loop.iter_epochs():
+            for step, (x,) in loop.iter_steps(train_iterator):
+                ...
+
+    Parameters
+    ----------
+    shards : collections.Iterable[str | tuple[str]]
+        The shard files.  Each shard may be a ".npy" file, which holds one
+        array; or a ".npz" file, which holds the arrays in the order of its
+        keys; or a tuple of such files, whose arrays are concatenated.
+        All the shards must provide the same number of aligned arrays.
+    """
+
+    def __init__(self, shards):
+        shards = [
+            (s,) if isinstance(s, six.string_types) else tuple(s)
+            for s in shards
+        ]
+        if not shards:
+            raise ValueError('`shards` must not be empty.')
+        self._shards = shards
+
+    @property
+    def shards(self):
+        """Get the files of each shard."""
+        return self._shards
+
+    def open_shard(self, index):
+        """Open the arrays of the `index`-th shard.
+
+        Returns
+        -------
+        tuple[np.ndarray]
+            The (memory-mapped if possible) arrays of the shard.
+        """
+        return _open_shard(self._shards[index])
+
+    def iterator(self, batch_size, shuffle=True, num_open_shards=4,
+                 ignore_incomplete_batch=False, random_state=None, rank=0,
+                 world_size=1):
+        """Get a mini-batch iterator over this dataset.
+
+        Parameters
+        ----------
+        batch_size : int
+            Size of each mini-batch.  Each mini-batch is taken from only
+            one shard, thus the final mini-batch of each shard may contain
+            less than `batch_size` items.
+
+        shuffle : bool
+            Whether or not to shuffle the data at each epoch? (default True)
+
+            If True, the order of the shards is shuffled at each epoch,
+            the mini-batches are drawn from `num_open_shards` concurrently
+            open shards in random interleaving, and the data within each
+            shard are shuffled.  Otherwise the shards are iterated one
+            after another, yielding read-only views of the arrays.
+
+        num_open_shards : int
+            Number of shards to be interleaved. (default 4)
+
+        ignore_incomplete_batch : bool
+            Whether or not to ignore the final batch of each shard if it
+            contains less than ``batch-size`` number of items?
+            (default False)
+
+        random_state : np.random.RandomState
+            Optional random state for shuffling.
+            If not specified, will use the global random state of NumPy.
+
+        rank, world_size : int
+            If `world_size` is larger than 1, iterate only through the
+            `rank`-th of `world_size` disjoint shards of each file shard
+            (see `MiniBatchIterator`), for data-parallel training in
+            several processes.  (default 0 and 1)
+
+            All the workers open the same file shards in the same order,
+            and have the same number of mini-batches.  If `shuffle` is
+            True, `random_state` must be specified, and must be seeded
+            identically in all the workers.
+
+        Returns
+        -------
+        _ShardedMiniBatchIterator
+            The mini-batch iterator.
+        """
+        return _ShardedMiniBatchIterator(
+            self, batch_size=batch_size, shuffle=shuffle,
+            num_open_shards=num_open_shards,
+            ignore_incomplete_batch=ignore_incomplete_batch,
+            random_state=random_state, rank=rank, world_size=world_size
+        )
+
+
+class _ShardedMiniBatchIterator(_ResumableIterator):
+    """Mini-batch iterator of `ShardedDataset`."""
+
+    def __init__(self, dataset, batch_size, shuffle, num_open_shards,
+                 ignore_incomplete_batch, random_state, rank, world_size):
+        if num_open_shards < 1:
+            raise ValueError('`num_open_shards` must be at least 1.')
+        _check_rank(rank, world_size)
+        if shuffle and world_size > 1 and random_state is None:
+            raise ValueError('`random_state` must be specified when '
+                             '`shuffle` is True and `world_size` > 1.')
+        self._rank = rank
+        self._world_size = world_size
+        self._dataset = dataset
+        self._batch_size = batch_size
+        self._shuffle = shuffle
+        self._num_open_shards = num_open_shards
+        self._ignore_incomplete_batch = ignore_incomplete_batch
+        self._random_state = random_state
+
+    @property
+    def batch_size(self):
+        """Get the size of each mini-batch."""
+        return self._batch_size
+
+    def _open(self, index, random_state):
+        """Open the `index`-th shard.
+
+        Returns
+        -------
+        list
+            The mini-batch iterator of the shard, the seed of its epoch,
+            the number of its mini-batches which have been taken, and its
+            batch generator (None if not started).
+        """
+        it = MiniBatchIterator(
+            self._dataset.open_shard(index),
+            batch_size=self._batch_size,
+            shuffle=self._shuffle,
+            ignore_incomplete_batch=self._ignore_incomplete_batch,
+            use_views=not self._shuffle,
+            # the epoch seed of the shard is specified by `set_state`
+            random_state=random_state,
+            rank=self._rank,
+            world_size=self._world_size
+        )
+        if random_state is not None:
+            seed = int(random_state.randint(0, 2 ** 31 - 1))
+        else:
+            seed = None
+        return [it, seed, 0, None]
+
+    def __iter__(self):
+        skip = self._begin_epoch()
+        shard_count = len(self._dataset.shards)
+        if self._shuffle:
+            random_state = self._epoch_random_state()
+            shard_order = list(random_state.permutation(shard_count))
+            num_open_shards = self._num_open_shards
+        else:
+            random_state = None
+            shard_order = list(range(shard_count))
+            num_open_shards = 1
+        shard_order.reverse()   # so that we can pop the next shard
+
+        # All the random choices are made in the same order, no matter
+        # whether or not a mini-batch is skipped by a resumed epoch, thus
+        # the skipped mini-batches need not to be actually gathered.
+        open_shards = []
+        while open_shards or shard_order:
+            # open more shards until reaching `num_open_shards`
+            while shard_order and len(open_shards) < num_open_shards:
+                open_shards.append(self._open(shard_order.pop(),
+                                              random_state))
+
+            # draw a mini-batch from a random open shard
+            if random_state is not None:
+                i = random_state.randint(len(open_shards))
+            else:
+                i = 0
+            shard = open_shards[i]
+            it, seed, count, generator = shard
+            if count >= it.num_batches:
+                # close the exhausted shard, releasing the memory-map
+                del open_shards[i]
+                continue
+            shard[2] += 1
+            if skip > 0:
+                skip -= 1
+                continue
+            if generator is None:
+                it.set_state({'epoch_seed': seed, 'cursor': count})
+                shard[3] = generator = iter(it)
+            batch = next(generator)
+            self._cursor += 1
+            yield batch
+        self._end_epoch()
+
+
+class _SumTree(object):
+    """Binary tree of the partial sums of weights, stored in a flat array.
+
+    The tree is an implicit complete binary tree of ``2 * n`` nodes, where
+    the leaves (i.e., the weights) are stored at ``[n, 2 * n)``, and each
+    internal node ``i`` stores the sum of its children ``2 * i`` and
+    ``2 * i + 1``.  Both sampling and updating are vectorized over a
+    mini-batch of indices, each of which takes ``O(log n)`` operations.
+    """
+
+    def __init__(self, weights):
+        count = len(weights)
+        self._count = count
+        # the depth of the deepest leaves
+        self._depth = (2 * count - 1).bit_length() - 1
+        self._tree = np.zeros([2 * count], dtype=np.float64)
+        self._tree[count:] = weights
+
+        # build the internal nodes in blocks, whose children are all
+        # beyond the block, thus have been built
+        stop = count
+        while stop > 1:
+            start = (stop + 1) // 2
+            self._tree[start: stop] = (
+                self._tree[2 * start: 2 * stop: 2] +
+                self._tree[2 * start + 1: 2 * stop: 2]
+            )
+            stop = start
+
+    @property
+    def total(self):
+        """Get the sum of all the weights."""
+        return self._tree[1]
+
+    @property
+    def weights(self):
+        """Get the weights (a view of the leaves)."""
+        return self._tree[self._count:]
+
+    def update(self, indices, weights):
+        """Set the weights at `indices`, and update their ancestors."""
+        nodes = indices + self._count
+        self._tree[nodes] = weights
+        # the duplicated nodes at each round are assigned with equal sums,
+        # and each node is assigned for the last time after its children,
+        # even if the leaves are at different depths
+        nodes = nodes[nodes > 1] // 2
+        while len(nodes):
+            self._tree[nodes] = \
+                self._tree[2 * nodes] + self._tree[2 * nodes + 1]
+            nodes = nodes[nodes > 1] // 2
+
+    def find(self, values):
+        """Find the indices of the leaves where the cumulative sums of the
+        weights exceed `values`, which must be within ``[0, total)``.
+
+        Subtrees with zero sums are never entered, thus the zero-weight
+        leaves will not be found even if `values` suffer from rounding
+        errors, provided that `total` is positive.
+        """
+        values = np.array(values, dtype=np.float64)
+        nodes = np.ones([len(values)], dtype=np.int64)
+        for _ in range(self._depth):
+            internal = np.where(nodes < self._count)[0]
+            children = 2 * nodes[internal]
+            left = self._tree[children]
+            right = self._tree[children + 1]
+            go_right = (((values[internal] >= left) & (right > 0)) |
+                        (left <= 0))
+            values[internal] -= left * go_right
+            nodes[internal] = children + go_right
+        return nodes - self._count
+
+
+class WeightedMiniBatchSampler(MiniBatchIterator):
+    """Mini-batch sampler over several aligned arrays, with weighted items.
+
+    Each mini-batch is drawn independently, with replacement, where the
+    probability of each data item is proportional to its weight.  The
+    weights are organized in a sum tree, such that both drawing a
+    mini-batch and updating the weights of a mini-batch (e.g., according
+    to the per-item losses) take ``O(batch_size * log(n))`` operations,
+    without rebuilding the whole table.  For example:
+
+        sampler = WeightedMiniBatchSampler(
+            [train_x, train_y], batch_size=64, weights=initial_weights,
+            return_indices=True)
+        for epoch in loop.iter_epochs():
+            for step, (x, y, indices) in loop.iter_steps(sampler):
+                losses, _ = session.run(
+                    [per_item_loss, train_op], feed_dict={
+                        input_x: x, input_y: y,
+                        importance: sampler.get_importance_weights(indices)
+                    })
+                sampler.update_weights(indices, losses + 1e-3)
+
+    The mini-batches are gathered into the pre-allocated buffers, just as
+    the shuffled `MiniBatchIterator`.  `get_state` and `set_state` are also
+    supported, but the weights are not included in the state, thus should
+    be saved and restored separately for exact resuming.
+
+    Parameters
+    ----------
+    arrays : collections.Iterable[np.ndarray]
+        The arrays to be sampled, whose lengths must be equal.
+
+    batch_size : int
+        Size of each mini-batch.
+
+    weights : np.ndarray
+        The non-negative weights of the data items.  If not specified,
+        all the data items will have equal weights.
+
+    num_batches : int
+        Number of mini-batches in each epoch.  If not specified, will be
+        ``ceil(n / batch_size)``, where ``n`` is the number of data items.
+
+    return_indices : bool
+        Whether or not to append the indices of the mini-batch to each
+        yielded tuple? (default False)
+
+    num_buffers, random_state
+        Other arguments passed to `MiniBatchIterator`.
+    """
+
+    def __init__(self, arrays, batch_size, weights=None, num_batches=None,
+                 return_indices=False, num_buffers=1, random_state=None):
+        super(WeightedMiniBatchSampler, self).__init__(
+            arrays, batch_size=batch_size, shuffle=True,
+            num_buffers=num_buffers, random_state=random_state
+        )
+        if weights is None:
+            weights = np.ones([self._data_count], dtype=np.float64)
+        else:
+            weights = np.asarray(weights, dtype=np.float64).reshape([-1])
+            if len(weights) != self._data_count:
+                raise ValueError('The length of `weights` does not match '
+                                 '`arrays`.')
+            self._check_weights(weights)
+        if num_batches is None:
+            num_batches = (self._data_count + batch_size - 1) // batch_size
+        elif num_batches < 1:
+            raise ValueError('`num_batches` must be at least 1.')
+        self._tree = _SumTree(weights)
+        if not self._tree.total > 0:
+            raise ValueError('The sum of `weights` must be positive.')
+        self._num_batches = num_batches
+        self._return_indices = return_indices
+
+    @staticmethod
+    def _check_weights(weights):
+        if not np.all(np.isfinite(weights)) or np.any(weights < 0):
+            raise ValueError('`weights` must be non-negative and finite.')
+
+    @property
+    def num_batches(self):
+        """Get the number of mini-batches in an epoch."""
+        return self._num_batches
+
+    @property
+    def weights(self):
+        """Get the current weights of the data items (read-only view)."""
+        ret = self._tree.weights.view()
+        ret.flags.writeable = False
+        return ret
+
+    @property
+    def total_weight(self):
+        """Get the sum of the current weights."""
+        return float(self._tree.total)
+
+    def update_weights(self, indices, weights):
+        """Update the weights of the data items at `indices`.
+
+        Parameters
+        ----------
+        indices : np.ndarray
+            The indices of the data items (e.g., the indices of a
+            mini-batch).  If some index is duplicated, the last of its
+            weights will take effect.
+
+        weights : float | np.ndarray
+            The new non-negative weights of these data items.
+        """
+        indices = np.asarray(indices, dtype=np.int64).reshape([-1])
+        if len(indices) == 0:
+            return
+        if np.min(indices) < 0 or np.max(indices) >= self._data_count:
+            raise IndexError('`indices` out of range.')
+        weights = np.broadcast_to(
+            np.asarray(weights, dtype=np.float64), indices.shape)
+        self._check_weights(weights)
+        self._tree.update(indices, weights)
+
+    def get_importance_weights(self, indices):
+        """Get the importance weights of the data items at `indices`.
+
+        The importance weight of the ``i``-th item is ``1 / (n * p_i)``,
+        where ``p_i`` is its current sampling probability.  Scaling the
+        per-item losses by these weights gives an unbiased estimate of the
+        uniformly averaged loss.
+
+        Parameters
+        ----------
+        indices : np.ndarray
+            The indices of the data items.
+
+        Returns
+        -------
+        np.ndarray
+            The importance weights.
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        return (self._tree.total /
+                (self._data_count * self._tree.weights[indices]))
+
+    def _sample(self, random_state):
+        """Draw the indices of a mini-batch."""
+        if not self._tree.total > 0:
+            raise ValueError('The sum of `weights` must be positive.')
+        values = random_state.random_sample(self._batch_size)
+        values *= self._tree.total
+        return self._tree.find(values)
+
+    def __iter__(self):
+        skip = self._begin_epoch()
+        random_state = self._epoch_random_state()
+        for _ in range(skip):
+            random_state.random_sample(self._batch_size)
+        for _ in range(skip, self._num_batches):
+            indices = self._sample(random_state)
+            batch = self._gather(indices)
+            if self._return_indices:
+                batch = batch + (indices,)
+            self._cursor += 1
+            yield batch
+        self._end_epoch()
@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+import sys
+import threading
+
+import six
+import tensorflow as tf
+
+from .scope import VarScopeObject, lagacy_default_name_arg
+from .session import get_default_session_or_error
+
+__all__ = ['InputQueue']
+
+
+class InputQueue(VarScopeObject):
+    """In-graph input queue, fed by a Python mini-batch iterator.
+
+    This class turns any Python iterable of mini-batches (e.g., the
+    iterators in `tfsnippet.utils.datautils`) into input tensors, which
+    can be used to build the model without placeholders.  The mini-batches
+    are enqueued into a `tf.FIFOQueue` by a background thread, so that the
+    data is copied into the TensorFlow runtime and prefetched while the
+    previous training step is running, instead of being fed through the
+    `feed_dict` of every training step.
+
+        input_queue = InputQueue([tf.float32, tf.int32],
+                                 shapes=[[None, 784], [None]])
+        x, y = input_queue.inputs
+        loss = build_model(x, y)
+        train_op = optimizer.minimize(loss)
+
+        with train_loop(param_vars, max_epoch=10) as loop:
+            for epoch in loop.iter_epochs():
+                for step, _ in loop.iter_steps(
+                        input_queue.feed(train_iterator)):
+                    session.run(train_op)
+
+    The iterator returned by `feed` yields once for each mini-batch which
+    has been enqueued, and it stops after the last mini-batch of the source
+    iterable, so the epoch boundaries are visible to `_TrainLoop`.
+    Note that each ``session.run`` that evaluates `inputs` dequeues one
+    mini-batch, thus exactly one such ``session.run`` should be performed
+    for each yielded step.
+
+    Parameters
+    ----------
+    dtypes : list[tf.DType]
+        The data types of the arrays in each mini-batch.
+
+    shapes : list[tuple[int | None]]
+        Optional static shapes of the arrays, where the batch dimension
+        (and other dynamic dimensions) should be None.
+
+    capacity : int
+        Maximum number of mini-batches in the queue. (default 4)
+
+    name, scope : str
+        Optional name and scope of this input queue.
+    """
+
+    #: Timeout in milliseconds of each enqueue operation.  The feeding
+    #: thread checks whether or not it should stop after each timeout.
+    ENQUEUE_TIMEOUT_MS = 100
+
+    @lagacy_default_name_arg
+    def __init__(self, dtypes, shapes=None, capacity=4, name=None,
+                 scope=None):
+        dtypes = [tf.as_dtype(t) for t in dtypes]
+        if shapes is None:
+            shapes = [None] * len(dtypes)
+        shapes = list(shapes)
+        if len(shapes) != len(dtypes):
+            raise ValueError('The length of `shapes` does not match '
+                             '`dtypes`.')
+        if capacity < 1:
+            raise ValueError('`capacity` must be at least 1.')
+        super(InputQueue, self).__init__(name=name, scope=scope)
+
+        self._dtypes = dtypes
+        self._capacity = capacity
+        with tf.variable_scope(self.variable_scope):
+            self._placeholders = [
+                tf.placeholder(dtype=t, shape=s, name='input_%d' % i)
+                for i, (t, s) in enumerate(zip(dtypes, shapes))
+            ]
+            self._queue = tf.FIFOQueue(capacity, dtypes, name='queue')
+            self._enqueue_op = self._queue.enqueue(self._placeholders)
+            inputs = self._queue.dequeue()
+            if not isinstance(inputs, (tuple, list)):
+                inputs = [inputs]
+            for t, p in zip(inputs, self._placeholders):
+                t.set_shape(p.get_shape())
+            self._inputs = tuple(inputs)
+            self._size_op = self._queue.size()
+
+    @property
+    def dtypes(self):
+        """Get the data types of the arrays in each mini-batch."""
+        return self._dtypes
+
+    @property
+    def capacity(self):
+        """Get the maximum number of mini-batches in the queue."""
+        return self._capacity
+
+    @property
+    def inputs(self):
+        """Get the input tensors, dequeued from the queue.
+
+        Returns
+        -------
+        tuple[tf.Tensor]
+            The input tensors, one for each array in a mini-batch.
+        """
+        return self._inputs
+
+    def size(self, session=None):
+        """Get the number of mini-batches in the queue."""
+        session = session or get_default_session_or_error()
+        return session.run(self._size_op)
+
+    def feed(self, iterable, session=None):
+        """Feed the mini-batches of `iterable` into the queue.
+
+        Parameters
+        ----------
+        iterable : collections.Iterable[tuple[np.ndarray]]
+            The mini-batches, each of which is a tuple of arrays.
+
+        session : tf.Session
+            The session to run the enqueue operation.
+            If not specified, use the active session.
+
+        Returns
+        -------
+        collections.Iterator[int]
+            The iterator which yields the index of each mini-batch, after
+            it has been enqueued.  The queue will be cleared if it is closed
+            before all the mini-batches are yielded.
+        """
+        session = session or get_default_session_or_error()
+        return _InputQueueFeeder(self, iterable, session)
+
+
+class _InputQueueFeeder(object):
+    """Iterator of the mini-batches fed into an `InputQueue`."""
+
+    def __init__(self, input_queue, iterable, session):
+        self._input_queue = input_queue
+        self._iterable = iterable
+        self._session = session
+        self._cond = threading.Condition()
+        self._thread = None
+        self._enqueued = 0
+        self._yielded = 0
+        self._finished = False
+        self._exc_info = None
+        self._closed = False
+
+    def _thread_main(self):
+        input_queue = self._input_queue
+        options = tf.RunOptions(
+            timeout_in_ms=input_queue.ENQUEUE_TIMEOUT_MS)
+        try:
+            for batch in self._iterable:
+                if not isinstance(batch, (tuple, list)):
+                    batch = (batch,)
+                feed_dict = dict(zip(input_queue._placeholders, batch))
+                while not self._closed:
+                    try:
+                        self._session.run(input_queue._enqueue_op,
+                                          feed_dict=feed_dict,
+                                          options=options)
+                    except tf.errors.DeadlineExceededError:
+                        continue
+                    else:
+                        break
+                if self._closed:
+                    break
+                with self._cond:
+                    self._enqueued += 1
+                    self._cond.notify_all()
+        except Exception:
+            self._exc_info = sys.exc_info()
+        finally:
+            with self._cond:
+                self._finished = True
+                self._cond.notify_all()
+
+    def close(self):
+        """Stop the feeding thread, and clear the queue."""
+        if self._closed:
+            return
+        self._closed = True
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+            # discard the mini-batches which are never consumed.  The
+            # counters may miss a mini-batch enqueued right before closing,
+            # or a yielded one never dequeued, thus the queue size is used,
+            # which is exact once the feeding thread has stopped.  The queue
+            # itself is not closed, so that it can be fed again.
+            input_queue = self._input_queue
+            for _ in range(input_queue.size(self._session)):
+                self._session.run(input_queue.inputs)
+        if hasattr(self._iterable, 'close'):
+            self._iterable.close()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._closed:
+            raise StopIteration()
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._thread_main,
+                                            name='InputQueueFeeder')
+            self._thread.daemon = True
+            self._thread.start()
+
+        with self._cond:
+            while self._enqueued <= self._yielded and not self._finished:
+                self._cond.wait()
+            has_batch = self._enqueued > self._yielded
+        if not has_batch:
+            exc_info = self._exc_info
+            self.close()
+            if exc_info is not None:
+                six.reraise(*exc_info)
+            raise StopIteration()
+        self._yielded += 1
+        return self._yielded - 1
+
+    next = __next__
@@ -12,7 +12,7 @@ __all__ = [
     'NOT_SPECIFIED',
     'is_integer', 'is_float', 'is_dynamic_tensor_like',
     'convert_to_tensor_if_dynamic', 'get_preferred_tensor_dtype',
-    'MetricAccumulator', 'humanize_duration',
+    'MetricAccumulator', 'LogBucketHistogram', 'humanize_duration',
     'unique', 'AutoReprObject', 'ContextStack', 'camel_to_underscore',
 ]
 
@@ -173,6 +173,237 @@ class MetricAccumulator(object):
         self._square += (value ** 2 - self._square) * discount
         self._counter += 1
 
+    def get_state(self):
+        """Get the JSON-compatible state of this accumulator.
+
+        Returns
+        -------
+        dict[str, any]
+            The state, which can be restored by `set_state`.
+        """
+        return {
+            'mean': float(self._mean),
+            'square': float(self._square),
+            'weight': float(self._weight),
+            'counter': int(self._counter),
+        }
+
+    def set_state(self, state):
+        """Restore the state of this accumulator.
+
+        Parameters
+        ----------
+        state : dict[str, any]
+            The state obtained by `get_state`.
+        """
+        self._mean = float(state['mean'])
+        self._square = float(state['square'])
+        self._weight = float(state['weight'])
+        self._counter = int(state['counter'])
+
+
+class LogBucketHistogram(object):
+    """Streaming histogram of non-negative values with logarithmic buckets.
+
+    The values within ``[min_value, max_value]`` are counted in buckets
+    whose boundaries grow geometrically, such that any quantile can be
+    estimated with bounded relative error `relative_accuracy`, using a
+    constant amount of memory.  Values below `min_value` are counted in a
+    single underflow bucket, while values above `max_value` are counted
+    in the last bucket.  The exact minimum and maximum values are tracked.
+    It is suitable for collecting the tail latency of timing metrics.
+
+    Parameters
+    ----------
+    relative_accuracy : float
+        The relative accuracy of the estimated quantiles. (default 0.01)
+
+    min_value, max_value : float
+        The range of values to be counted with bounded relative error.
+        (default 1e-6 and 1e6)
+    """
+
+    def __init__(self, relative_accuracy=0.01, min_value=1e-6, max_value=1e6):
+        if not 0 < relative_accuracy < 1:
+            raise ValueError('`relative_accuracy` must be in range (0, 1).')
+        if not 0 < min_value < max_value:
+            raise ValueError('`min_value` must be positive and less than '
+                             '`max_value`.')
+        self._relative_accuracy = relative_accuracy
+        self._gamma = (1. + relative_accuracy) / (1. - relative_accuracy)
+        self._log_gamma = math.log(self._gamma)
+        self._min_value = min_value
+        self._offset = int(math.ceil(math.log(min_value) / self._log_gamma))
+        # bucket 0 is the underflow bucket, while bucket i (i >= 1) counts
+        # the values in (gamma^(i + offset - 2), gamma^(i + offset - 1)]
+        self._num_buckets = 2 + int(math.ceil(
+            math.log(max_value) / self._log_gamma)) - self._offset
+        self._counts = np.zeros([self._num_buckets], dtype=np.int64)
+        self.reset()
+
+    @property
+    def relative_accuracy(self):
+        """Get the relative accuracy of the estimated quantiles."""
+        return self._relative_accuracy
+
+    @property
+    def num_buckets(self):
+        """Get the number of buckets."""
+        return self._num_buckets
+
+    @property
+    def count(self):
+        """Get the number of added values."""
+        return self._count
+
+    @property
+    def sum(self):
+        """Get the sum of added values."""
+        return self._sum
+
+    @property
+    def sum_squares(self):
+        """Get the sum of squares of added values."""
+        return self._sum_squares
+
+    @property
+    def min(self):
+        """Get the minimum of added values, or None if no value added."""
+        return self._min
+
+    @property
+    def max(self):
+        """Get the maximum of added values, or None if no value added."""
+        return self._max
+
+    def reset(self):
+        """Reset the histogram to initial state."""
+        self._counts.fill(0)
+        self._count = 0
+        self._sum = 0.
+        self._sum_squares = 0.
+        self._min = None
+        self._max = None
+
+    def _bucket_index(self, value):
+        if value < self._min_value:
+            return 0
+        index = int(math.ceil(math.log(value) / self._log_gamma)) - \
+            self._offset + 1
+        return min(index, self._num_buckets - 1)
+
+    def _bucket_upper_limit(self, index):
+        return self._gamma ** (index + self._offset - 1)
+
+    def add(self, value):
+        """Add a value to this histogram.
+
+        Parameters
+        ----------
+        value : float
+            The value to be collected, which should be non-negative.
+        """
+        value = float(value)
+        self._counts[self._bucket_index(value)] += 1
+        self._count += 1
+        self._sum += value
+        self._sum_squares += value * value
+        if self._min is None or value < self._min:
+            self._min = value
+        if self._max is None or value > self._max:
+            self._max = value
+
+    def quantile(self, q):
+        """Estimate the `q`-quantile of added values.
+
+        Parameters
+        ----------
+        q : float
+            The quantile, in range [0, 1].
+
+        Returns
+        -------
+        float | None
+            The estimated quantile, or None if no value has been added.
+        """
+        if not 0 <= q <= 1:
+            raise ValueError('`q` must be in range [0, 1].')
+        if not self._count:
+            return None
+        if q == 0:
+            return self._min
+        if q == 1:
+            return self._max
+        rank = q * (self._count - 1)
+        index = int(np.searchsorted(np.cumsum(self._counts), rank,
+                                    side='right'))
+        if index == 0:
+            value = self._min
+        else:
+            # the representative value of the bucket, whose relative error
+            # to any value in the bucket is at most `relative_accuracy`
+            value = 2. * self._bucket_upper_limit(index) / (self._gamma + 1)
+        return min(max(value, self._min), self._max)
+
+    def buckets(self):
+        """Get the non-empty buckets.
+
+        Returns
+        -------
+        list[(float, int)]
+            The upper limits and the counts of the non-empty buckets.
+            The upper limit of the last non-empty bucket is `max`.
+        """
+        ret = []
+        for index in np.nonzero(self._counts)[0]:
+            if index == 0:
+                limit = self._min_value
+            else:
+                limit = self._bucket_upper_limit(index)
+            ret.append((float(min(limit, self._max)),
+                        int(self._counts[index])))
+        if ret:
+            ret[-1] = (self._max, ret[-1][1])
+        return ret
+
+    def get_state(self):
+        """Get the JSON-compatible state of this histogram.
+
+        The configuration of the buckets is not included, thus the state
+        should only be restored into a histogram with the same arguments.
+
+        Returns
+        -------
+        dict[str, any]
+            The state, which can be restored by `set_state`.
+        """
+        indices = np.nonzero(self._counts)[0]
+        return {
+            'counts': [[int(i), int(self._counts[i])] for i in indices],
+            'count': self._count,
+            'sum': self._sum,
+            'sum_squares': self._sum_squares,
+            'min': self._min,
+            'max': self._max,
+        }
+
+    def set_state(self, state):
+        """Restore the state of this histogram.
+
+        Parameters
+        ----------
+        state : dict[str, any]
+            The state obtained by `get_state`.
+        """
+        self.reset()
+        for index, count in state['counts']:
+            self._counts[index] = count
+        self._count = int(state['count'])
+        self._sum = float(state['sum'])
+        self._sum_squares = float(state['sum_squares'])
+        self._min = state['min']
+        self._max = state['max']
+
 
 def humanize_duration(seconds):
     """Format specified time duration into human readable text.
@@ -1,5 +1,8 @@
 # -*- coding: utf-8 -*-
+import json
 import os
+import sys
+import threading
 
 import six
 import tensorflow as tf
@@ -206,14 +209,38 @@ class VariableSaver(VarScopeObject):
     save_meta : bool
         Whether or not to save meta graph (default is True).
 
+    state_objects : dict[str, any]
+        Optional dict of objects with ``get_state()`` and ``set_state(state)``
+        methods (e.g., the mini-batch iterators of `tfsnippet.utils`).
+        Their states will be saved as JSON into a file next to each
+        checkpoint, and be restored along with the variables.
+
+    async_save : bool
+        Whether or not to write the checkpoints in background? (default False)
+
+        If True, `save` only fetches the variable values into host memory
+        by one ``session.run``, and a background thread writes them to
+        disk, while the training continues.  At most one checkpoint can be
+        in flight: `save` blocks until the previous one has been written.
+        The files are written under temporary names, and renamed when
+        completed, before the checkpoint is registered in `latest_file`.
+        Call `wait` to ensure the last checkpoint has been written.
+
     name, scope : str
         Optional name and scope of this session restorer.
     """
 
+    #: Suffix of the file of object states, appended to the checkpoint path.
+    STATE_FILE_SUFFIX = '.state.json'
+
+    #: Suffix of the temporary files of a checkpoint being written.
+    TEMP_FILE_SUFFIX = '.tmp'
+
     @lagacy_default_name_arg
     def __init__(self, variables, save_dir, max_versions=2,
                  filename='variables.dat', latest_file='latest',
-                 save_meta=True, name=None, scope=None):
+                 save_meta=True, state_objects=None, async_save=False,
+                 name=None, scope=None):
         if not isinstance(variables, dict):
             variables = list(variables)
         if max_versions < 2:
@@ -225,48 +252,234 @@ class VariableSaver(VarScopeObject):
         self.max_versions = max_versions
         self.latest_file = latest_file
         self.save_meta = save_meta
+        self.state_objects = dict(state_objects or {})
+        self.async_save = async_save
         with tf.variable_scope(self.variable_scope):
             self._saver = tf.train.Saver(
                 var_list=self.variables, max_to_keep=self.max_versions,
                 name='saver'
             )
 
+        # the objects for writing checkpoints in background
+        self._async_writer = None
+        self._async_thread = None
+        self._async_exc_info = None
+        self._async_checkpoints = []
+
+        # recover the versions saved before, so that they can be purged
+        ckpt_state = tf.train.get_checkpoint_state(
+            self.save_dir, self.latest_file)
+        if ckpt_state is not None:
+            checkpoints = [
+                p if os.path.isabs(p) else os.path.join(self.save_dir, p)
+                for p in ckpt_state.all_model_checkpoint_paths
+            ]
+            self._async_checkpoints = checkpoints
+            self._saver.recover_last_checkpoints(checkpoints)
+
     def get_latest_file(self):
         """Get the latest available checkpoint file."""
         return tf.train.latest_checkpoint(self.save_dir, self.latest_file)
 
-    def save(self, global_step=None):
+    def _get_states(self):
+        """Get the states of `state_objects`."""
+        return {
+            name: obj.get_state()
+            for name, obj in six.iteritems(self.state_objects)
+        }
+
+    def save(self, global_step=None, session=None):
         """Save the checkpoint to file.
 
         Parameters
         ----------
         global_step : int | tf.Tensor
             The global step counter.
+
+        session : tf.Session
+            The session whose variable values should be saved.
+            If not specified, use the active session.
         """
-        sess = get_default_session_or_error()
+        sess = session or get_default_session_or_error()
         if not os.path.isdir(self.save_dir):
             os.makedirs(self.save_dir)
-        self._saver.save(
+        if self.async_save:
+            self._save_async(sess, global_step)
+            return
+        file_path = self._saver.save(
             sess,
             os.path.join(self.save_dir, self.filename),
             global_step=global_step,
             latest_filename=self.latest_file,
             write_meta_graph=self.save_meta
         )
+        if self.state_objects:
+            self._save_states(file_path, self._get_states(),
+                              self._saver.last_checkpoints)
+
+    def _get_async_writer(self):
+        """Get the shadow graph, session and saver, which write the variable
+        values in host memory as a checkpoint."""
+        if self._async_writer is None:
+            if isinstance(self.variables, dict):
+                items = sorted(six.iteritems(self.variables))
+            else:
+                items = [(v.op.name, v) for v in self.variables]
+            graph = tf.Graph()
+            with graph.as_default():
+                placeholders = []
+                shadow_vars = {}
+                for i, (key, var) in enumerate(items):
+                    ph = tf.placeholder(dtype=var.dtype.base_dtype,
+                                        shape=var.get_shape(),
+                                        name='value_%d' % i)
+                    placeholders.append(ph)
+                    shadow_vars[key] = tf.Variable(ph, name='var_%d' % i,
+                                                   trainable=False)
+                init_op = tf.variables_initializer(list(shadow_vars.values()))
+                # the checkpoint versions are managed by this class
+                saver = tf.train.Saver(var_list=shadow_vars, max_to_keep=0)
+            session = tf.Session(
+                graph=graph, config=tf.ConfigProto(device_count={'GPU': 0}))
+            self._async_writer = (
+                [v for _, v in items], placeholders, init_op, saver, session)
+        return self._async_writer
+
+    def _save_async(self, sess, global_step):
+        """Snapshot the variable values, and write them in background."""
+        self.wait()
+        variables, placeholders, init_op, saver, session = \
+            self._get_async_writer()
+        if isinstance(global_step, (tf.Tensor, tf.Variable)):
+            values, global_step = sess.run([variables, global_step])
+        else:
+            values = sess.run(variables)
+        states = self._get_states() if self.state_objects else None
+
+        # the default graph is thread-local, thus the meta graph must be
+        # exported from the graph of `sess` in the calling thread
+        meta_graph_def = None
+        if self.save_meta:
+            with sess.graph.as_default():
+                meta_graph_def = self._saver.export_meta_graph()
+
+        file_path = os.path.join(self.save_dir, self.filename)
+        if global_step is not None:
+            file_path = '%s-%d' % (file_path, global_step)
+
+        def write():
+            try:
+                session.run(init_op, feed_dict=dict(zip(placeholders, values)))
+                self._write_checkpoint(saver, session, file_path, states,
+                                       meta_graph_def)
+            except Exception:
+                self._async_exc_info = sys.exc_info()
+
+        self._async_thread = threading.Thread(
+            target=write, name='VariableSaverWriter')
+        self._async_thread.daemon = True
+        self._async_thread.start()
+
+    def _write_checkpoint(self, saver, session, file_path, states,
+                          meta_graph_def):
+        """Write the checkpoint files from the shadow `session`."""
+        temp_path = file_path + self.TEMP_FILE_SUFFIX
+        saver.save(session, temp_path, write_meta_graph=False,
+                   write_state=False)
+        if meta_graph_def is not None:
+            with tf.gfile.GFile(temp_path + '.meta', 'wb') as f:
+                f.write(meta_graph_def.SerializeToString())
+
+        # move the completed files to their final names
+        for path in tf.gfile.Glob(temp_path + '.*'):
+            os.rename(path, file_path + path[len(temp_path):])
+        if states is not None:
+            self._save_states(file_path, states, [])
+
+        # register the checkpoint, and purge the old versions
+        if file_path in self._async_checkpoints:
+            self._async_checkpoints.remove(file_path)
+        self._async_checkpoints.append(file_path)
+        while len(self._async_checkpoints) > self.max_versions:
+            old_path = self._async_checkpoints.pop(0)
+            for path in tf.gfile.Glob(old_path + '.*'):
+                os.remove(path)
+        tf.train.update_checkpoint_state(
+            self.save_dir, file_path,
+            all_model_checkpoint_paths=self._async_checkpoints,
+            latest_filename=self.latest_file
+        )
+
+    def wait(self):
+        """Wait for the checkpoint being written in background.
+
+        Raises
+        ------
+        Exception
+            The error raised when writing the checkpoint, if any.
+        """
+        if self._async_thread is not None:
+            self._async_thread.join()
+            self._async_thread = None
+        if self._async_exc_info is not None:
+            exc_info = self._async_exc_info
+            self._async_exc_info = None
+            six.reraise(*exc_info)
+
+    def _save_states(self, file_path, states, kept_checkpoints):
+        """Save `states` of `state_objects` along with `file_path`."""
+        state_file = file_path + self.STATE_FILE_SUFFIX
+        temp_file = state_file + '.tmp'
+        with open(temp_file, 'w') as f:
+            json.dump(states, f)
+        if os.path.exists(state_file):
+            os.remove(state_file)
+        os.rename(temp_file, state_file)
+
+        # purge the state files of the checkpoints deleted by the saver
+        if kept_checkpoints:
+            kept_files = set(
+                os.path.abspath(p) + self.STATE_FILE_SUFFIX
+                for p in kept_checkpoints
+            )
+            for name in os.listdir(self.save_dir):
+                path = os.path.join(self.save_dir, name)
+                if name.startswith(self.filename) and \
+                        name.endswith(self.STATE_FILE_SUFFIX) and \
+                        path not in kept_files:
+                    os.remove(path)
+
+    def _restore_states(self, file_path):
+        """Restore the states of `state_objects` saved along with
+        `file_path`, if the state file exists."""
+        state_file = file_path + self.STATE_FILE_SUFFIX
+        if not os.path.isfile(state_file):
+            return
+        with open(state_file, 'r') as f:
+            states = json.load(f)
+        for name, obj in six.iteritems(self.state_objects):
+            if name in states:
+                obj.set_state(states[name])
 
     def restore(self, ignore_non_exist=True):
         """Restore the checkpoint from file if it exists.
 
+        If a checkpoint is being written in background, this method will
+        wait for it before restoring.
+
         Parameters
         ----------
         ignore_non_exist : bool
             Whether or not to ignore error if the saved file does not exist?
             (default True)
         """
+        self.wait()
         file_path = self.get_latest_file()
         if file_path:
             sess = get_default_session_or_error()
             self._saver.restore(sess, file_path)
+            if self.state_objects:
+                self._restore_states(file_path)
             getLogger(__name__).debug(
                 'Restored from checkpoint file %r.', file_path)
         elif not ignore_non_exist: